@@ -14,16 +14,58 @@ Rules:
 from __future__ import annotations
 
 import argparse
+import codecs
+import cProfile
+import csv
 import datetime as dt
+import hashlib
+import io
+import json
+import os
+import pickle
+import posixpath
+import pstats
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+import zipfile
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field, replace
+from decimal import Decimal
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence
+from types import MemberDescriptorType
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from xml.etree import ElementTree
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
 
 from openpyxl import load_workbook
-from openpyxl.formula.translate import Translator
+from openpyxl.cell.cell import ERROR_CODES, ILLEGAL_CHARACTERS_RE, Cell, get_time_format
+from openpyxl.compat import safe_string
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.formula.translate import Translator, TranslatorError
 from openpyxl.styles import PatternFill, Font, Alignment, alignment
-from openpyxl.formatting.rule import FormulaRule
-from openpyxl.utils import column_index_from_string, get_column_letter
-from openpyxl.utils.datetime import from_excel
+from openpyxl.formatting.rule import FormulaRule, Rule
+from openpyxl.styles.differential import DifferentialStyle
+from openpyxl.workbook.defined_name import DefinedName
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.styles.numbers import BUILTIN_FORMATS, BUILTIN_FORMATS_REVERSE, is_date_format, is_timedelta_format
+from openpyxl.utils import column_index_from_string, get_column_letter, quote_sheetname, range_boundaries
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel, from_ISO8601, to_excel
+from openpyxl.utils.exceptions import IllegalCharacterError
+from openpyxl.xml.functions import tostring
 
 # === 常量 ===
 
@@ -33,8 +75,16 @@ SHEET_ASSET_DETAIL = "资产明细"
 SHEET_ZHONGDENG = "中登登记表"
 SHEET_CUSTOMER = "客户表"
 SHEET_INTEREST = "利息缴纳"
+LEDGER_TARGET_SHEETS = (SHEET_FINANCING_REPAYMENT, SHEET_ASSET_DETAIL, SHEET_ZHONGDENG, SHEET_CUSTOMER, SHEET_INTEREST)
 CUSTOMER_SOURCE_SHEET = "sheet1"
 
+# 并发读取数据源时的最大进程数（放款、保理、再保理、中登、客户表）
+INGEST_MAX_WORKERS = 4
+
+# 还款明细 AB 列费用类型
+FEE_TYPE_PRINCIPAL = "本金"
+FEE_TYPE_INTEREST = "资金费"
+
 # 目标表列
 COL_A = column_index_from_string("A")
 COL_B = column_index_from_string("B")
@@ -172,18 +222,156 @@ CUSTOMER_SRC_COL_LEGAL_REP = column_index_from_string("I")
 CUSTOMER_SRC_COL_LEGAL_ID = column_index_from_string("J")
 CUSTOMER_SRC_COL_REGION = column_index_from_string("L")
 
+# 各数据源实际用到的列（流式读取时只构造这些列）
+LOAN_SOURCE_COLUMNS = (
+    LOAN_COL_B, LOAN_COL_C, LOAN_COL_D, LOAN_COL_E, LOAN_COL_F, LOAN_COL_G, LOAN_COL_J, LOAN_COL_K,
+    LOAN_COL_L, LOAN_COL_M, LOAN_COL_N, LOAN_COL_P, LOAN_COL_Q, LOAN_COL_S, LOAN_COL_T, LOAN_COL_U,
+    LOAN_COL_Y, LOAN_COL_AA, LOAN_COL_AC, LOAN_COL_AE, LOAN_COL_AF, LOAN_COL_AG, LOAN_COL_AH,
+    LOAN_COL_AI, LOAN_COL_AJ, LOAN_COL_AK, LOAN_COL_AL, LOAN_COL_AM, LOAN_COL_AN, LOAN_COL_AO,
+    LOAN_COL_AQ, LOAN_COL_AR, LOAN_COL_AW, LOAN_COL_AZ, LOAN_COL_BC, LOAN_COL_BF,
+)
+REPAY_SOURCE_COLUMNS = (
+    REPAY_COL_B, REPAY_COL_C, REPAY_COL_F, REPAY_COL_G, REPAY_COL_H, REPAY_COL_J, REPAY_COL_M,
+    REPAY_COL_O, REPAY_COL_X, REPAY_COL_Y, REPAY_COL_AB, REPAY_COL_AC, REPAY_COL_AD, REPAY_COL_AE,
+    REPAY_COL_AG, REPAY_COL_AH,
+)
+ZD_SOURCE_COLUMNS = (
+    ZD_COL_C, ZD_COL_D, ZD_COL_E, ZD_COL_F, ZD_COL_G, ZD_COL_H, ZD_COL_I, ZD_COL_J, ZD_COL_K,
+    ZD_COL_L, ZD_COL_M, ZD_COL_N, ZD_COL_O, ZD_COL_P, ZD_COL_R, ZD_COL_S, ZD_COL_T, ZD_COL_U,
+    ZD_COL_W, ZD_COL_X, ZD_COL_Y,
+)
+CUSTOMER_SOURCE_COLUMNS = (
+    CUSTOMER_SRC_COL_NAME, CUSTOMER_SRC_COL_CODE, CUSTOMER_SRC_COL_INDUSTRY, CUSTOMER_SRC_COL_ECONOMIC,
+    CUSTOMER_SRC_COL_SCALE, CUSTOMER_SRC_COL_REGISTER_ADDR, CUSTOMER_SRC_COL_BUSINESS_ADDR,
+    CUSTOMER_SRC_COL_ROLE, CUSTOMER_SRC_COL_LEGAL_REP, CUSTOMER_SRC_COL_LEGAL_ID, CUSTOMER_SRC_COL_REGION,
+)
+
+
+# === 数据源记录 ===
+
+def source_fields(columns: Sequence[int]) -> tuple:
+    return tuple(get_column_letter(col_idx) for col_idx in columns)
+
+
+class SourceRecord:
+    """
+    数据源一行的紧凑投影：只保存 COLUMNS 中的列，字段按源文件列字母命名（record.AE 即 AE 列），
+    与说明文档和 *_COL_* 常量的写法一致。
+    使用 __slots__ 而不是按最大列号补齐的元组：放款明细每行只保留实际读取的 36 列（而非 58 个位置），
+    也没有逐行的 __dict__；跨进程与写入缓存时按取值元组序列化。
+    """
+
+    __slots__ = ()
+    COLUMNS: tuple = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._pick = itemgetter(*(col_idx - 1 for col_idx in cls.COLUMNS))
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_row(cls, row: Sequence) -> "SourceRecord":
+        """ 由 iter_source_rows 的行元组投影（行元组已按请求列的最大序号补齐） """
+        return cls(*cls._pick(row))
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __reduce__(self):
+        return self.__class__, self.values()
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.values() == other.values()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+
+class LoanRecord(SourceRecord):
+    """ 放款明细一行 """
+    COLUMNS = LOAN_SOURCE_COLUMNS
+    __slots__ = source_fields(LOAN_SOURCE_COLUMNS)
+
 
-def parse_args() -> argparse.Namespace:
+class RepayRecord(SourceRecord):
+    """ 保理 / 再保理融资还款明细一行 """
+    COLUMNS = REPAY_SOURCE_COLUMNS
+    __slots__ = source_fields(REPAY_SOURCE_COLUMNS)
+
+
+class ZhongdengRecord(SourceRecord):
+    """ 中登登记表导出一行 """
+    COLUMNS = ZD_SOURCE_COLUMNS
+    __slots__ = source_fields(ZD_SOURCE_COLUMNS)
+
+
+class CustomerRecord(SourceRecord):
+    """ 下载客户表（sheet1）一行 """
+    COLUMNS = CUSTOMER_SOURCE_COLUMNS
+    __slots__ = source_fields(CUSTOMER_SOURCE_COLUMNS)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Append ledger financing & repayment rows.")
     parser.add_argument("--ledger", required=True, help="现有台账文件路径")
-    parser.add_argument("--loan", required=True, help="放款明细路径")
-    parser.add_argument("--factoring-repay", required=True, help="保理融资还款明细路径")
-    parser.add_argument("--refactoring-repay", required=True, help="再保理融资还款明细路径")
-    parser.add_argument("--zhongdeng", required=True, help="中登登记表路径")
-    parser.add_argument("--customer", required=True, help="客户表路径（下载版）")
-    parser.add_argument("--date", required=True, help="目标日期，格式 YYYYMMDD")
-    parser.add_argument("--output", required=True, help="输出文件路径")
-    return parser.parse_args()
+    parser.add_argument("--loan", required=True, help="放款明细路径（xlsx / csv / parquet）")
+    parser.add_argument("--factoring-repay", required=True, help="保理融资还款明细路径（xlsx / csv / parquet）")
+    parser.add_argument("--refactoring-repay", required=True, help="再保理融资还款明细路径（xlsx / csv / parquet）")
+    parser.add_argument("--zhongdeng", required=True, help="中登登记表路径（xlsx / csv / parquet）")
+    parser.add_argument("--customer", required=True, help="客户表路径（下载版，xlsx / csv / parquet）")
+    parser.add_argument("--date", action="append", default=[], help="目标日期，格式 YYYYMMDD；可重复指定以一次补录多天")
+    parser.add_argument("--date-from", default=None, help="补录起始日期（含），格式 YYYYMMDD，需与 --date-to 同时使用")
+    parser.add_argument("--date-to", default=None, help="补录结束日期（含），格式 YYYYMMDD")
+    parser.add_argument("--output", default=None, help="输出文件路径（--dry-run 时不需要）")
+    parser.add_argument("--cache-dir", default=None, help=f"数据源解析缓存目录（默认读取环境变量 {SOURCE_CACHE_ENV} 或用户缓存目录）")
+    parser.add_argument("--cache-max-mb", type=int, default=SOURCE_CACHE_DEFAULT_MAX_MB, help="缓存目录大小上限（MB），超出后按最近使用淘汰")
+    parser.add_argument("--no-cache", action="store_true", help="禁用数据源解析缓存")
+    parser.add_argument("--workers", type=int, default=None, help="并发读取数据源的进程数，1 表示串行（默认按 CPU 核数，最多 4）")
+    parser.add_argument("--no-manifest", action="store_true", help="不读写台账旁的状态清单（<台账>.manifest.json），每次全表扫描")
+    parser.add_argument("--lookup-mode", choices=LOOKUP_MODES, default=LOOKUP_MODE_WHOLE,
+                        help="追加行查找公式的引用方式：whole 整列（默认）、named 引用随数据末行移动的定义名称")
+    parser.add_argument("--rewrite-lookups", action="store_true",
+                        help="同时把台账中已有的查找公式（整列、定义名称或旧版 bounded 写法）改写为 --lookup-mode 指定的方式"
+                             "（仅 openpyxl 引擎）")
+    parser.add_argument("--engine", choices=LEDGER_ENGINES, default=LEDGER_ENGINE_OPENPYXL,
+                        help="台账读写引擎：openpyxl 整本加载；stream 只扫描目标 sheet 并把新增行拼接进原始 XML")
+    parser.add_argument("--profile", default=None,
+                        help="把各阶段耗时 / CPU / RSS 峰值与各 sheet 扫描、追加行数写入该 JSON 文件")
+    parser.add_argument("--profile-hotspots", type=int, default=0,
+                        help="同时用 cProfile 统计自身耗时最多的 N 个函数，并在 JSON 旁写出 .prof 文件（需配合 --profile）")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="用 tracemalloc 记录各阶段的 Python 内存峰值（需配合 --profile；追踪会拖慢执行，此时的耗时偏大）")
+    parser.add_argument("--compression-level", type=int, choices=range(10), default=SAVE_ZIP_LEVEL, metavar="0-9",
+                        help=f"输出 xlsx 的 deflate 压缩级别（默认 {SAVE_ZIP_LEVEL}）：中间结果可用 1 快速保存，最终输出用 9 减小体积；"
+                             "流式引擎只作用于改写过的部件")
+    parser.add_argument("--save-threads", type=int, default=None,
+                        help=f"保存时并行压缩部件的线程数，1 表示串行（默认按 CPU 核数，最多 {SAVE_THREADS_MAX}）")
+    parser.add_argument("--dry-run", nargs="?", const=DRY_RUN_STDOUT, default=None, metavar="PLAN_JSON",
+                        help="只预览：用流式引擎扫描台账，生成各 sheet 的追加计划写到该 JSON 文件（省略路径时输出到 stdout），"
+                             "不保存台账与状态清单")
+    return parser
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if not args.date and not (args.date_from and args.date_to):
+        parser.error("需指定 --date，或同时指定 --date-from 与 --date-to")
+    if bool(args.date_from) != bool(args.date_to):
+        parser.error("--date-from 与 --date-to 需同时指定")
+    if args.profile_hotspots and not args.profile:
+        parser.error("--profile-hotspots 需配合 --profile 使用")
+    if args.profile_memory and not args.profile:
+        parser.error("--profile-memory 需配合 --profile 使用")
+    if not args.output and args.dry_run is None:
+        parser.error("需指定 --output（预览时使用 --dry-run）")
+    return args
 
 
 def parse_input_date(date_str: str) -> dt.date:
@@ -193,7 +381,23 @@ def parse_input_date(date_str: str) -> dt.date:
         raise SystemExit(f"无效日期格式: {date_str}，需为 YYYYMMDD") from exc
 
 
-def normalize_excel_date(value) -> Optional[dt.date]:
+def resolve_target_dates(args: argparse.Namespace) -> List[dt.date]:
+    """ 合并 --date 与 --date-from/--date-to，去重后升序返回 """
+    dates = {parse_input_date(value) for value in args.date}
+    if args.date_from and args.date_to:
+        start = parse_input_date(args.date_from)
+        end = parse_input_date(args.date_to)
+        if start > end:
+            raise SystemExit(f"补录日期范围无效：{args.date_from} > {args.date_to}")
+        dates.update(start + dt.timedelta(days=offset) for offset in range((end - start).days + 1))
+    return sorted(dates)
+
+
+DATE_TEXT_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y%m%d")
+
+
+def parse_excel_date(value) -> Optional[dt.date]:
+    """ 单元格取值解析为日期（不缓存）；一般通过 normalize_excel_date 调用 """
     if isinstance(value, dt.datetime):
         return value.date()
     if isinstance(value, dt.date):
@@ -205,7 +409,7 @@ def normalize_excel_date(value) -> Optional[dt.date]:
             return None
     if isinstance(value, str):
         text = value.strip()
-        for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%Y%m%d"):
+        for fmt in DATE_TEXT_FORMATS:
             try:
                 return dt.datetime.strptime(text, fmt).date()
             except ValueError:
@@ -213,6 +417,74 @@ def normalize_excel_date(value) -> Optional[dt.date]:
     return None
 
 
+class DateNormalizer:
+    """
+    按原始取值缓存的 parse_excel_date：放款 / 还款导出中日期列只有几百个不同取值，
+    文本（最多 3 次 strptime）与序列号（from_excel）只在首次出现时解析。
+    缓存键带上类型，避免 1 / 1.0 / True 互相命中；超过上限时整体清空（常驻 worker 下防止无限增长）。
+    """
+
+    def __init__(self, max_entries: int = 65536):
+        self.max_entries = max_entries
+        self._cache: Dict[tuple, Optional[dt.date]] = {}
+
+    def __call__(self, value) -> Optional[dt.date]:
+        if value is None:
+            return None
+        if isinstance(value, dt.datetime):
+            return value.date()
+        if isinstance(value, dt.date):
+            return value
+        key = (value.__class__, value)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return parse_excel_date(value)
+        if len(self._cache) >= self.max_entries:
+            self._cache.clear()
+        parsed = self._cache[key] = parse_excel_date(value)
+        return parsed
+
+    def matcher(self, target_date: dt.date):
+        """
+        返回判断取值是否为 target_date 的函数：目标日期预先换算为序列号与规范文本，
+        命中则直接返回 True，其余取值再走缓存解析，结果与 normalize_excel_date(value) == target_date 一致
+        """
+        serial = int(to_excel(target_date))
+        texts = {target_date.strftime(fmt) for fmt in DATE_TEXT_FORMATS}
+
+        def matches(value) -> bool:
+            if value.__class__ is str and value in texts:
+                return True
+            if value.__class__ in (int, float) and value == serial:
+                return True
+            return self(value) == target_date
+
+        return matches
+
+    def partition(self, rows: Iterable[Sequence], col_idx: int,
+                  dates: Optional[Iterable[dt.date]] = None) -> Dict[dt.date, List[Sequence]]:
+        """ 一次遍历按 col_idx 列（1 起）的日期分组；dates 非空时只保留这些日期，无法解析的行丢弃 """
+        wanted = set(dates) if dates is not None else None
+        partitions: Dict[dt.date, List[Sequence]] = {}
+        normalize = self.__call__
+        for row in rows:
+            row_date = normalize(row[col_idx - 1])
+            if row_date is None or (wanted is not None and row_date not in wanted):
+                continue
+            partitions.setdefault(row_date, []).append(row)
+        return partitions
+
+
+DATE_NORMALIZER = DateNormalizer()
+
+
+def normalize_excel_date(value) -> Optional[dt.date]:
+    return DATE_NORMALIZER(value)
+
+
 def normalize_string(value) -> str:
     if value is None:
         return ""
@@ -223,16 +495,6 @@ def normalize_string(value) -> str:
     return str(value).strip()
 
 
-def normalize_amount_to_10k(value) -> Optional[float]:
-    if value in (None, ""):
-        return None
-    try:
-        numeric = float(str(value).replace(",", ""))
-    except Exception:
-        return None
-    return round(numeric / 10000, 2)
-
-
 def find_sheet_by_name(wb, sheet_name: str) -> "Worksheet":
     """ 根据名称查找工作表 """
     if sheet_name in wb.sheetnames:
@@ -240,14 +502,73 @@ def find_sheet_by_name(wb, sheet_name: str) -> "Worksheet":
     raise SystemExit(f"未找到目标工作表：{sheet_name}")
 
 
+def iter_scan_rows(ws, min_row: int) -> Iterable[int]:
+    """ 全表扫描时遍历的行号；流式引擎只返回扫描阶段保留下来的行 """
+    captured_rows = getattr(ws, "captured_rows", None)
+    rows = captured_rows(min_row) if captured_rows is not None else range(min_row, ws.max_row + 1)
+    if ACTIVE_PROFILE is not None:
+        return ACTIVE_PROFILE.count_scanned(ws.title, rows)
+    return rows
+
+
+def peek_cell_value(ws, row: int, column: int):
+    """ 读取单元格取值但不创建单元格（ws.cell 会为不存在的坐标新建空单元格） """
+    peek_value = getattr(ws, "peek_value", None)
+    if peek_value is not None:
+        return peek_value(row, column)
+    cell = ws._cells.get((row, column))
+    return None if cell is None else cell.value
+
+
 def find_last_data_row(ws) -> int:
-    # 使用 A 列（序号公式）向上查找
+    # 使用 A 列（序号公式）向上查找，只读取已存在的单元格
     for row_idx in range(ws.max_row, 0, -1):
-        if ws.cell(row=row_idx, column=COL_A).value not in (None, ""):
+        if peek_cell_value(ws, row_idx, COL_A) not in (None, ""):
             return row_idx
     return 0
 
 
+def find_last_content_row(ws) -> int:
+    """ 最后一个含取值（或位于合并区域内）的行号，末尾只带样式的行不计 """
+    max_row = ws.max_row
+    merged_bottom = min(max((merged.max_row for merged in ws.merged_cells.ranges), default=0), max_row)
+    columns = range(1, ws.max_column + 1)
+    for row_idx in range(max_row, merged_bottom, -1):
+        if any(peek_cell_value(ws, row_idx, col_idx) not in (None, "") for col_idx in columns):
+            return row_idx
+    return merged_bottom
+
+
+def compact_trailing_rows(ws) -> range:
+    """
+    删除末尾只带样式、没有取值的行，返回被删除的行号范围。
+    这类行会抬高 ws.max_row：按 max_row 追加的新行会落在远离数据的位置，文件与每次扫描也随之变大。
+    """
+    compact = getattr(ws, "compact_trailing_rows", None)
+    if compact is not None:
+        return compact()
+    removed = range(find_last_content_row(ws) + 1, ws.max_row + 1)
+    columns = range(1, ws.max_column + 1)
+    for row_idx in removed:
+        for col_idx in columns:
+            ws._cells.pop((row_idx, col_idx), None)
+        ws.row_dimensions.pop(row_idx, None)
+    return removed
+
+
+def compact_ledger_sheets(wb) -> int:
+    """ 追加前整理各目标 sheet 末尾的空行，返回删除的总行数 """
+    total = 0
+    for title in LEDGER_TARGET_SHEETS:
+        if title not in wb.sheetnames:
+            continue
+        removed = compact_trailing_rows(wb[title])
+        if removed:
+            print(f"[{title}] 移除末尾 {len(removed)} 行仅含样式的空行（第 {removed.start}-{removed.stop - 1} 行）")
+            total += len(removed)
+    return total
+
+
 def get_last_existing_date(ws) -> Optional[dt.date]:
     last_row = find_last_data_row(ws)
     if last_row == 0:
@@ -257,44 +578,229 @@ def get_last_existing_date(ws) -> Optional[dt.date]:
     return last_w or last_ae
 
 
+class FormulaTemplate:
+    """
+    预先分词的模板行公式：cache_template_row 时用 openpyxl 的 Tokenizer 分词一次，
+    记录随行移动的行号（不带 $ 的行引用），追加行只替换这些行号，结果与同列的
+    Translator.translate_formula(目标单元格) 一致。
+    """
+
+    def __init__(self, formula: str, origin_row: int):
+        self.origin_row = origin_row
+        # parts：字符串为原样输出的片段，整数为模板行中的相对行号
+        self.parts: List[object] = []
+        tokens = Tokenizer(formula).items
+        if not tokens:
+            return
+        if tokens[0].type == Token.LITERAL:
+            self._emit(tokens[0].value)
+            return
+        self._emit("=")
+        for token in tokens:
+            if token.type == Token.OPERAND and token.subtype == Token.RANGE:
+                self._compile_range(token.value)
+            else:
+                self._emit(token.value)
+
+    def _emit(self, part):
+        if isinstance(part, str) and self.parts and isinstance(self.parts[-1], str):
+            self.parts[-1] += part
+        else:
+            self.parts.append(part)
+
+    def _emit_row(self, row_str: str):
+        self._emit(row_str if row_str.startswith("$") else int(row_str))
+
+    def _compile_range(self, range_str: str):
+        """ 同 Translator.translate_range（列偏移恒为 0） """
+        ws_part, range_str = Translator.strip_ws_name(range_str)
+        self._emit(ws_part)
+        match = Translator.ROW_RANGE_RE.match(range_str)
+        if match is not None:
+            self._emit_row(match.group(1))
+            self._emit(":")
+            self._emit_row(match.group(2))
+            return
+        match = Translator.COL_RANGE_RE.match(range_str)
+        if match is not None:
+            self._emit(Translator.translate_col(match.group(1), 0) + ":" + Translator.translate_col(match.group(2), 0))
+            return
+        if ":" in range_str:
+            for index, piece in enumerate(range_str.split(":")):
+                if index:
+                    self._emit(":")
+                self._compile_range(piece)
+            return
+        match = Translator.CELL_REF_RE.match(range_str)
+        if match is None:
+            self._emit(range_str)
+            return
+        self._emit(Translator.translate_col(match.group(1), 0))
+        self._emit_row(match.group(2))
+
+    def render(self, row_idx: int) -> str:
+        delta = row_idx - self.origin_row
+        out = []
+        for part in self.parts:
+            if part.__class__ is str:
+                out.append(part)
+                continue
+            new_row = part + delta
+            if new_row <= 0:
+                raise TranslatorError("Formula out of range")
+            out.append(str(new_row))
+        return "".join(out)
+
+
+DATE_VALUE_TYPES = (dt.datetime, dt.date, dt.time, dt.timedelta)
+
+
+class TemplateStylePool:
+    """
+    模板单元格样式及其覆盖变体（对齐 / 数字格式）的池：每种组合只登记一次，
+    追加行直接赋值现成的 _style，不再逐行构造样式对象、也不经过 cell.alignment / number_format 的 setter。
+    openpyxl 下模板行与同列追加行共享同一个 StyleArray，setter 会原地修改它（连带模板行和已追加的行），
+    变体在一个不挂到 sheet 上的草稿单元格（持有 StyleArray 副本）上经公开的 setter 生成，每种组合只做一次。
+    流式引擎下样式为 cellXfs 索引，交给 StreamWorkbook.derive_style。
+    """
+
+    def __init__(self, ws, style):
+        self.ws = ws
+        self.wb = ws.parent
+        self.style = style
+        self._variants: Dict[tuple, object] = {}
+        self._date_formatted: Optional[bool] = None
+
+    def _scratch_cell(self) -> Cell:
+        """ 带模板样式副本的游离单元格：读写 alignment / number_format 都走 openpyxl 的公开接口 """
+        return Cell(self.ws, style_array=self.style)
+
+    @property
+    def date_formatted(self) -> bool:
+        """ 模板数字格式是否为日期格式（否则写入日期时 openpyxl 会改用默认日期格式） """
+        if self._date_formatted is None:
+            if hasattr(self.wb, "derive_style"):
+                code = self.wb.styles.number_format(self.style)
+            else:
+                code = self._scratch_cell().number_format
+            self._date_formatted = is_date_format(code)
+        return self._date_formatted
+
+    def for_value(self, value, alignment: Optional[Alignment] = None, number_format: Optional[str] = None):
+        """ 写入 value 时应使用的样式：日期写入非日期格式时同样取带默认日期格式的变体 """
+        if number_format is None and isinstance(value, DATE_VALUE_TYPES) and not self.date_formatted:
+            number_format = get_time_format(type(value))
+        return self.variant(alignment, number_format)
+
+    @property
+    def alignment(self):
+        """ 与模板单元格 cell.alignment 的取值相同 """
+        if hasattr(self.wb, "derive_style"):
+            return self.wb.styles.alignment(self.style)
+        return self._scratch_cell().alignment
+
+    def variant(self, alignment: Optional[Alignment] = None, number_format: Optional[str] = None):
+        if alignment is None and number_format is None:
+            return self.style
+        key = (alignment, number_format)
+        derived = self._variants.get(key)
+        if derived is None:
+            derived = self._variants[key] = self._derive(alignment, number_format)
+        return derived
+
+    def _derive(self, alignment: Optional[Alignment], number_format: Optional[str]):
+        if hasattr(self.wb, "derive_style"):
+            return self.wb.derive_style(self.style, alignment, number_format)
+        scratch = self._scratch_cell()
+        if alignment is not None:
+            scratch.alignment = alignment
+        if number_format is not None:
+            scratch.number_format = number_format
+        return scratch._style
+
+
 def cache_template_row(ws, row_index: int) -> Dict[int, Dict[str, object]]:
     cached: Dict[int, Dict[str, object]] = {}
     for cell in ws[row_index]:
-        translator = None
+        formula = None
         if cell.data_type == "f" and isinstance(cell.value, str):
-            origin = f"{get_column_letter(cell.column)}{row_index}"
-            translator = Translator(cell.value, origin=origin)
+            formula = FormulaTemplate(cell.value, row_index)
         cached[cell.column] = {
             "value": cell.value,
             "data_type": cell.data_type,
             # 样式对象可共享，避免为每个单元格复制带来的样式爆炸与慢速保存
             "style": cell._style,
-            "translator": translator,
+            "styles": TemplateStylePool(ws, cell._style) if cell._style is not None else None,
+            "formula": formula,
         }
     return cached
 
 
-def apply_template_row(ws, template_cache, target_row: int, template_row_index: int, template_height: Optional[float]):
-    for col_idx, meta in template_cache.items():
-        target_cell = ws.cell(row=target_row, column=col_idx)
-        tpl_value = meta["value"]
-        tpl_type = meta["data_type"]
-        translator: Optional[Translator] = meta.get("translator")  # type: ignore
-        if meta.get("style"):
-            target_cell._style = meta["style"]
-
-        if tpl_type == "f" and translator:
-            target = f"{get_column_letter(col_idx)}{target_row}"
-            # openpyxl 3.1 的接口是 translate_formula，而旧版本是 translate
-            if hasattr(translator, "translate_formula"):
-                target_cell.value = translator.translate_formula(target)
-            else:  # pragma: no cover - 兼容旧接口
-                target_cell.value = translator.translate(target)
-        else:
-            target_cell.value = tpl_value
+B_TEXT_FILL_COLOR = "FFFFE699"
+B_TEXT_FONT_COLOR = "FFC00000"
+ISTEXT_B_FORMULA_RE = re.compile(r"^ISTEXT\(\$B([1-9][0-9]*)\)$")
 
-    if template_height:
-        ws.row_dimensions[target_row].height = template_height
+
+def parse_column_b_rows(sqref: str) -> Optional[List[tuple]]:
+    """ sqref 全部位于 B 列时返回各区域的 (起始行, 结束行)，否则返回 None """
+    rows: List[tuple] = []
+    for ref in sqref.split():
+        try:
+            min_col, min_row, max_col, max_row = range_boundaries(ref)
+        except (TypeError, ValueError):
+            return None
+        if min_col != COL_B or max_col != COL_B or min_row is None:
+            return None
+        rows.append((min_row, max_row))
+    return rows or None
+
+
+def is_b_column_text_rule(sqref: str, rule) -> bool:
+    """ 是否为 apply_b_column_conditional_format 生成的规则（ISTEXT 锚定区域首行，黄底红字加粗） """
+    if rule.type != "expression" or not rule.formula or len(rule.formula) != 1:
+        return False
+    match = ISTEXT_B_FORMULA_RE.match(rule.formula[0])
+    rows = parse_column_b_rows(sqref)
+    if match is None or rows is None or int(match.group(1)) != min(start for start, _ in rows):
+        return False
+    dxf = rule.dxf
+    if dxf is None or dxf.fill is None or dxf.font is None:
+        return False
+    return (getattr(dxf.fill.fgColor, "rgb", None) == B_TEXT_FILL_COLOR
+            and getattr(dxf.font.color, "rgb", None) == B_TEXT_FONT_COLOR
+            and bool(dxf.font.b))
+
+
+def pop_conditional_rules(ws, predicate) -> List[tuple]:
+    """ 从 sheet 的条件格式中移除 predicate(sqref, rule) 为真的规则，返回 [(sqref, rule)] """
+    if hasattr(ws.conditional_formatting, "pop_rules"):
+        return ws.conditional_formatting.pop_rules(predicate)
+    popped: List[tuple] = []
+    formatting = ws.conditional_formatting
+    for cf in list(formatting):
+        sqref = str(cf.sqref)
+        keep = []
+        for rule in cf.rules:
+            if predicate(sqref, rule):
+                popped.append((sqref, rule))
+            else:
+                keep.append(rule)
+        if not keep:
+            del formatting[sqref]
+        elif len(keep) != len(cf.rules):
+            # cf.rules 即 ConditionalFormattingList 中登记的规则列表，原地修改
+            cf.rules[:] = keep
+    return popped
+
+
+def merge_row_intervals(intervals: Iterable[tuple]) -> List[tuple]:
+    merged: List[list] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
 
 
 def apply_b_column_conditional_format(ws, start_row: int, end_row: int):
@@ -302,795 +808,4468 @@ def apply_b_column_conditional_format(ws, start_row: int, end_row: int):
     对 B 列指定范围应用条件格式：
     - 当公式计算结果为文本时，应用黄底红字加粗样式
     - 当公式计算结果为数字时，不应用样式（使用模板默认样式）
+    已有同样式的 ISTEXT 规则（含历史上每天追加的零散规则）合并为一条并扩展区域，规则数量不随天数增长
     """
     if start_row > end_row:
         return
 
+    existing = pop_conditional_rules(ws, is_b_column_text_rule)
+    intervals = [(start_row, end_row)]
+    for sqref, _ in existing:
+        intervals.extend(parse_column_b_rows(sqref))
+    intervals = merge_row_intervals(intervals)
+    top = intervals[0][0]
+
     # 定义文本时的样式
-    text_fill = PatternFill(start_color='FFFFE699', end_color='FFFFE699', fill_type='solid')
-    text_font = Font(color='FFC00000', size=11, bold=True)
+    text_fill = PatternFill(start_color=B_TEXT_FILL_COLOR, end_color=B_TEXT_FILL_COLOR, fill_type='solid')
+    text_font = Font(color=B_TEXT_FONT_COLOR, size=11, bold=True)
 
     # 条件格式规则：当 B 列值为文本时应用样式
-    # 使用 ISTEXT 函数判断，$B 表示列固定，行号相对
+    # 使用 ISTEXT 函数判断，$B 表示列固定，行号相对（锚定合并后区域的首行）
     formula_rule = FormulaRule(
-        formula=[f'ISTEXT($B{start_row})'],
+        formula=[f'ISTEXT($B{top})'],
         fill=text_fill,
         font=text_font
     )
-
-    # 应用到 B 列指定范围
-    range_string = f'B{start_row}:B{end_row}'
+    priorities = [rule.priority for _, rule in existing if rule.priority]
+    if priorities:
+        # 沿用原有规则中最高的优先级（数值最小）
+        formula_rule.priority = min(priorities)
+    if len(existing) > 1:
+        print(f"[{ws.title}] 合并 {len(existing)} 条 B 列 ISTEXT 条件格式为 1 条")
+
+    # 应用到 B 列合并后的范围
+    range_string = " ".join(f"B{start}:B{end}" for start, end in intervals)
     ws.conditional_formatting.add(range_string, formula_rule)
 
 
-def collect_loan_rows(path: Path, target_date: dt.date) -> List[Sequence]:
-    wb = load_workbook(path, read_only=True, data_only=False)
-    ws = wb.active
-    # 修复第三方 Excel 文件 dimension 信息不正确的问题
-    ws.reset_dimensions()
-    matched: List[Sequence] = []
-    for row in ws.iter_rows(min_row=2, max_col=LOAN_COL_BF, values_only=True):
-        # read_only + reset_dimensions 会裁掉行尾的空单元格，这里补齐到预期列数避免索引越界
-        if len(row) < LOAN_COL_BF:
-            row = tuple(row) + (None,) * (LOAN_COL_BF - len(row))
-        if normalize_excel_date(row[LOAN_COL_P - 1]) == target_date:
-            matched.append(row)
-    wb.close()
-    return matched
-
-
-def collect_repay_rows(path: Path, target_date: dt.date, fee_type: str = "本金") -> List[Sequence]:
-    wb = load_workbook(path, read_only=True, data_only=False)
-    ws = wb.active
-    # 修复第三方 Excel 文件 dimension 信息不正确的问题
-    ws.reset_dimensions()
-    matched: List[Sequence] = []
-    for row in ws.iter_rows(min_row=2, max_col=REPAY_COL_AH, values_only=True):
-        # read_only + reset_dimensions 会裁掉行尾的空单元格，这里补齐到预期列数避免索引越界
-        if len(row) < REPAY_COL_AH:
-            row = tuple(row) + (None,) * (REPAY_COL_AH - len(row))
-        if normalize_excel_date(row[REPAY_COL_AE - 1]) != target_date:
-            continue
-        fee_value = row[REPAY_COL_AB - 1]
-        if (fee_value or "").strip() != fee_type:
-            continue
-        matched.append(row)
-    wb.close()
-    # 按交易银行流水号（AH）升序
-    return sorted(matched, key=lambda r: (r[REPAY_COL_AH - 1] is None, str(r[REPAY_COL_AH - 1])))
+# =============================================================================
+# 数据源 xlsx 流式读取
+# 直接解析 zip 内的 XML（expat 增量解析），只为需要的列构造值，
+# 避免 openpyxl 只读模式为每个单元格创建对象后再丢弃。
+# 不依赖 <dimension> 元数据，天然规避第三方导出文件 dimension 错误的问题。
+# =============================================================================
 
+XLSX_REL_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+XLSX_READ_CHUNK = 1 << 16
 
-def collect_zhongdeng_rows(path: Path, finance_codes: set[str]) -> List[Sequence]:
-    if not finance_codes:
-        return []
+# 列字母 -> 列序号缓存（单元格坐标形如 "AB123"）
+_COLUMN_LETTER_CACHE: Dict[str, int] = {}
 
-    wb = load_workbook(path, read_only=True, data_only=False)
-    try:
-        ws = wb[SHEET_ZHONGDENG] if SHEET_ZHONGDENG in wb.sheetnames else wb.active
-        # 修复第三方 Excel 文件 dimension 信息不正确的问题
-        # read_only 模式依赖文件中的 dimension 元数据，某些第三方系统生成的文件此信息可能不正确
-        # 调用 reset_dimensions() 可强制 openpyxl 扫描实际数据范围
-        ws.reset_dimensions()
-        dedup: Dict[str, Sequence] = {}
-        fallback_index = 0
-
-        for row in ws.iter_rows(min_row=2, max_col=ZD_COL_Y, values_only=True):
-            # read_only + reset_dimensions 会裁掉行尾的空单元格，这里补齐到预期列数避免索引越界
-            if len(row) < ZD_COL_Y:
-                row = tuple(row) + (None,) * (ZD_COL_Y - len(row))
-            finance_code = normalize_string(row[ZD_COL_C - 1])
-            if not finance_code or finance_code not in finance_codes:
-                continue
 
-            reg_number = normalize_string(row[ZD_COL_I - 1])
-            reg_type = normalize_string(row[ZD_COL_F - 1])
-            key = reg_number or f"__row_{fallback_index}"
-            if not reg_number:
-                fallback_index += 1
-
-            existing = dedup.get(key)
-            if existing:
-                existing_type = normalize_string(existing[ZD_COL_F - 1])
-                if existing_type != "初始登记" and reg_type == "初始登记":
-                    dedup[key] = row
-                continue
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1].rsplit(":", 1)[-1]
 
-            dedup[key] = row
 
-        return [
-            row
-            for row in dedup.values()
-            if normalize_string(row[ZD_COL_F - 1]) == "初始登记"
-        ]
-    finally:
-        wb.close()
+def _cast_number(text: str):
+    # 与 openpyxl 保持一致：含小数点或指数记号的为 float，否则为 int
+    if "." in text or "E" in text or "e" in text:
+        return float(text)
+    return int(text)
 
 
-def set_cell(ws, row_idx: int, col_idx: int, value):
-    cell = ws.cell(row=row_idx, column=col_idx)
-    if value is None:
-        cell.value = None
-    else:
-        cell.value = value
+def _column_of(coordinate: str) -> int:
+    letters = coordinate.rstrip("0123456789")
+    col_idx = _COLUMN_LETTER_CACHE.get(letters)
+    if col_idx is None:
+        col_idx = column_index_from_string(letters.replace("$", ""))
+        _COLUMN_LETTER_CACHE[letters] = col_idx
+    return col_idx
 
 
-def append_loan_block(ws, template_cache, template_height, template_row_index, rows: Iterable[Sequence]) -> int:
-    added = 0
-    start_row = ws.max_row
-    for record in rows:
-        target_row = start_row + added + 1
-        apply_template_row(ws, template_cache, target_row, template_row_index, template_height)
-        # B 列样式通过条件格式统一处理，不再逐行应用
-
-        set_cell(ws, target_row, COL_C, None)
-        set_cell(ws, target_row, COL_D, record[LOAN_COL_B - 1])
-        loan_e = record[LOAN_COL_AE - 1]
-        if isinstance(loan_e, str):
-            loan_e = loan_e.replace('业务', '')
-
-        set_cell(ws, target_row, COL_E, loan_e)
-        # F列：明保->明保理，暗保->暗保理
-        loan_f = record[LOAN_COL_AG - 1]
-        if isinstance(loan_f, str):
-            if loan_f.strip() == '明保':
-                loan_f = '明保理'
-            elif loan_f.strip() == '暗保':
-                loan_f = '暗保理'
-        set_cell(ws, target_row, COL_F, loan_f)
-        set_cell(ws, target_row, COL_G, record[LOAN_COL_K - 1])
-        set_cell(ws, target_row, COL_H, record[LOAN_COL_C - 1])
-        set_cell(ws, target_row, COL_I, record[LOAN_COL_G - 1])
-        loan_j = record[LOAN_COL_AZ - 1]
-        loan_k = record[LOAN_COL_J - 1]
-        set_cell(ws, target_row, COL_J, loan_j if loan_j not in (None, "") else "/")
-        set_cell(ws, target_row, COL_K, loan_k if loan_k not in (None, "") else "/")
-        set_cell(ws, target_row, COL_L, record[LOAN_COL_AA - 1])
-        set_cell(ws, target_row, COL_N, record[LOAN_COL_AK - 1])
-        ws.cell(row=target_row, column=COL_N).alignment = Alignment(horizontal='left')
-        # O 列保留模板公式 (=GX&"-"&TX)
-        set_cell(ws, target_row, COL_P, record[LOAN_COL_M - 1])
-        ws.cell(row=target_row, column=COL_P).alignment = Alignment(horizontal='center')
-        set_cell(ws, target_row, COL_Q, record[LOAN_COL_L - 1])
-        set_cell(ws, target_row, COL_R, record[LOAN_COL_AK - 1])
-        ws.cell(row=target_row, column=COL_R).alignment = Alignment(horizontal='left')
-        biz_mode = record[LOAN_COL_Y - 1]
-        set_cell(ws, target_row, COL_S, "保理" if isinstance(biz_mode, str) and biz_mode.strip() == "直接投放" else "再保理")
-        set_cell(ws, target_row, COL_T, record[LOAN_COL_N - 1])
-        set_cell(ws, target_row, COL_U, record[LOAN_COL_AW - 1])
-        set_cell(ws, target_row, COL_V, record[LOAN_COL_AW - 1])
-        set_cell(ws, target_row, COL_W, record[LOAN_COL_P - 1])
-        set_cell(ws, target_row, COL_X, record[LOAN_COL_BC - 1])
-        bf_value = record[LOAN_COL_BF - 1]
-        if isinstance(bf_value, (int, float)):
-            set_cell(ws, target_row, COL_Z, round(float(bf_value), 4))
-            ws.cell(row=target_row, column=COL_Z).number_format = "0.00%"
-        else:
-            set_cell(ws, target_row, COL_Z, bf_value)
-        set_cell(ws, target_row, COL_AB, record[LOAN_COL_Q - 1])
-        set_cell(ws, target_row, COL_AC, record[LOAN_COL_T - 1])
-        set_cell(ws, target_row, COL_AD, record[LOAN_COL_U - 1])
-        set_cell(ws, target_row, COL_AO, f"=VLOOKUP(AG{target_row},P:W,8,0)")
-        set_cell(ws, target_row, COL_AP, None)
-        set_cell(ws, target_row, COL_AQ, f"=XLOOKUP(AG{target_row},P:P,AD:AD)")
-        added += 1
-    return added
-
-
-def append_repay_block(ws, template_cache, template_height, template_row_index, rows: Iterable[Sequence], repay_type: str) -> int:
-    added = 0
-    start_row = ws.max_row
-    for record in rows:
-        target_row = start_row + added + 1
-        apply_template_row(ws, template_cache, target_row, template_row_index, template_height)
-        # B 列样式通过条件格式统一处理，不再逐行应用
-
-        set_cell(ws, target_row, COL_C, None)
-        set_cell(ws, target_row, COL_D, record[REPAY_COL_G - 1])
-        repay_e = record[REPAY_COL_H - 1]
-        if isinstance(repay_e, str):
-            repay_e = repay_e.replace('业务', '')
-        set_cell(ws, target_row, COL_E, repay_e)
-        # F列：明保->明保理，暗保->暗保理
-        repay_f = record[REPAY_COL_J - 1]
-        if isinstance(repay_f, str):
-            if repay_f.strip() == '明保':
-                repay_f = '明保理'
-            elif repay_f.strip() == '暗保':
-                repay_f = '暗保理'
-        set_cell(ws, target_row, COL_F, repay_f)
-        set_cell(ws, target_row, COL_G, record[REPAY_COL_M - 1])
-        set_cell(ws, target_row, COL_H, record[REPAY_COL_B - 1])
-        set_cell(ws, target_row, COL_I, record[REPAY_COL_C - 1])
-        set_cell(ws, target_row, COL_J, "/")
-        set_cell(ws, target_row, COL_K, "/")
-        set_cell(ws, target_row, COL_L, record[REPAY_COL_F - 1])
-
-        for col_idx in (
-            COL_M,
-            COL_N,
-            COL_O,
-            COL_P,
-            COL_Q,
-            COL_R,
-            COL_S,
-            COL_T,
-            COL_U,
-            COL_V,
-            COL_W,
-            COL_X,
-            COL_Y,
-            COL_Z,
-            COL_AA,
-            COL_AB,
-            COL_AC,
-            COL_AD,
-            COL_AP,
-        ):
-            set_cell(ws, target_row, col_idx, None)
-
-        set_cell(ws, target_row, COL_AE, record[REPAY_COL_AE - 1])
-        set_cell(ws, target_row, COL_AG, record[REPAY_COL_O - 1])
-        set_cell(ws, target_row, COL_AH, record[REPAY_COL_AG - 1])
-        set_cell(ws, target_row, COL_AI, record[REPAY_COL_AG - 1])
-        set_cell(ws, target_row, COL_AJ, record[REPAY_COL_AE - 1])
-        set_cell(ws, target_row, COL_AK, repay_type)
-        set_cell(ws, target_row, COL_AO, f"=VLOOKUP(AG{target_row},P:W,8,0)")
-        set_cell(ws, target_row, COL_AQ, f"=XLOOKUP(AG{target_row},P:P,AD:AD)")
-        set_cell(ws, target_row, COL_AR, record[REPAY_COL_AH - 1])
-        added += 1
-    return added
+def _resolve_part(base_dir: str, target: str) -> str:
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(base_dir, target))
 
 
-def extract_date_prefix(value):
-    text = normalize_string(value)
-    if not text:
-        return None
-    prefix = text.split("~", 1)[0].strip()
-    if not prefix:
-        return None
-    parsed = normalize_excel_date(prefix)
-    return parsed or prefix
+def _read_relationships(archive: zipfile.ZipFile, rels_path: str) -> Dict[str, tuple]:
+    """ 返回 {rId: (Type, Target)} """
+    try:
+        payload = archive.read(rels_path)
+    except KeyError:
+        return {}
+    root = ElementTree.fromstring(payload)
+    return {
+        rel.get("Id"): (rel.get("Type", ""), rel.get("Target", ""))
+        for rel in root
+        if _local_name(rel.tag) == "Relationship"
+    }
+
+
+def _rich_text_content(node) -> str:
+    """ 与 openpyxl Text.content 一致：拼接 <t> 与富文本 <r><t>，忽略拼音 <rPh> """
+    snippets = []
+    for child in node:
+        name = _local_name(child.tag)
+        if name == "t":
+            snippets.append(child.text or "")
+        elif name == "r":
+            for grandchild in child:
+                if _local_name(grandchild.tag) == "t":
+                    snippets.append(grandchild.text or "")
+    return "".join(snippets)
+
+
+class XlsxStreamReader:
+    """
+    轻量级 xlsx 只读流式读取器：
+    - 共享字符串、日期样式与 1904 纪元按 openpyxl 的规则解析，取值结果与 openpyxl 一致；
+    - iter_rows 只转换请求的列，其余位置为 None，行元组长度为请求列的最大序号，
+      调用方仍可按 row[COL_X - 1] 取值；
+    - 缺失的行（稀疏行）与请求列全部为空的行直接跳过。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._archive = zipfile.ZipFile(self.path)
+        self._shared_strings: Optional[List[str]] = None
+        self._load_workbook_parts()
+
+    def __enter__(self) -> "XlsxStreamReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._archive.close()
+
+    def _load_workbook_parts(self):
+        workbook_part = "xl/workbook.xml"
+        for rel_type, target in _read_relationships(self._archive, "_rels/.rels").values():
+            if rel_type == XLSX_REL_OFFICE_DOCUMENT:
+                workbook_part = _resolve_part("", target)
+                break
+        self.workbook_part = workbook_part
+        base_dir = posixpath.dirname(workbook_part)
+        rels_path = posixpath.join(base_dir, "_rels", posixpath.basename(workbook_part) + ".rels")
+        workbook_rels = _read_relationships(self._archive, rels_path)
+
+        self.sheet_names: List[str] = []
+        self.sheet_parts: Dict[str, str] = {}
+        self.epoch = CALENDAR_WINDOWS_1900
+        self.active_index = 0
+        active_found = False
+        for node in ElementTree.fromstring(self._archive.read(workbook_part)).iter():
+            name = _local_name(node.tag)
+            if name == "sheet":
+                rel_id = next((v for k, v in node.attrib.items() if _local_name(k) == "id"), None)
+                if rel_id not in workbook_rels:
+                    continue
+                self.sheet_names.append(node.get("name"))
+                self.sheet_parts[node.get("name")] = _resolve_part(base_dir, workbook_rels[rel_id][1])
+            elif name == "workbookPr" and node.get("date1904") in ("1", "true"):
+                self.epoch = CALENDAR_MAC_1904
+            elif name == "workbookView" and not active_found and node.get("activeTab") is not None:
+                self.active_index = int(node.get("activeTab"))
+                active_found = True
+
+        self.shared_strings_part: Optional[str] = None
+        self.styles_part: Optional[str] = None
+        for rel_type, target in workbook_rels.values():
+            if rel_type.endswith("/sharedStrings"):
+                self.shared_strings_part = _resolve_part(base_dir, target)
+            elif rel_type.endswith("/styles"):
+                self.styles_part = _resolve_part(base_dir, target)
+        self.date_styles, self.timedelta_styles = self._load_date_styles(self.styles_part)
+
+    def _load_date_styles(self, styles_part: Optional[str]):
+        date_styles: set[int] = set()
+        timedelta_styles: set[int] = set()
+        if not styles_part:
+            return date_styles, timedelta_styles
+        try:
+            root = ElementTree.fromstring(self._archive.read(styles_part))
+        except KeyError:
+            return date_styles, timedelta_styles
+        custom_formats: Dict[int, str] = {}
+        cell_xfs = []
+        for node in root:
+            name = _local_name(node.tag)
+            if name == "numFmts":
+                for fmt in node:
+                    custom_formats[int(fmt.get("numFmtId"))] = fmt.get("formatCode")
+            elif name == "cellXfs":
+                cell_xfs = [child for child in node if _local_name(child.tag) == "xf"]
+        for idx, xf in enumerate(cell_xfs):
+            fmt_id = int(xf.get("numFmtId", 0))
+            fmt = custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+            if is_date_format(fmt):
+                date_styles.add(idx)
+            if is_timedelta_format(fmt):
+                timedelta_styles.add(idx)
+        return date_styles, timedelta_styles
+
+    @property
+    def shared_strings(self) -> List[str]:
+        if self._shared_strings is None:
+            self._shared_strings = self._load_shared_strings()
+        return self._shared_strings
+
+    def _load_shared_strings(self) -> List[str]:
+        strings: List[str] = []
+        if not self.shared_strings_part:
+            return strings
+        try:
+            source = self.open_part(self.shared_strings_part)
+        except KeyError:
+            return strings
+        with source:
+            for _, node in ElementTree.iterparse(source):
+                if _local_name(node.tag) == "si":
+                    strings.append(_rich_text_content(node).replace("x005F_", ""))
+                    node.clear()
+        return strings
+
+    @property
+    def archive(self) -> zipfile.ZipFile:
+        return self._archive
+
+    def open_part(self, part: str):
+        return self._archive.open(part)
+
+    def read_part(self, part: Optional[str]) -> Optional[bytes]:
+        if not part:
+            return None
+        try:
+            return self._archive.read(part)
+        except KeyError:
+            return None
 
+    def resolve_sheet(self, sheet_name: Optional[str] = None) -> str:
+        """ 指定名称存在时使用该表，否则回退到活动工作表（与 wb.active 一致） """
+        if sheet_name and sheet_name in self.sheet_parts:
+            return sheet_name
+        if not self.sheet_names:
+            raise SystemExit(f"文件中未找到工作表：{self.path}")
+        index = self.active_index if self.active_index < len(self.sheet_names) else 0
+        return self.sheet_names[index]
+
+    def iter_rows(self, columns: Iterable[int], sheet_name: Optional[str] = None, min_row: int = 2,
+                  data_only: bool = False) -> Iterator[tuple]:
+        part = self.sheet_parts[self.resolve_sheet(sheet_name)]
+        parser = _SheetXmlParser(self, columns, min_row, data_only)
+        with self.open_part(part) as source:
+            while True:
+                chunk = source.read(XLSX_READ_CHUNK)
+                parser.feed(chunk)
+                if parser.ready:
+                    yield from parser.ready
+                    parser.ready.clear()
+                if not chunk:
+                    break
+
+
+class _SheetXmlParser:
+    """ worksheet XML 的 expat 回调状态机，取值规则对齐 openpyxl WorkSheetParser.parse_cell """
+
+    def __init__(self, reader: XlsxStreamReader, columns: Iterable[int], min_row: int, data_only: bool):
+        self.wanted = frozenset(columns)
+        self.width = max(self.wanted)
+        self.min_row = min_row
+        self.data_only = data_only
+        self.reader = reader
+        self.date_styles = reader.date_styles
+        self.timedelta_styles = reader.timedelta_styles
+        self.epoch = reader.epoch
+        self.shared_formulae: Dict[str, Translator] = {}
+        self.ready: List[tuple] = []
+
+        self.row_idx = 0
+        self.col_idx = 0
+        self.values: Optional[List[object]] = None
+        self.cell_col: Optional[int] = None
+        self.cell_type = "n"
+        self.cell_style = 0
+        self.cell_ref: Optional[str] = None
+        self.raw_value: Optional[str] = None
+        self.formula: Optional[str] = None
+        self.formula_attrs: Dict[str, str] = {}
+        self.inline: Optional[List[str]] = None
+        self.in_phonetic = False
+        self.capture: Optional[str] = None
+        self.text: List[str] = []
+
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self.start
+        self._parser.EndElementHandler = self.end
+        self._parser.CharacterDataHandler = self.characters
+
+    def feed(self, chunk: bytes):
+        self._parser.Parse(chunk, not chunk)
+
+    def start(self, tag: str, attrs: Dict[str, str]):
+        name = _local_name(tag) if ":" in tag else tag
+        if name == "c":
+            ref = attrs.get("r")
+            col = _column_of(ref) if ref else self.col_idx + 1
+            self.col_idx = col
+            if col in self.wanted:
+                self.cell_col = col
+                self.cell_type = attrs.get("t", "n")
+                self.cell_style = int(attrs.get("s", 0))
+                self.cell_ref = ref
+                self.raw_value = None
+                self.formula = None
+                self.inline = None
+            else:
+                self.cell_col = None
+        elif name == "row":
+            ref = attrs.get("r")
+            self.row_idx = int(ref) if ref else self.row_idx + 1
+            self.col_idx = 0
+            self.values = None
+            self.cell_col = None
+        elif self.cell_col is None:
+            return
+        elif name == "v" or name == "f":
+            self.capture = name
+            self.text = []
+            if name == "f":
+                self.formula_attrs = attrs
+        elif name == "is":
+            self.inline = []
+        elif name == "rPh":
+            self.in_phonetic = True
+        elif name == "t" and self.inline is not None and not self.in_phonetic:
+            self.capture = name
+            self.text = []
+
+    def end(self, tag: str):
+        name = _local_name(tag) if ":" in tag else tag
+        if name == "row":
+            if self.values is not None and self.row_idx >= self.min_row:
+                self.ready.append(tuple(self.values))
+            self.values = None
+            return
+        if self.cell_col is None:
+            return
+        if name == "c":
+            value = self.convert_cell()
+            if value is not None:
+                if self.values is None:
+                    self.values = [None] * self.width
+                self.values[self.cell_col - 1] = value
+            self.cell_col = None
+        elif name == "rPh":
+            self.in_phonetic = False
+        elif name == self.capture:
+            text = "".join(self.text)
+            if name == "v":
+                self.raw_value = text
+            elif name == "f":
+                self.formula = text
+            else:
+                self.inline.append(text)
+            self.capture = None
+
+    def characters(self, data: str):
+        if self.capture is not None:
+            self.text.append(data)
+
+    def convert_cell(self):
+        if not self.data_only and self.formula is not None:
+            value = "=" + self.formula
+            if self.formula_attrs.get("t") == "shared":
+                shared_index = self.formula_attrs.get("si")
+                coordinate = self.cell_ref or f"{get_column_letter(self.cell_col)}{self.row_idx}"
+                if shared_index in self.shared_formulae:
+                    value = self.shared_formulae[shared_index].translate_formula(coordinate)
+                elif value != "=":
+                    self.shared_formulae[shared_index] = Translator(value, coordinate)
+            return value
+
+        cell_type = self.cell_type
+        if cell_type == "inlineStr":
+            return "".join(self.inline) if self.inline is not None else None
+        text = self.raw_value
+        if not text:
+            return None
+        if cell_type == "n":
+            value = _cast_number(text)
+            if self.cell_style in self.date_styles:
+                try:
+                    return from_excel(value, self.epoch, timedelta=self.cell_style in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return value
+        if cell_type == "s":
+            return self.reader.shared_strings[int(text)]
+        if cell_type == "b":
+            return bool(int(text))
+        if cell_type == "d":
+            return from_ISO8601(text)
+        return text
 
-def append_interest_rows(ws, template_cache, template_height, template_row_index: int, rows: Iterable[Sequence], label: str) -> int:
-    added = 0
-    start_row = find_last_data_row(ws)
 
-    for record in rows:
-        target_row = start_row + added + 1
-        apply_template_row(ws, template_cache, target_row, template_row_index, template_height)
+# =============================================================================
+# 数据源读取器（按扩展名选择）
+# 五个数据源都经 iter_source_rows 读取，读取器约定与 XlsxStreamReader 相同：
+# - 上下文管理器，iter_rows(columns, sheet_name, min_row, data_only) 逐行产出行元组；
+# - 列按位置对应（第 1 列即 A 列），行元组按请求列的最大序号补齐，跳过表头与请求列全部为空的行。
+# CSV 逐行流式读取（UTF-8 / GBK 自动识别），Parquet 按批读取（需要 pyarrow）；
+# 两者没有单元格类型，取值经 source_cell_value 规范为 xlsx 读取时的类型（数值、datetime、None），
+# 之后的日期筛选与字段映射对所有格式一致。
+# =============================================================================
 
-        set_cell(ws, target_row, COL_D, record[REPAY_COL_O - 1])
-        set_cell(ws, target_row, COL_G, record[REPAY_COL_B - 1])
-        g_cell = ws.cell(row=target_row, column=COL_G)
-        base_alignment = g_cell.alignment or Alignment()
-        if hasattr(base_alignment, "copy"):
-            g_cell.alignment = base_alignment.copy(wrap_text=False, horizontal="left")
-        else:  # pragma: no cover - compatibility fallback
-            g_cell.alignment = Alignment(wrap_text=False, horizontal="left", vertical=base_alignment.vertical)
-        set_cell(ws, target_row, COL_J, None)
-        set_cell(ws, target_row, COL_K, record[REPAY_COL_AE - 1])
-        set_cell(ws, target_row, COL_L, "/")
+CSV_SNIFF_BYTES = 1 << 16
+CSV_FALLBACK_ENCODING = "gb18030"  # GBK 的超集
+# 数值文本：不含前导零且不超过 15 位整数（更长的编号、证件号保持文本，避免丢失精度）
+SOURCE_NUMBER_RE = re.compile(r"-?(?:0|[1-9][0-9]{0,14})(?:\.[0-9]+)?")
+SOURCE_DATETIME_RE = re.compile(r"[0-9]{4}([-/])[0-9]{1,2}\1[0-9]{1,2}(?:[ T][0-9]{1,2}:[0-9]{2}(?::[0-9]{2})?)?")
+SOURCE_DATETIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M",
+                           "%Y-%m-%d")
 
-        prefix_date = extract_date_prefix(record[REPAY_COL_AC - 1])
-        set_cell(ws, target_row, COL_M, prefix_date)
-        set_cell(ws, target_row, COL_N, prefix_date)
-        set_cell(ws, target_row, COL_O, record[REPAY_COL_AD - 1])
 
-        set_cell(ws, target_row, COL_P, None)
-        set_cell(ws, target_row, COL_Q, None)
-        set_cell(ws, target_row, COL_W, None)
+def source_cell_value(value):
+    """ CSV 文本与 Parquet 取值转为 xlsx 读取时的类型：空值为 None，数值文本为 int / float，日期为 datetime """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return None
+        if SOURCE_NUMBER_RE.fullmatch(text):
+            return _cast_number(text)
+        if SOURCE_DATETIME_RE.fullmatch(text):
+            normalized = text.replace("/", "-")
+            for fmt in SOURCE_DATETIME_FORMATS:
+                try:
+                    return dt.datetime.strptime(normalized, fmt)
+                except ValueError:
+                    continue
+        return value
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float):
+        return None if value != value else value
+    if isinstance(value, Decimal):
+        return _cast_number(str(value))
+    if isinstance(value, dt.datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, dt.date):
+        return dt.datetime.combine(value, dt.time())
+    return value
 
-        t_value = record[REPAY_COL_Y - 1]
-        if t_value in (None, ""):
-            t_value = record[REPAY_COL_X - 1]
-        set_cell(ws, target_row, COL_T, t_value)
 
-        # amount = normalize_amount_to_10k(record[REPAY_COL_AG - 1])
-        # set_cell(ws, target_row, COL_U, amount)
-        # set_cell(ws, target_row, COL_V, amount)
-        # set_cell(ws, target_row, COL_AA, amount)
-        set_cell(ws, target_row, COL_U, record[REPAY_COL_AG - 1])
-        set_cell(ws, target_row, COL_V, record[REPAY_COL_AG - 1])
-        set_cell(ws, target_row, COL_AA, record[REPAY_COL_AG - 1])
+def detect_csv_encoding(path: Path) -> str:
+    """ 按文件开头判断编码：带 BOM 或能按 UTF-8 解码时为 UTF-8，否则按 GBK（gb18030）读取 """
+    with open(path, "rb") as source:
+        head = source.read(CSV_SNIFF_BYTES)
+    try:
+        # 增量解码：截断在多字节字符中间不算错误
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return CSV_FALLBACK_ENCODING
+    return "utf-8-sig"
 
-        set_cell(ws, target_row, COL_S, f"=ROUND(U{target_row}*360/T{target_row}/R{target_row},2)")
 
-        added += 1
+class SourceReader(ABC):
+    """ 非 xlsx 读取器的基类；XlsxStreamReader 按同样的约定实现 """
 
-    if added:
-        print(f"[利息缴纳] {label}新增 {added} 行")
-    return added
+    def __init__(self, path: Path):
+        self.path = Path(path)
 
+    def __enter__(self) -> "SourceReader":
+        return self
 
-def merge_ai_with_sum(ws, start_row: int, end_row: int, target_date: dt.date):
-    if start_row > end_row:
-        return
+    def __exit__(self, *exc_info):
+        self.close()
 
-    def finalize(group: List[int], ar_value):
-        if not group:
-            return
-        total = 0.0
-        for r in group:
-            val = ws.cell(row=r, column=COL_AH).value
-            if isinstance(val, (int, float)):
-                total += float(val)
-            elif val not in (None, ""):
-                try:
-                    total += float(val)
-                except Exception:
-                    pass
-        top = group[0]
-        set_cell(ws, top, COL_AI, total)
-        if len(group) > 1:
-            ws.merge_cells(start_row=top, end_row=group[-1], start_column=COL_AI, end_column=COL_AI)
-
-    current_group: List[int] = []
-    current_ar = None
-
-    for row_idx in range(start_row, end_row + 1):
-        ae_date = normalize_excel_date(ws.cell(row=row_idx, column=COL_AE).value)
-        ar_value = ws.cell(row=row_idx, column=COL_AR).value
-        if ae_date == target_date and ar_value not in (None, ""):
-            if current_ar is None:
-                current_ar = ar_value
-                current_group = [row_idx]
-            elif ar_value == current_ar:
-                current_group.append(row_idx)
-            else:
-                finalize(current_group, current_ar)
-                current_ar = ar_value
-                current_group = [row_idx]
-        else:
-            finalize(current_group, current_ar)
-            current_group = []
-            current_ar = None
+    def close(self):
+        pass
 
-    finalize(current_group, current_ar)
+    @abstractmethod
+    def iter_rows(self, columns: Iterable[int], sheet_name: Optional[str] = None, min_row: int = 2,
+                  data_only: bool = False) -> Iterator[tuple]:
+        """ 从 min_row 行起逐行产出按 columns 最大序号补齐的行元组，全空行跳过 """
 
+    @staticmethod
+    def project(cells: Iterable[tuple], width: int) -> Optional[tuple]:
+        """ cells 为 (列序号, 原始取值)，规范类型后放入补齐的行元组；全部为空时返回 None """
+        row = [None] * width
+        found = False
+        for col_idx, value in cells:
+            value = source_cell_value(value)
+            if value is not None:
+                row[col_idx - 1] = value
+                found = True
+        return tuple(row) if found else None
 
-# =============================================================================
-# 资产明细 Sheet 处理函数
-# =============================================================================
 
-def append_asset_detail_block(ws, template_cache, template_height, template_row_index: int, rows: Iterable[Sequence]) -> int:
+class CsvSourceReader(SourceReader):
     """
-    向【资产明细】sheet 追加放款明细数据
-    数据来源：放款明细表，筛选条件为 P 列实际放款日期 = 目标日期
+    CSV 数据源：只有一张表，sheet_name 忽略；第 1 行为表头。
+    offset 非零时从该字节位置（上次读到的文件末尾）开始读取，此时没有表头，调用方传 min_row=1。
     """
-    added = 0
-    start_row = ws.max_row
-    for record in rows:
-        target_row = start_row + added + 1
-        apply_template_row(ws, template_cache, target_row, template_row_index, template_height)
-
-        # A列：公式 =ROW()-3
-        set_cell(ws, target_row, COL_A, f"=ROW()-3")
-        # C列：放款明细 B列 业务来源
-        set_cell(ws, target_row, COL_C, record[LOAN_COL_B - 1])
-        # D列：固定为"宁波国富商业保理有限公司"
-        set_cell(ws, target_row, COL_D, "宁波国富商业保理有限公司")
-        # E列：放款明细 AA列 所属行业
-        set_cell(ws, target_row, COL_E, record[LOAN_COL_AA - 1])
-        # F列：放款明细 E列 经济成分
-        set_cell(ws, target_row, COL_F, record[LOAN_COL_E - 1])
-        # G列：放款明细 F列 企业规模
-        set_cell(ws, target_row, COL_G, record[LOAN_COL_F - 1])
-        # H列：放款明细 AI列 产品名称
-        set_cell(ws, target_row, COL_H, record[LOAN_COL_AI - 1])
-        # I列：放款明细 AC列 是否票据增信
-        set_cell(ws, target_row, COL_I, record[LOAN_COL_AC - 1])
-        # J列：放款明细 AF列 有/无追索权
-        loan_j = record[LOAN_COL_AF - 1]
-        if isinstance(loan_j, str):
-            if loan_j.strip() == '有追':
-                # strip() 方法用于移除字符串开头和结尾的空白字符（包括空格、制表符、换行符等）。
-                loan_j = '有追索权'
-            elif loan_j.strip() == '无追':
-                loan_j = '无追索权'
-        set_cell(ws, target_row, COL_J, loan_j)
-        # K列：放款明细 AG列 明暗保
-        loan_k = record[LOAN_COL_AG - 1]
-        if isinstance(loan_k, str):
-            if loan_k.strip() == '明保':
-                loan_k = '明保理'
-            elif loan_k.strip() == '暗保':
-                loan_k = '暗保理'
-        set_cell(ws, target_row, COL_K, loan_k)
-        # M列：放款明细 AJ列 单据类型
-        set_cell(ws, target_row, COL_M, record[LOAN_COL_AJ - 1])
-        # N列：放款明细 AH列 正反向
-        set_cell(ws, target_row, COL_N, record[LOAN_COL_AH - 1])
-        # O列：填入公式 =XLOOKUP(AG10000,中登登记表!J:J,中登登记表!U:U)，其中 AG10005 中的 10005 表示当前行号
-        set_cell(ws, target_row, COL_O, f"=XLOOKUP(AG{target_row},中登登记表!J:J,中登登记表!U:U)")
-        # P列：放款明细 C列 保理/再保理申请人名称
-        set_cell(ws, target_row, COL_P, record[LOAN_COL_C - 1])
-        # Q列：放款明细 D列 统一社会信用代码
-        set_cell(ws, target_row, COL_Q, record[LOAN_COL_D - 1])
-        # R列：放款明细 G列 基础交易对手方名称（买方/卖方）
-        set_cell(ws, target_row, COL_R, record[LOAN_COL_G - 1])
-        # S列：放款明细 S列 收票方名称(多个逗号分割)
-        set_cell(ws, target_row, COL_S, record[LOAN_COL_S - 1])
-        # T列：放款明细 T列 付款方式
-        set_cell(ws, target_row, COL_T, record[LOAN_COL_T - 1])
-        # U列：放款明细 U列 放款账户开户行
-        set_cell(ws, target_row, COL_U, record[LOAN_COL_U - 1])
-        # V列：放款明细 K列 资产编号
-        set_cell(ws, target_row, COL_V, record[LOAN_COL_K - 1])
-        # W列：放款明细 L列 融资申请号
-        set_cell(ws, target_row, COL_W, record[LOAN_COL_L - 1])
-        # X列：放款明细 L列 融资申请号（同W列）
-        set_cell(ws, target_row, COL_X, record[LOAN_COL_L - 1])
-        # Y列：放款明细 AL列 转让日
-        set_cell(ws, target_row, COL_Y, record[LOAN_COL_AL - 1])
-        # Z列：放款明细 AQ列 应收账款金额/价值
-        set_cell(ws, target_row, COL_Z, record[LOAN_COL_AQ - 1])
-        # AA列：放款明细 AR列 转让总金额
-        set_cell(ws, target_row, COL_AA, record[LOAN_COL_AR - 1])
-        # AB列：放款明细 AO列 原始账款到期日
-        set_cell(ws, target_row, COL_AB, record[LOAN_COL_AO - 1])
-        # AD列：放款明细 AM列 转让通知函编号
-        set_cell(ws, target_row, COL_AD, record[LOAN_COL_AM - 1])
-        # AG列：放款明细 AN列 中登登记编号
-        set_cell(ws, target_row, COL_AG, record[LOAN_COL_AN - 1])
-        # AH列：固定为"正常"
-        set_cell(ws, target_row, COL_AH, "正常")
-
-        added += 1
-    return added
 
+    def __init__(self, path: Path, offset: int = 0):
+        super().__init__(path)
+        self.encoding = detect_csv_encoding(self.path)
+        raw = open(self.path, "rb")
+        raw.seek(offset)
+        self._handle = io.TextIOWrapper(raw, encoding=self.encoding, newline="")
+
+    def close(self):
+        self._handle.close()
+
+    def iter_rows(self, columns: Iterable[int], sheet_name: Optional[str] = None, min_row: int = 2,
+                  data_only: bool = False) -> Iterator[tuple]:
+        wanted = sorted(set(columns))
+        width = wanted[-1]
+        for row_idx, values in enumerate(csv.reader(self._handle), start=1):
+            if row_idx < min_row:
+                continue
+            count = len(values)
+            row = self.project(((col_idx, values[col_idx - 1]) for col_idx in wanted if col_idx <= count), width)
+            if row is not None:
+                yield row
 
-# =============================================================================
-# 中登登记表 Sheet 处理函数
-# =============================================================================
 
-def append_zhongdeng_block(ws, template_cache, template_height, template_row_index: int, rows: Iterable[Sequence]) -> int:
-    added = 0
-    start_row = ws.max_row
-    for record in rows:
-        target_row = start_row + added + 1
-        apply_template_row(ws, template_cache, target_row, template_row_index, template_height)
-
-        set_cell(ws, target_row, COL_A, "=ROW()-1")
-        set_cell(ws, target_row, COL_B, None)
-        set_cell(ws, target_row, COL_C, record[ZD_COL_C - 1])
-        set_cell(ws, target_row, COL_D, record[ZD_COL_D - 1])
-        set_cell(ws, target_row, COL_F, record[ZD_COL_E - 1])
-        set_cell(ws, target_row, COL_G, record[ZD_COL_F - 1])
-        zh_g_value = record[ZD_COL_G - 1]
-        set_cell(ws, target_row, COL_H, "" if zh_g_value is None else str(zh_g_value))
-        ws.cell(row=target_row, column=COL_H).number_format = "@"
-        set_cell(ws, target_row, COL_I, record[ZD_COL_H - 1])
-        set_cell(ws, target_row, COL_J, record[ZD_COL_I - 1])
-        set_cell(ws, target_row, COL_K, record[ZD_COL_J - 1])
-        ws.cell(row=target_row, column=COL_K).alignment = Alignment(wrap_text=False, horizontal="center", vertical="center")
-        set_cell(ws, target_row, COL_L, record[ZD_COL_K - 1])
-        set_cell(ws, target_row, COL_M, record[ZD_COL_L - 1])
-        ws.cell(row=target_row, column=COL_M).alignment = Alignment(wrap_text=False, horizontal="center", vertical="center")
-        set_cell(ws, target_row, COL_N, record[ZD_COL_M - 1])
-        set_cell(ws, target_row, COL_O, record[ZD_COL_N - 1])
-        set_cell(ws, target_row, COL_P, record[ZD_COL_O - 1])
-        set_cell(ws, target_row, COL_Q, record[ZD_COL_P - 1])
-        set_cell(ws, target_row, COL_R, "/")
-        set_cell(ws, target_row, COL_S, record[ZD_COL_R - 1])
-        set_cell(ws, target_row, COL_T, record[ZD_COL_S - 1])
-        set_cell(ws, target_row, COL_U, record[ZD_COL_T - 1])
-        set_cell(ws, target_row, COL_V, record[ZD_COL_U - 1])
-        set_cell(ws, target_row, COL_W, record[ZD_COL_W - 1])
-        set_cell(ws, target_row, COL_X, record[ZD_COL_X - 1])
-        set_cell(ws, target_row, COL_Y, record[ZD_COL_Y - 1])
-
-        added += 1
-    return added
-
-
-def process_financing_repayment_sheet(wb, loan_rows: List[Sequence], factoring_repay_rows: List[Sequence],
-                                       refactoring_repay_rows: List[Sequence], target_date: dt.date) -> int:
+class ParquetSourceReader(SourceReader):
     """
-    处理【融资及还款明细】sheet
-    返回新增行数
+    Parquet 数据源：列名即表头，第一条记录对应 xlsx 的第 2 行；sheet_name 忽略。
+    只读取请求的列（按 schema 中的位置），按批转换，内存只随批大小增长。
     """
-    ws = find_sheet_by_name(wb, SHEET_FINANCING_REPAYMENT)
-    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
-    template_height = ws.row_dimensions[TEMPLATE_ROW_INDEX].height
 
-    last_date = get_last_existing_date(ws)
-    if last_date and target_date <= last_date:
-        print(f"[融资及还款明细] 无需更新（{target_date} <= {last_date}）")
-        return 0
+    def __init__(self, path: Path):
+        super().__init__(path)
+        try:
+            import pyarrow.parquet as parquet
+        except ImportError:
+            raise SystemExit(f"读取 Parquet 数据源需要安装 pyarrow（pip install pyarrow）：{self.path}")
+        self._handle = open(self.path, "rb")
+        self._file = parquet.ParquetFile(self._handle)
+
+    def close(self):
+        self._handle.close()
+
+    def iter_rows(self, columns: Iterable[int], sheet_name: Optional[str] = None, min_row: int = 2,
+                  data_only: bool = False) -> Iterator[tuple]:
+        wanted = sorted(set(columns))
+        width = wanted[-1]
+        names = self._file.schema_arrow.names
+        present = [col_idx for col_idx in wanted if col_idx <= len(names)]
+        if not present:
+            return
+        for batch in self._file.iter_batches(columns=[names[col_idx - 1] for col_idx in present]):
+            arrays = [batch.column(index).to_pylist() for index in range(len(present))]
+            for values in zip(*arrays):
+                row = self.project(zip(present, values), width)
+                if row is not None:
+                    yield row
 
-    append_start_row = find_last_data_row(ws) + 1
 
-    total_added = 0
-    total_added += append_loan_block(ws, template_cache, template_height, TEMPLATE_ROW_INDEX, loan_rows)
-    total_added += append_repay_block(ws, template_cache, template_height, TEMPLATE_ROW_INDEX, factoring_repay_rows, "保理")
-    total_added += append_repay_block(ws, template_cache, template_height, TEMPLATE_ROW_INDEX, refactoring_repay_rows, "再保理")
+SOURCE_READERS: Dict[str, type] = {
+    ".xlsx": XlsxStreamReader,
+    ".csv": CsvSourceReader,
+    ".parquet": ParquetSourceReader,
+}
 
-    if total_added:
-        merge_ai_with_sum(ws, append_start_row, ws.max_row, target_date)
-        apply_b_column_conditional_format(ws, append_start_row, ws.max_row)
 
-    print(f"[融资及还款明细] 新增 {total_added} 行：放款 {len(loan_rows)}，保理还款 {len(factoring_repay_rows)}，再保理还款 {len(refactoring_repay_rows)}")
-    return total_added
+def open_source_reader(path: Path):
+    """ 按扩展名选择读取器，未知扩展名按 xlsx 读取 """
+    reader_type = SOURCE_READERS.get(Path(path).suffix.lower(), XlsxStreamReader)
+    return reader_type(path)
 
 
-def process_asset_detail_sheet(wb, loan_rows: List[Sequence], target_date: dt.date) -> int:
-    """
-    处理【资产明细】sheet
-    数据来源仅为放款明细
-    返回新增行数
-    """
-    ws = find_sheet_by_name(wb, SHEET_ASSET_DETAIL)
-    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
-    template_height = ws.row_dimensions[TEMPLATE_ROW_INDEX].height
+def iter_source_rows(path: Path, columns: Iterable[int], sheet_name: Optional[str] = None,
+                     data_only: bool = False) -> Iterator[tuple]:
+    """ 逐行读取数据源（跳过表头），仅构造 columns 指定的列 """
+    with open_source_reader(path) as reader:
+        yield from reader.iter_rows(columns, sheet_name=sheet_name, min_row=2, data_only=data_only)
 
-    total_added = append_asset_detail_block(ws, template_cache, template_height, TEMPLATE_ROW_INDEX, loan_rows)
 
-    print(f"[资产明细] 新增 {total_added} 行")
-    return total_added
+# =============================================================================
+# 数据源解析缓存
+# 累计型的放款明细/还款明细每天都会被重新解析，这里把解析结果按筛选日期
+# （放款 P 列、还款 AE 列）分区，以列式结构持久化到本地缓存目录。
+# 缓存键 = 文件内容哈希 + 大小 + mtime，文件变化后自动失效；目录总大小按 LRU 淘汰。
+# =============================================================================
 
+SOURCE_CACHE_VERSION = 2
+SOURCE_CACHE_DEFAULT_MAX_MB = 1024
+SOURCE_CACHE_INDEX = "index.pkl"
+SOURCE_CACHE_ENV = "LEDGER_DAILY_CACHE_DIR"
 
-def process_zhongdeng_sheet(wb, zhongdeng_rows: List[Sequence]) -> int:
-    if not zhongdeng_rows:
-        print("[中登登记表] 匹配到 0 行，跳过追加")
-        return 0
 
-    ws = find_sheet_by_name(wb, SHEET_ZHONGDENG)
-    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
-    template_height = ws.row_dimensions[TEMPLATE_ROW_INDEX].height
+def default_cache_dir() -> Path:
+    override = os.environ.get(SOURCE_CACHE_ENV)
+    if override:
+        return Path(override)
+    if os.name == "nt":
+        base = Path(os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local")
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return base / "gf-excel-electron" / "ledger_daily"
 
-    added = append_zhongdeng_block(ws, template_cache, template_height, TEMPLATE_ROW_INDEX, zhongdeng_rows)
-    print(f"[中登登记表] 新增 {added} 行")
-    return added
 
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def process_interest_sheet(wb, factoring_interest_rows: List[Sequence], refactoring_interest_rows: List[Sequence]) -> int:
-    if not factoring_interest_rows and not refactoring_interest_rows:
-        print("[利息缴纳] 目标日期无资金费记录，跳过")
-        return 0
 
-    ws = find_sheet_by_name(wb, SHEET_INTEREST)
-    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
-    template_height = ws.row_dimensions[TEMPLATE_ROW_INDEX].height
+def partition_name(day: dt.date) -> str:
+    return f"{day:%Y%m%d}.pkl"
 
-    total_added = 0
-    total_added += append_interest_rows(ws, template_cache, template_height, TEMPLATE_ROW_INDEX, factoring_interest_rows, "保理")
-    total_added += append_interest_rows(ws, template_cache, template_height, TEMPLATE_ROW_INDEX, refactoring_interest_rows, "再保理")
 
-    print(f"[利息缴纳] 合计新增 {total_added} 行")
-    return total_added
+class SourceCache:
+    """
+    数据源分区缓存，目录结构：
+        <root>/<kind>-<sha256>-<size>-<mtime_ns>/index.pkl
+        <root>/<kind>-<sha256>-<size>-<mtime_ns>/YYYYMMDD.pkl
+    每个分区文件保存 {"columns", "values"}，values 为逐列的值列表，读取时还原为对应的 SourceRecord。
+    对象本身只保存路径与上限，可随任务传入进程池。
+    """
 
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
 
-# =============================================================================
-# 客户表 Sheet 处理函数
-# =============================================================================
+    def entry_dir(self, path: Path, kind: str) -> Path:
+        stat = path.stat()
+        key = f"{kind}-v{SOURCE_CACHE_VERSION}-{hash_file(path)[:32]}-{stat.st_size}-{stat.st_mtime_ns}"
+        return self.root / key
 
-def collect_customer_names_from_financing(ws, target_date: dt.date) -> List[str]:
-    """
-    从【融资及还款明细】sheet 中筛选 W 列=目标日期的行，收集 H/I/J 列名称，按出现顺序去重
-    """
-    names: List[str] = []
-    seen: set[str] = set()
-    for row_idx in range(2, ws.max_row + 1):
-        loan_date = normalize_excel_date(ws.cell(row=row_idx, column=COL_W).value)
-        if loan_date != target_date:
-            continue
-        for col_idx in (COL_H, COL_I):
-            name = normalize_string(ws.cell(row=row_idx, column=col_idx).value)
-            if not name or name == "/":
+    def load(self, entry: Path, dates: Iterable[dt.date],
+             record_type: type) -> Optional[Dict[dt.date, List[SourceRecord]]]:
+        index_path = entry / SOURCE_CACHE_INDEX
+        if not index_path.exists():
+            return None
+        try:
+            with open(index_path, "rb") as handle:
+                available = pickle.load(handle)
+            result: Dict[dt.date, List[SourceRecord]] = {}
+            for day in dates:
+                if day not in available:
+                    result[day] = []
+                    continue
+                with open(entry / partition_name(day), "rb") as handle:
+                    result[day] = decode_partition(pickle.load(handle), record_type)
+        except Exception as exc:  # 缓存损坏时丢弃并重新解析
+            print(f"[缓存] 读取失败，重新解析：{entry.name}（{exc}）")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # 用 index 的 mtime 记录最近使用时间，供 LRU 淘汰
+        os.utime(index_path)
+        return result
+
+    def store(self, entry: Path, partitions: Dict[dt.date, List[SourceRecord]], record_type: type):
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{entry.name}-", dir=self.root))
+        try:
+            for day, rows in partitions.items():
+                with open(staging / partition_name(day), "wb") as handle:
+                    pickle.dump(encode_partition(rows, record_type), handle, protocol=pickle.HIGHEST_PROTOCOL)
+            # index 最后写入，存在即代表分区完整
+            with open(staging / SOURCE_CACHE_INDEX, "wb") as handle:
+                pickle.dump({day: len(rows) for day, rows in partitions.items()}, handle,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(staging, entry)
+        except OSError:
+            # 并发写入同一条目时以先完成者为准
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict(keep=entry)
+
+    def evict(self, keep: Optional[Path] = None):
+        entries = []
+        total = 0
+        for entry in self.root.iterdir():
+            index_path = entry / SOURCE_CACHE_INDEX
+            if not entry.is_dir() or not index_path.exists():
                 continue
-            if name not in seen:
-                seen.add(name)
-                names.append(name)
-    return names
+            size = sum(item.stat().st_size for item in entry.iterdir())
+            entries.append((index_path.stat().st_mtime, size, entry))
+            total += size
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            print(f"[缓存] 淘汰 {entry.name}（{size / 1024 / 1024:.1f} MB）")
 
 
-def collect_existing_customer_names(ws) -> set[str]:
-    existing: set[str] = set()
-    for row_idx in range(2, ws.max_row + 1):
-        name = normalize_string(ws.cell(row=row_idx, column=COL_E).value)
-        if name and name != "/":
-            existing.add(name)
-    return existing
+def encode_partition(records: List[SourceRecord], record_type: type) -> Dict[str, object]:
+    return {
+        "columns": record_type.COLUMNS,
+        "values": [list(values) for values in zip(*(record.values() for record in records))],
+    }
 
 
-def build_asset_lookup_for_customers(ws, target_names: set[str]) -> Dict[str, Dict[str, object]]:
+def decode_partition(payload: Dict[str, object], record_type: type) -> List[SourceRecord]:
+    if tuple(payload["columns"]) != record_type.COLUMNS:
+        raise ValueError("缓存分区的列与当前记录类型不一致")
+    return [record_type(*values) for values in zip(*payload["values"])]
+
+
+def collect_rows_by_date(path: Path, kind: str, record_type: type, date_col: int,
+                         dates: Iterable[dt.date], cache: Optional[SourceCache] = None) -> Dict[dt.date, List[SourceRecord]]:
     """
-    在【资产明细】sheet 中查找 P/R 列匹配的最早行，返回通道与日期信息
+    返回 {日期: 该日期的记录}（保持文件顺序），记录只投影 record_type.COLUMNS 中的列
+    启用缓存时：命中则只读取对应日期分区；未命中则完整解析一次并写入全部分区。
     """
-    if not target_names:
-        return {}
+    wanted = set(dates)
+    entry = None
+    if cache is not None:
+        entry = cache.entry_dir(path, kind)
+        cached = cache.load(entry, wanted, record_type)
+        if cached is not None:
+            return cached
 
-    lookup: Dict[str, Dict[str, object]] = {}
-    for row_idx in range(4, ws.max_row + 1):
-        for col_idx in (COL_P, COL_R):
-            candidate = normalize_string(ws.cell(row=row_idx, column=col_idx).value)
-            if candidate and candidate in target_names and candidate not in lookup:
-                lookup[candidate] = {
-                    "channel": ws.cell(row=row_idx, column=COL_C).value,
-                    "first_date": ws.cell(row=row_idx, column=COL_Y).value,
-                }
-        if len(lookup) == len(target_names):
-            break
-    return lookup
+    rows = iter_source_rows(path, record_type.COLUMNS)
+    partitions = {
+        day: [record_type.from_row(row) for row in day_rows]
+        for day, day_rows in DATE_NORMALIZER.partition(rows, date_col, None if entry is not None else wanted).items()
+    }
 
+    if entry is not None:
+        cache.store(entry, partitions, record_type)
+    return {day: partitions.get(day, []) for day in wanted}
 
-def get_source_cell(row: Sequence, col_idx: int):
-    if row is None or col_idx <= 0:
-        return None
-    idx = col_idx - 1
-    if idx < len(row):
-        return row[idx]
-    return None
 
+def collect_loan_rows_by_date(path: Path, dates: Iterable[dt.date],
+                              cache: Optional[SourceCache] = None) -> Dict[dt.date, List[LoanRecord]]:
+    return collect_rows_by_date(path, "loan", LoanRecord, LOAN_COL_P, dates, cache)
 
-def load_customer_source_map(path: Path) -> Dict[str, Sequence]:
-    wb = load_workbook(path, read_only=True, data_only=True)
-    try:
-        ws = wb[CUSTOMER_SOURCE_SHEET] if CUSTOMER_SOURCE_SHEET in wb.sheetnames else wb.active
-        # 修复第三方 Excel 文件 dimension 信息不正确的问题
-        ws.reset_dimensions()
-        mapping: Dict[str, Sequence] = {}
-        max_col = CUSTOMER_SRC_COL_REGION
-        for row in ws.iter_rows(min_row=2, max_col=max_col, values_only=True):
-            # read_only + reset_dimensions 会裁掉行尾的空单元格，这里补齐到预期列数避免索引越界
-            if len(row) < max_col:
-                row = tuple(row) + (None,) * (max_col - len(row))
-            name = normalize_string(get_source_cell(row, CUSTOMER_SRC_COL_NAME))
-            if not name or name == "/":
-                continue
-            if name not in mapping:
-                mapping[name] = row
-        return mapping
-    finally:
-        wb.close()
 
+def sort_repay_rows(rows: Iterable[RepayRecord]) -> List[RepayRecord]:
+    # 按交易银行流水号（AH）升序
+    return sorted(rows, key=lambda record: (record.AH is None, str(record.AH)))
+
+
+def split_repay_buckets(rows: Iterable[RepayRecord], fee_types: Optional[Iterable[str]] = None) -> Dict[str, List[RepayRecord]]:
+    """ 按 AB 列费用类型分桶；fee_types 为空时保留全部费用类型；每个桶均按 AH 升序返回 """
+    wanted = set(fee_types) if fee_types is not None else None
+    buckets: Dict[str, List[RepayRecord]] = {}
+    for row in rows:
+        fee_type = normalize_string(row.AB)
+        if wanted is not None and fee_type not in wanted:
+            continue
+        buckets.setdefault(fee_type, []).append(row)
+    return {fee_type: sort_repay_rows(rows) for fee_type, rows in buckets.items()}
+
+
+def collect_repay_buckets_by_date(path: Path, dates: Iterable[dt.date], fee_types: Optional[Iterable[str]] = None,
+                                  cache: Optional[SourceCache] = None) -> Dict[dt.date, Dict[str, List[RepayRecord]]]:
+    """ 单次遍历还款明细，同时为多个日期（AE 列）按费用类型分桶 """
+    rows_by_date = collect_rows_by_date(path, "repay", RepayRecord, REPAY_COL_AE, dates, cache)
+    return {day: split_repay_buckets(rows, fee_types) for day, rows in rows_by_date.items()}
+
+
+def scan_zhongdeng_candidates(path: Path, finance_codes: set[str]) -> List[ZhongdengRecord]:
+    """ 按文件顺序返回 C 列融资编号属于 finance_codes 的行（尚未去重） """
+    if not finance_codes:
+        return []
+    # 优先读取名为“中登登记表”的工作表，不存在时回退到活动工作表
+    return [
+        ZhongdengRecord.from_row(row)
+        for row in iter_source_rows(path, ZD_SOURCE_COLUMNS, sheet_name=SHEET_ZHONGDENG)
+        if normalize_string(row[ZD_COL_C - 1]) in finance_codes
+    ]
+
+
+def dedupe_zhongdeng_rows(rows: Iterable[ZhongdengRecord], finance_codes: set[str]) -> List[ZhongdengRecord]:
+    """ 在融资编号匹配的行中按 I 列登记编号去重（优先保留初始登记），再筛选初始登记 """
+    if not finance_codes:
+        return []
+
+    dedup: Dict[str, ZhongdengRecord] = {}
+    fallback_index = 0
+
+    for row in rows:
+        finance_code = normalize_string(row.C)
+        if not finance_code or finance_code not in finance_codes:
+            continue
+
+        reg_number = normalize_string(row.I)
+        reg_type = normalize_string(row.F)
+        key = reg_number or f"__row_{fallback_index}"
+        if not reg_number:
+            fallback_index += 1
+
+        existing = dedup.get(key)
+        if existing:
+            existing_type = normalize_string(existing.F)
+            if existing_type != "初始登记" and reg_type == "初始登记":
+                dedup[key] = row
+            continue
+
+        dedup[key] = row
+
+    return [
+        row
+        for row in dedup.values()
+        if normalize_string(row.F) == "初始登记"
+    ]
+
+
+def collect_zhongdeng_rows(path: Path, finance_codes: set[str]) -> List[ZhongdengRecord]:
+    return dedupe_zhongdeng_rows(scan_zhongdeng_candidates(path, finance_codes), finance_codes)
+
+
+def collect_zhongdeng_rows_by_date(path: Path, codes_by_date: Dict[dt.date, set[str]],
+                                   cache: Optional[SourceCache] = None) -> Dict[dt.date, List[ZhongdengRecord]]:
+    """
+    只扫描一次中登导出，再对每个日期的融资编号分别去重，结果与逐日调用 collect_zhongdeng_rows 相同
+    启用缓存时改为查询缓存目录中的中登索引（ZhongdengIndex），索引不可用时退回扫描
+    """
+    all_codes = set().union(*codes_by_date.values()) if codes_by_date else set()
+    candidates = None
+    if cache is not None and all_codes:
+        candidates = ZhongdengIndex(cache.root / ZHONGDENG_INDEX_NAME).candidates(path, all_codes)
+    if candidates is None:
+        candidates = scan_zhongdeng_candidates(path, all_codes)
+    return {day: dedupe_zhongdeng_rows(candidates, codes) for day, codes in codes_by_date.items()}
+
+
+# =============================================================================
+# 中登登记表导出索引（SQLite）
+# 中登导出是累计文件，每天只需按当日放款的融资编号取几十行。索引保存在缓存目录的 zhongdeng.sqlite3：
+# - registrations：融资编号非空的行，按文件顺序编号，带规范化的融资编号（C 列）与登记编号（I 列）及整行取值；
+# - meta：索引对应的文件哈希、已索引的行数与最后一行的指纹；CSV 另记已索引部分的字节数与哈希。
+# 文件未变化时直接查询；累计导出只在末尾追加时只补入新增行（CSV 从上次的字节位置继续读取，
+# 其他格式核对第 N 行的指纹后跳过前 N 行），否则整体重建。
+# 查询得到的候选行与 scan_zhongdeng_candidates 相同，再经 dedupe_zhongdeng_rows，去重与初始登记规则不变。
+# =============================================================================
+
+ZHONGDENG_INDEX_VERSION = 1
+ZHONGDENG_INDEX_NAME = "zhongdeng.sqlite3"
+ZHONGDENG_INDEX_BATCH = 5000
+SQLITE_MAX_PARAMS = 900
+
+
+def hash_file_with_prefix(path: Path, prefix_size: Optional[int]) -> tuple:
+    """ 读取一遍文件，返回 (整个文件的 sha256, 前 prefix_size 字节的 sha256)；文件不足该长度时后者为 None """
+    digest = hashlib.sha256()
+    prefix_digest = None
+    with open(path, "rb") as source:
+        if prefix_size:
+            remaining = prefix_size
+            while remaining > 0:
+                chunk = source.read(min(1 << 20, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+            if remaining == 0:
+                prefix_digest = digest.hexdigest()
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest(), prefix_digest
+
+
+def row_fingerprint(row: Sequence) -> str:
+    return hashlib.blake2b(repr(tuple(row)).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ZhongdengIndex:
+    """ 中登导出的 SQLite 索引；每次 candidates 调用先把索引同步到给定文件，再按融资编号查询 """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+
+    def candidates(self, path: Path, finance_codes: set[str]) -> Optional[List[ZhongdengRecord]]:
+        """ 同 scan_zhongdeng_candidates；索引无法使用时返回 None """
+        try:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            with closing(sqlite3.connect(self.db_path, timeout=60, isolation_level=None)) as conn:
+                # 多个进程同时运行时串行同步，避免重复建立
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._sync(conn, Path(path))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                return self._query(conn, finance_codes)
+        except sqlite3.Error as exc:
+            print(f"[中登索引] 不可用，改为全表扫描：{exc}")
+            if not isinstance(exc, sqlite3.OperationalError):
+                # 文件损坏：删除后下次重建
+                self.db_path.unlink(missing_ok=True)
+            return None
+
+    def _sync(self, conn: sqlite3.Connection, path: Path):
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS registrations (seq INTEGER PRIMARY KEY, finance_code TEXT NOT NULL, "
+                     "reg_number TEXT NOT NULL, payload BLOB NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS registrations_finance ON registrations (finance_code)")
+        conn.execute("CREATE INDEX IF NOT EXISTS registrations_reg ON registrations (reg_number)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'state'").fetchone()
+        state = json.loads(row[0]) if row else None
+        if state is not None and (state.get("version") != ZHONGDENG_INDEX_VERSION
+                                  or state.get("columns") != list(ZD_SOURCE_COLUMNS)):
+            state = None
+
+        is_csv = path.suffix.lower() == ".csv"
+        csv_size = state.get("csv_size") if state and is_csv else None
+        sha256, prefix_sha256 = hash_file_with_prefix(path, csv_size)
+        if state is not None and state["sha256"] == sha256:
+            return
+
+        if state is not None and csv_size and prefix_sha256 == state.get("csv_sha256"):
+            # CSV 只在末尾追加：从上次的文件末尾继续读取
+            with CsvSourceReader(path, offset=csv_size) as reader:
+                added = self._append(conn, state, reader.iter_rows(ZD_SOURCE_COLUMNS, min_row=1))
+            mode = f"追加 {added} 行"
+        else:
+            added = self._append_after_verified(conn, state, path)
+            mode = "重建" if added is None else f"追加 {added} 行"
+            if added is None:
+                conn.execute("DELETE FROM registrations")
+                state = {"rows": 0, "tail": None}
+                self._append(conn, state, iter_source_rows(path, ZD_SOURCE_COLUMNS, sheet_name=SHEET_ZHONGDENG))
+
+        state.update(version=ZHONGDENG_INDEX_VERSION, columns=list(ZD_SOURCE_COLUMNS), sha256=sha256,
+                     csv_size=path.stat().st_size if is_csv else None,
+                     csv_sha256=sha256 if is_csv else None)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('state', ?)", (json.dumps(state),))
+        print(f"[中登索引] {path.name}：{mode}，共 {state['rows']} 行")
+
+    def _append_after_verified(self, conn: sqlite3.Connection, state: Optional[dict], path: Path) -> Optional[int]:
+        """ 新文件第 N 行（已索引的末行）与记录的指纹一致时只补入其后的行，返回补入行数；否则返回 None """
+        if state is None or not state["rows"]:
+            return None
+        indexed = state["rows"]
+        rows = iter_source_rows(path, ZD_SOURCE_COLUMNS, sheet_name=SHEET_ZHONGDENG)
+        for ordinal, row in enumerate(rows, start=1):
+            if ordinal == indexed:
+                if row_fingerprint(row) != state["tail"]:
+                    return None
+                return self._append(conn, state, rows)
+        return None
+
+    def _append(self, conn: sqlite3.Connection, state: dict, rows: Iterable[tuple]) -> int:
+        """ 把 rows 接在已索引的行之后写入，更新 state 中的行数与末行指纹 """
+        batch = []
+        added = 0
+        seq = state["rows"]
+        last = None
+        for row in rows:
+            seq += 1
+            added += 1
+            last = row
+            finance_code = normalize_string(row[ZD_COL_C - 1])
+            if not finance_code:
+                continue
+            record = ZhongdengRecord.from_row(row)
+            batch.append((seq, finance_code, normalize_string(record.I),
+                          pickle.dumps(record.values(), protocol=pickle.HIGHEST_PROTOCOL)))
+            if len(batch) >= ZHONGDENG_INDEX_BATCH:
+                conn.executemany("INSERT INTO registrations VALUES (?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.executemany("INSERT INTO registrations VALUES (?, ?, ?, ?)", batch)
+        state["rows"] = seq
+        if last is not None:
+            state["tail"] = row_fingerprint(last)
+        return added
+
+    def _query(self, conn: sqlite3.Connection, finance_codes: set[str]) -> List[ZhongdengRecord]:
+        codes = sorted(finance_codes)
+        found = []
+        for start in range(0, len(codes), SQLITE_MAX_PARAMS):
+            chunk = codes[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+            found.extend(conn.execute(
+                f"SELECT seq, payload FROM registrations WHERE finance_code IN ({placeholders})", chunk))
+        found.sort(key=itemgetter(0))
+        return [ZhongdengRecord(*pickle.loads(payload)) for _, payload in found]
+
+
+# =============================================================================
+# 列映射规格
+# 各 sheet 追加行的“源列 → 目标列”规则集中声明，编译为逐行构造器（RowBuilder）：
+# 模板样式 / 公式与映射取值在同一遍中按列写入，每个单元格只取一次。
+# =============================================================================
+
+@dataclass(frozen=True)
+class ColumnMapping:
+    """
+    target：目标列；source：源记录字段（如 LoanRecord.AE）或 callable(record, row_idx)
+    transform：对取到的值再做转换
+    number_format：数字格式，callable 时按写入值返回格式（None 表示保留模板格式）
+    alignment：对齐，callable 时以当前（模板）对齐为参数返回新的对齐
+    """
+    target: int
+    source: object = None
+    transform: Optional[object] = None
+    number_format: Optional[object] = None
+    alignment: Optional[object] = None
+
+
+def value_of(value):
+    """ 固定取值 """
+    return lambda record, row_idx: value
+
+
+def row_formula(template: str):
+    """ 带当前行号的公式，如 "=VLOOKUP(AG{row},P:W,8,0)" """
+    return lambda record, row_idx: template.format(row=row_idx)
+
+
+def blank_columns(*columns: int) -> List[ColumnMapping]:
+    return [ColumnMapping(col_idx, value_of(None)) for col_idx in columns]
+
+
+def strip_business_word(value):
+    """ 业务类型去掉“业务”二字 """
+    return value.replace("业务", "") if isinstance(value, str) else value
+
+
+def map_factoring_visibility(value):
+    """ 明保 -> 明保理，暗保 -> 暗保理 """
+    if isinstance(value, str):
+        text = value.strip()
+        if text == "明保":
+            return "明保理"
+        if text == "暗保":
+            return "暗保理"
+    return value
+
+
+def map_recourse(value):
+    """ 有追 -> 有追索权，无追 -> 无追索权 """
+    if isinstance(value, str):
+        text = value.strip()
+        if text == "有追":
+            return "有追索权"
+        if text == "无追":
+            return "无追索权"
+    return value
+
+
+def default_slash(value):
+    return value if value not in (None, "") else "/"
+
+
+def map_business_mode(value):
+    """ 直接投放 -> 保理，其余 -> 再保理 """
+    return "保理" if isinstance(value, str) and value.strip() == "直接投放" else "再保理"
+
+
+def excel_datetime(value):
+    """
+    还款日期：导出中 datetime 与 Excel 序列号 / 日期文本混用，能解析的统一写成当日零点的 datetime，
+    整列都显示为日期；无法解析的原样写入
+    """
+    if isinstance(value, dt.datetime):
+        return value
+    parsed = normalize_excel_date(value)
+    return dt.datetime.combine(parsed, dt.time()) if parsed is not None else value
+
+
+def round_ratio(value):
+    return round(float(value), 4) if isinstance(value, (int, float)) else value
+
+
+def percent_format(value) -> Optional[str]:
+    return "0.00%" if isinstance(value, float) else None
+
+
+def text_or_empty(value) -> str:
+    return "" if value is None else str(value)
+
+
+def interest_rate_base(record, row_idx):
+    """ T 列：优先取 Y 列，为空时取 X 列 """
+    value = record.Y
+    return record.X if value in (None, "") else value
+
+
+def unwrap_left(base: Alignment) -> Alignment:
+    if hasattr(base, "copy"):
+        return base.copy(wrap_text=False, horizontal="left")
+    return Alignment(wrap_text=False, horizontal="left", vertical=base.vertical)  # pragma: no cover - compatibility fallback
+
+
+ALIGN_LEFT = Alignment(horizontal="left")
+ALIGN_CENTER = Alignment(horizontal="center")
+ALIGN_CENTER_NOWRAP = Alignment(wrap_text=False, horizontal="center", vertical="center")
+
+
+# 查找公式（--lookup-mode）：
+# - whole：整列引用（默认，与历史台账一致），如 =VLOOKUP(AG10,P:W,8,0)
+# - named：引用定义名称（LEDGER_*），每次运行结束前把名称区域移到数据末行
+# 曾经的 bounded 模式把写入时的数据末行固定在公式里（如 $P$1:$W$5000），之后追加的行永远查不到，已移除；
+# 这类公式可用 --rewrite-lookups 改写为当前模式。
+LOOKUP_MODE_WHOLE = "whole"
+LOOKUP_MODE_NAMED = "named"
+LOOKUP_MODES = (LOOKUP_MODE_WHOLE, LOOKUP_MODE_NAMED)
+
+# 查找公式 -> 各模式的公式模板（{row} 为当前行）
+LOOKUP_FORMULAS: Dict[str, Dict[str, str]] = {
+    "financing_vlookup": {
+        LOOKUP_MODE_WHOLE: "=VLOOKUP(AG{row},P:W,8,0)",
+        LOOKUP_MODE_NAMED: "=VLOOKUP(AG{row},LEDGER_FIN_P_W,8,0)",
+    },
+    "financing_xlookup": {
+        LOOKUP_MODE_WHOLE: "=XLOOKUP(AG{row},P:P,AD:AD)",
+        LOOKUP_MODE_NAMED: "=XLOOKUP(AG{row},LEDGER_FIN_P,LEDGER_FIN_AD)",
+    },
+    "asset_zhongdeng": {
+        LOOKUP_MODE_WHOLE: "=XLOOKUP(AG{row},中登登记表!J:J,中登登记表!U:U)",
+        LOOKUP_MODE_NAMED: "=XLOOKUP(AG{row},LEDGER_ZD_J,LEDGER_ZD_U)",
+    },
+}
+
+# 旧版 bounded 模式写入的公式（{end} 为写入时的数据末行），只用于 --rewrite-lookups 识别
+LEGACY_BOUNDED_LOOKUPS: Dict[str, str] = {
+    "financing_vlookup": "=VLOOKUP(AG{row},$P$1:$W${end},8,0)",
+    "financing_xlookup": "=XLOOKUP(AG{row},$P$1:$P${end},$AD$1:$AD${end})",
+    "asset_zhongdeng": "=XLOOKUP(AG{row},中登登记表!$J$1:$J${end},中登登记表!$U$1:$U${end})",
+}
+
+# named 模式的定义名称：名称 -> (sheet, 区域模板)
+LOOKUP_NAMES: Dict[str, tuple] = {
+    "LEDGER_FIN_P_W": (SHEET_FINANCING_REPAYMENT, "$P$1:$W${end}"),
+    "LEDGER_FIN_P": (SHEET_FINANCING_REPAYMENT, "$P$1:$P${end}"),
+    "LEDGER_FIN_AD": (SHEET_FINANCING_REPAYMENT, "$AD$1:$AD${end}"),
+    "LEDGER_ZD_J": (SHEET_ZHONGDENG, "$J$1:$J${end}"),
+    "LEDGER_ZD_U": (SHEET_ZHONGDENG, "$U$1:$U${end}"),
+}
+
+# --rewrite-lookups 改写已有查找公式的位置：(sheet, 列, 查找公式)
+LOOKUP_CELLS = (
+    (SHEET_FINANCING_REPAYMENT, COL_AO, "financing_vlookup"),
+    (SHEET_FINANCING_REPAYMENT, COL_AQ, "financing_xlookup"),
+    (SHEET_ASSET_DETAIL, COL_O, "asset_zhongdeng"),
+)
+
+
+def normalize_lookup_formula(text: str) -> str:
+    """
+    识别查找公式用的规范形式：去掉绝对引用的 $、空白与工作表名的引号并统一大写，
+    历史台账中的 $P:$W、中登登记表!$J:$J、'中登登记表'!J:J 与脚本写入的 P:W、中登登记表!J:J 视为同一写法
+    """
+    return re.sub(r"[$'\s]", "", text).upper()
+
+
+def lookup_formula_pattern(template: str) -> "re.Pattern":
+    """ 公式模板 -> 匹配 normalize_lookup_formula 规范形式的整串正则，第 1 组为 {row} 对应的行号 """
+    pattern = re.escape(normalize_lookup_formula(template))
+    pattern = pattern.replace(re.escape("{ROW}"), r"([1-9][0-9]*)", 1)
+    pattern = pattern.replace(re.escape("{END}"), r"[1-9][0-9]*")
+    return re.compile(pattern + "$")
+
+
+@dataclass(frozen=True)
+class LookupRef:
+    """ 列映射中的查找公式占位，由 LookupFormulas 按 --lookup-mode 生成 """
+    kind: str
+
+
+class LookupFormulas:
+    """ 一次运行内的查找公式生成器 """
+
+    def __init__(self, mode: str = LOOKUP_MODE_WHOLE):
+        self.mode = mode
+
+    def render(self, kind: str, row_idx: int) -> str:
+        return LOOKUP_FORMULAS[kind][self.mode].format(row=row_idx)
+
+    def source(self, kind: str):
+        return lambda record, row_idx: self.render(kind, row_idx)
+
+    def finalize(self, wb, rewrite: bool = False):
+        """ 保存前调用：named 模式更新定义名称；rewrite 时把已有的其他写法改写为当前模式 """
+        if self.mode == LOOKUP_MODE_NAMED:
+            for name, (title, area) in LOOKUP_NAMES.items():
+                if title in wb.sheetnames:
+                    set_defined_name(wb, name, f"{quote_sheetname(title)}!{area.format(end=wb[title].max_row)}")
+        if rewrite:
+            self.rewrite_existing(wb)
+
+    def rewrite_existing(self, wb):
+        """
+        整列、定义名称与旧版 bounded 写法中不属于当前模式的公式，按原行号改写为当前模式；
+        列中不是任何已知写法的公式单元格只计数并打印，不改动
+        """
+        for title, col_idx, kind in LOOKUP_CELLS:
+            if title not in wb.sheetnames:
+                continue
+            ws = wb[title]
+            current = lookup_formula_pattern(LOOKUP_FORMULAS[kind][self.mode])
+            templates = [template for mode, template in LOOKUP_FORMULAS[kind].items() if mode != self.mode]
+            patterns = [lookup_formula_pattern(template) for template in templates + [LEGACY_BOUNDED_LOOKUPS[kind]]]
+            rewritten = unknown = 0
+            for row_idx in range(1, ws.max_row + 1):
+                value = peek_cell_value(ws, row_idx, col_idx)
+                if not isinstance(value, str) or not value.startswith("="):
+                    continue
+                text = normalize_lookup_formula(value)
+                if current.match(text) is not None:
+                    continue
+                for pattern in patterns:
+                    match = pattern.match(text)
+                    if match is not None:
+                        ws.cell(row=row_idx, column=col_idx).value = self.render(kind, int(match.group(1)))
+                        rewritten += 1
+                        break
+                else:
+                    unknown += 1
+            letter = get_column_letter(col_idx)
+            print(f"[{title}] {letter} 列改写 {rewritten} 个查找公式（{self.mode}）")
+            if unknown:
+                print(f"[{title}] {letter} 列有 {unknown} 个公式不是已知的查找公式写法，未改写")
+
+
+def set_defined_name(wb, name: str, ref: str):
+    """ 新增或更新工作簿级定义名称 """
+    if hasattr(wb, "set_defined_name"):
+        wb.set_defined_name(name, ref)
+        return
+    wb.defined_names.add(DefinedName(name, attr_text=ref))
+
+
+class RowBuilder:
+    """
+    由模板行缓存（cache_template_row）与列映射编译出的逐行构造器，分两步：
+    - render：按列算出取值（映射列取映射值，其余列取模板值，公式由 FormulaTemplate 按目标行平移），结果是纯数据；
+    - write：每列只取一次单元格，套用模板样式（映射列的格式 / 对齐覆盖取自 TemplateStylePool 的变体）并写入取值。
+    取值方式在编译时确定。
+    """
+
+    def __init__(self, template_cache, template_height: Optional[float], mappings: Sequence[ColumnMapping],
+                 lookups: Optional[LookupFormulas] = None):
+        self.template_height = template_height
+        lookups = lookups or LookupFormulas()
+        by_target = {mapping.target: mapping for mapping in mappings}
+        plan = []
+        getters = []
+        for col_idx in sorted(set(template_cache) | set(by_target)):
+            meta = template_cache.get(col_idx)
+            mapping = by_target.get(col_idx)
+            style = meta.get("style") if meta else None
+            if mapping is not None:
+                source = mapping.source
+                if isinstance(source, MemberDescriptorType):
+                    source = (lambda field: lambda record, row_idx: field.__get__(record))(source)
+                elif isinstance(source, LookupRef):
+                    source = lookups.source(source.kind)
+                number_format, align = mapping.number_format, mapping.alignment
+                if meta is not None:
+                    # 有模板样式时覆盖项折算为样式池中的变体，写入时只赋值 _style（不经过 setter）
+                    style = meta["styles"]
+                    if style is not None and callable(align):
+                        align = align(style.alignment or Alignment())
+                plan.append((col_idx, style, True, number_format, align))
+                getters.append((None, None, source, mapping.transform))
+            else:
+                formula = meta.get("formula") if meta["data_type"] == "f" else None
+                plan.append((col_idx, style, False, None, None))
+                getters.append((meta["value"], formula, None, None))
+        self.plan = plan
+        self.getters = getters
+        self.columns = tuple(entry[0] for entry in plan)
+
+    def render(self, record, row_idx: int) -> tuple:
+        """ 目标行各列（与 columns 对应）的取值 """
+        values = []
+        for tpl_value, formula, source, transform in self.getters:
+            if source is None:
+                values.append(formula.render(row_idx) if formula is not None else tpl_value)
+                continue
+            value = source(record, row_idx)
+            values.append(value if transform is None else transform(value))
+        return tuple(values)
+
+    def write(self, ws, row_idx: int, values: Sequence):
+        cell_at = ws.cell
+        for (col_idx, style, mapped, number_format, align), value in zip(self.plan, values):
+            cell = cell_at(row=row_idx, column=col_idx)
+            if not mapped:
+                if style is not None:
+                    cell._style = style
+                cell.value = value
+                continue
+            if style is not None:
+                fmt = number_format(value) if callable(number_format) else number_format
+                cell._style = style.for_value(value, align, fmt)
+                cell.value = value
+                continue
+            cell.value = value
+            if number_format is not None:
+                fmt = number_format(value) if callable(number_format) else number_format
+                if fmt is not None:
+                    cell.number_format = fmt
+            if align is not None:
+                cell.alignment = align(cell.alignment or Alignment()) if callable(align) else align
+
+        if self.template_height:
+            ws.row_dimensions[row_idx].height = self.template_height
+
+
+# 融资及还款明细：放款（B 列样式通过条件格式统一处理，不逐行应用；O 列保留模板公式 =GX&"-"&TX）
+FINANCING_LOAN_MAPPINGS = (
+    ColumnMapping(COL_C, value_of(None)),
+    ColumnMapping(COL_D, LoanRecord.B),
+    ColumnMapping(COL_E, LoanRecord.AE, strip_business_word),
+    ColumnMapping(COL_F, LoanRecord.AG, map_factoring_visibility),
+    ColumnMapping(COL_G, LoanRecord.K),
+    ColumnMapping(COL_H, LoanRecord.C),
+    ColumnMapping(COL_I, LoanRecord.G),
+    ColumnMapping(COL_J, LoanRecord.AZ, default_slash),
+    ColumnMapping(COL_K, LoanRecord.J, default_slash),
+    ColumnMapping(COL_L, LoanRecord.AA),
+    ColumnMapping(COL_N, LoanRecord.AK, alignment=ALIGN_LEFT),
+    ColumnMapping(COL_P, LoanRecord.M, alignment=ALIGN_CENTER),
+    ColumnMapping(COL_Q, LoanRecord.L),
+    ColumnMapping(COL_R, LoanRecord.AK, alignment=ALIGN_LEFT),
+    ColumnMapping(COL_S, LoanRecord.Y, map_business_mode),
+    ColumnMapping(COL_T, LoanRecord.N),
+    ColumnMapping(COL_U, LoanRecord.AW),
+    ColumnMapping(COL_V, LoanRecord.AW),
+    ColumnMapping(COL_W, LoanRecord.P),
+    ColumnMapping(COL_X, LoanRecord.BC),
+    ColumnMapping(COL_Z, LoanRecord.BF, round_ratio, number_format=percent_format),
+    ColumnMapping(COL_AB, LoanRecord.Q),
+    ColumnMapping(COL_AC, LoanRecord.T),
+    ColumnMapping(COL_AD, LoanRecord.U),
+    ColumnMapping(COL_AO, LookupRef("financing_vlookup")),
+    ColumnMapping(COL_AP, value_of(None)),
+    ColumnMapping(COL_AQ, LookupRef("financing_xlookup")),
+)
+
+
+def financing_repay_mappings(repay_type: str) -> tuple:
+    """ 融资及还款明细：保理 / 再保理还款（AK 列写入还款类型） """
+    return (
+        ColumnMapping(COL_C, value_of(None)),
+        ColumnMapping(COL_D, RepayRecord.G),
+        ColumnMapping(COL_E, RepayRecord.H, strip_business_word),
+        ColumnMapping(COL_F, RepayRecord.J, map_factoring_visibility),
+        ColumnMapping(COL_G, RepayRecord.M),
+        ColumnMapping(COL_H, RepayRecord.B),
+        ColumnMapping(COL_I, RepayRecord.C),
+        ColumnMapping(COL_J, value_of("/")),
+        ColumnMapping(COL_K, value_of("/")),
+        ColumnMapping(COL_L, RepayRecord.F),
+        *blank_columns(COL_M, COL_N, COL_O, COL_P, COL_Q, COL_R, COL_S, COL_T, COL_U, COL_V, COL_W,
+                       COL_X, COL_Y, COL_Z, COL_AA, COL_AB, COL_AC, COL_AD, COL_AP),
+        ColumnMapping(COL_AE, RepayRecord.AE, excel_datetime),
+        ColumnMapping(COL_AG, RepayRecord.O),
+        ColumnMapping(COL_AH, RepayRecord.AG),
+        ColumnMapping(COL_AI, RepayRecord.AG),
+        ColumnMapping(COL_AJ, RepayRecord.AE, excel_datetime),
+        ColumnMapping(COL_AK, value_of(repay_type)),
+        ColumnMapping(COL_AO, LookupRef("financing_vlookup")),
+        ColumnMapping(COL_AQ, LookupRef("financing_xlookup")),
+        ColumnMapping(COL_AR, RepayRecord.AH),
+    )
+
+
+# 利息缴纳：资金费（M/N 列取 AC 列“~”前的起息日）
+INTEREST_MAPPINGS = (
+    ColumnMapping(COL_D, RepayRecord.O),
+    ColumnMapping(COL_G, RepayRecord.B, alignment=unwrap_left),
+    ColumnMapping(COL_J, value_of(None)),
+    ColumnMapping(COL_K, RepayRecord.AE, excel_datetime),
+    ColumnMapping(COL_L, value_of("/")),
+    ColumnMapping(COL_M, RepayRecord.AC, lambda value: extract_date_prefix(value)),
+    ColumnMapping(COL_N, RepayRecord.AC, lambda value: extract_date_prefix(value)),
+    ColumnMapping(COL_O, RepayRecord.AD),
+    *blank_columns(COL_P, COL_Q, COL_W),
+    ColumnMapping(COL_T, interest_rate_base),
+    ColumnMapping(COL_U, RepayRecord.AG),
+    ColumnMapping(COL_V, RepayRecord.AG),
+    ColumnMapping(COL_AA, RepayRecord.AG),
+    ColumnMapping(COL_S, row_formula("=ROUND(U{row}*360/T{row}/R{row},2)")),
+)
+
+# 资产明细：放款
+ASSET_DETAIL_MAPPINGS = (
+    ColumnMapping(COL_A, value_of("=ROW()-3")),
+    ColumnMapping(COL_C, LoanRecord.B),                           # 业务来源
+    ColumnMapping(COL_D, value_of("宁波国富商业保理有限公司")),
+    ColumnMapping(COL_E, LoanRecord.AA),                          # 所属行业
+    ColumnMapping(COL_F, LoanRecord.E),                           # 经济成分
+    ColumnMapping(COL_G, LoanRecord.F),                           # 企业规模
+    ColumnMapping(COL_H, LoanRecord.AI),                          # 产品名称
+    ColumnMapping(COL_I, LoanRecord.AC),                          # 是否票据增信
+    ColumnMapping(COL_J, LoanRecord.AF, map_recourse),            # 有/无追索权
+    ColumnMapping(COL_K, LoanRecord.AG, map_factoring_visibility),  # 明暗保
+    ColumnMapping(COL_M, LoanRecord.AJ),                          # 单据类型
+    ColumnMapping(COL_N, LoanRecord.AH),                          # 正反向
+    ColumnMapping(COL_O, LookupRef("asset_zhongdeng")),
+    ColumnMapping(COL_P, LoanRecord.C),                           # 保理/再保理申请人名称
+    ColumnMapping(COL_Q, LoanRecord.D),                           # 统一社会信用代码
+    ColumnMapping(COL_R, LoanRecord.G),                           # 基础交易对手方名称（买方/卖方）
+    ColumnMapping(COL_S, LoanRecord.S),                           # 收票方名称(多个逗号分割)
+    ColumnMapping(COL_T, LoanRecord.T),                           # 付款方式
+    ColumnMapping(COL_U, LoanRecord.U),                           # 放款账户开户行
+    ColumnMapping(COL_V, LoanRecord.K),                           # 资产编号
+    ColumnMapping(COL_W, LoanRecord.L),                           # 融资申请号
+    ColumnMapping(COL_X, LoanRecord.L),                           # 融资申请号（同 W 列）
+    ColumnMapping(COL_Y, LoanRecord.AL),                          # 转让日
+    ColumnMapping(COL_Z, LoanRecord.AQ),                          # 应收账款金额/价值
+    ColumnMapping(COL_AA, LoanRecord.AR),                         # 转让总金额
+    ColumnMapping(COL_AB, LoanRecord.AO),                         # 原始账款到期日
+    ColumnMapping(COL_AD, LoanRecord.AM),                         # 转让通知函编号
+    ColumnMapping(COL_AG, LoanRecord.AN),                         # 中登登记编号
+    ColumnMapping(COL_AH, value_of("正常")),
+)
+
+# 中登登记表
+ZHONGDENG_MAPPINGS = (
+    ColumnMapping(COL_A, value_of("=ROW()-1")),
+    ColumnMapping(COL_B, value_of(None)),
+    ColumnMapping(COL_C, ZhongdengRecord.C),
+    ColumnMapping(COL_D, ZhongdengRecord.D),
+    ColumnMapping(COL_F, ZhongdengRecord.E),
+    ColumnMapping(COL_G, ZhongdengRecord.F),
+    ColumnMapping(COL_H, ZhongdengRecord.G, text_or_empty, number_format="@"),
+    ColumnMapping(COL_I, ZhongdengRecord.H),
+    ColumnMapping(COL_J, ZhongdengRecord.I),
+    ColumnMapping(COL_K, ZhongdengRecord.J, alignment=ALIGN_CENTER_NOWRAP),
+    ColumnMapping(COL_L, ZhongdengRecord.K),
+    ColumnMapping(COL_M, ZhongdengRecord.L, alignment=ALIGN_CENTER_NOWRAP),
+    ColumnMapping(COL_N, ZhongdengRecord.M),
+    ColumnMapping(COL_O, ZhongdengRecord.N),
+    ColumnMapping(COL_P, ZhongdengRecord.O),
+    ColumnMapping(COL_Q, ZhongdengRecord.P),
+    ColumnMapping(COL_R, value_of("/")),
+    ColumnMapping(COL_S, ZhongdengRecord.R),
+    ColumnMapping(COL_T, ZhongdengRecord.S),
+    ColumnMapping(COL_U, ZhongdengRecord.T),
+    ColumnMapping(COL_V, ZhongdengRecord.U),
+    ColumnMapping(COL_W, ZhongdengRecord.W),
+    ColumnMapping(COL_X, ZhongdengRecord.X),
+    ColumnMapping(COL_Y, ZhongdengRecord.Y),
+)
+
+
+def set_cell(ws, row_idx: int, col_idx: int, value):
+    cell = ws.cell(row=row_idx, column=col_idx)
+    if value is None:
+        cell.value = None
+    else:
+        cell.value = value
+
+
+def extract_date_prefix(value):
+    text = normalize_string(value)
+    if not text:
+        return None
+    prefix = text.split("~", 1)[0].strip()
+    if not prefix:
+        return None
+    parsed = normalize_excel_date(prefix)
+    return parsed or prefix
+
+
+def sum_amounts(values: Iterable) -> float:
+    """ 金额求和：数字直接累加，文本尝试转换，无法转换的忽略 """
+    total = 0.0
+    for val in values:
+        if isinstance(val, (int, float)):
+            total += float(val)
+        elif val not in (None, ""):
+            try:
+                total += float(val)
+            except Exception:
+                pass
+    return total
+
+
+def plan_ai_merge_groups(repay_rows: Sequence[RepayRecord], first_row: int) -> List[tuple]:
+    """
+    由按追加顺序排列的还款记录（保理 + 再保理，均已按 AH 排序）计算 AI 列分组：
+    连续且 AR（源 AH 列交易银行流水号）相同且非空的行为一组，返回 [(首行, 末行, AH 合计)]
+    """
+    groups: List[tuple] = []
+    group_top = 0
+    group_ar = None
+    amounts: List[object] = []
+
+    for row_idx, record in enumerate(repay_rows, start=first_row):
+        ar_value = record.AH
+        if group_ar is not None and ar_value == group_ar:
+            amounts.append(record.AG)
+            continue
+        if amounts:
+            groups.append((group_top, row_idx - 1, sum_amounts(amounts)))
+        if ar_value in (None, ""):
+            group_ar, amounts = None, []
+        else:
+            group_top, group_ar, amounts = row_idx, ar_value, [record.AG]
+    if amounts:
+        groups.append((group_top, group_top + len(amounts) - 1, sum_amounts(amounts)))
+    return groups
+
+
+def count_merged_ranges(ws) -> int:
+    if hasattr(ws, "merged_range_count"):
+        return ws.merged_range_count()
+    return len(ws.merged_cells.ranges)
+
+
+def apply_ai_merge_groups(ws, groups: Sequence[tuple]):
+    """ 先写入各组 AI 列合计（首行），再统一登记多行分组的合并区域 """
+    for top, _, total in groups:
+        set_cell(ws, top, COL_AI, total)
+    merged = 0
+    for top, bottom, _ in groups:
+        if bottom > top:
+            ws.merge_cells(start_row=top, end_row=bottom, start_column=COL_AI, end_column=COL_AI)
+            merged += 1
+    print(f"[融资及还款明细] AI 列合并 {merged} 组，sheet 合并区域共 {count_merged_ranges(ws)} 个")
+
+
+def plan_financing_repayment_sheet(wb, loan_rows: List[LoanRecord], factoring_repay_rows: List[RepayRecord],
+                                    refactoring_repay_rows: List[RepayRecord], target_date: dt.date,
+                                    lookups: Optional[LookupFormulas] = None,
+                                    identities: Optional["RowIdentityIndex"] = None) -> SheetPlan:
+    """ 【融资及还款明细】：先放款，再保理还款，再再保理还款；还款行按 AR 合并 AI 列 """
+    plan = SheetPlan(SHEET_FINANCING_REPAYMENT)
+    ws = find_sheet_by_name(wb, SHEET_FINANCING_REPAYMENT)
+    last_date = get_last_existing_date(ws)
+    if last_date and target_date <= last_date:
+        plan.skipped = f"无需更新（{target_date} <= {last_date}）"
+        print(f"[融资及还款明细] {plan.skipped}")
+        return plan
+
+    gate = open_identity_gate(identities, SHEET_FINANCING_REPAYMENT)
+    loan_rows = gate.admit("financing_loan", loan_rows)
+    factoring_repay_rows = gate.admit("financing_factoring_repay", factoring_repay_rows)
+    refactoring_repay_rows = gate.admit("financing_refactoring_repay", refactoring_repay_rows)
+    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
+    append_start_row = find_last_data_row(ws) + 1
+    loan_block = plan_block(plan, "financing_loan", template_cache, ws.max_row + 1, loan_rows, lookups)
+    repay_start_row = loan_block.first_row + len(loan_rows)
+    factoring_block = plan_block(plan, "financing_factoring_repay", template_cache, repay_start_row,
+                                 factoring_repay_rows, lookups)
+    plan_block(plan, "financing_refactoring_repay", template_cache, factoring_block.first_row + len(factoring_repay_rows),
+               refactoring_repay_rows, lookups)
+
+    if plan.added:
+        # AI 列：还款行按 AR 分组合并并写入 AH 合计（放款行 AE 为空，不参与分组）
+        plan.ai_merges = plan_ai_merge_groups([*factoring_repay_rows, *refactoring_repay_rows], repay_start_row)
+        plan.b_text_rows = (append_start_row, loan_block.first_row + plan.added - 1)
+
+    print(f"[融资及还款明细] 新增 {plan.added} 行：放款 {len(loan_rows)}，保理还款 {len(factoring_repay_rows)}，再保理还款 {len(refactoring_repay_rows)}")
+    gate.report(plan)
+    return plan
+
+
+def process_financing_repayment_sheet(wb, loan_rows: List[LoanRecord], factoring_repay_rows: List[RepayRecord],
+                                       refactoring_repay_rows: List[RepayRecord], target_date: dt.date,
+                                       lookups: Optional[LookupFormulas] = None) -> int:
+    """
+    处理【融资及还款明细】sheet
+    返回新增行数
+    """
+    return commit_sheet_plan(wb, plan_financing_repayment_sheet(
+        wb, loan_rows, factoring_repay_rows, refactoring_repay_rows, target_date, lookups))
+
+
+# =============================================================================
+# 资产明细 Sheet 处理函数
+# =============================================================================
+
+def plan_asset_detail_sheet(wb, loan_rows: List[LoanRecord], lookups: Optional[LookupFormulas] = None,
+                            identities: Optional["RowIdentityIndex"] = None) -> SheetPlan:
+    """
+    【资产明细】追加放款明细数据
+    数据来源：放款明细表，筛选条件为 P 列实际放款日期 = 目标日期
+    """
+    plan = SheetPlan(SHEET_ASSET_DETAIL)
+    ws = find_sheet_by_name(wb, SHEET_ASSET_DETAIL)
+    gate = open_identity_gate(identities, SHEET_ASSET_DETAIL)
+    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
+    plan_block(plan, "asset_detail", template_cache, ws.max_row + 1, gate.admit("asset_detail", loan_rows), lookups)
+    print(f"[资产明细] 新增 {plan.added} 行")
+    gate.report(plan)
+    return plan
+
+
+def process_asset_detail_sheet(wb, loan_rows: List[LoanRecord], target_date: dt.date,
+                               lookups: Optional[LookupFormulas] = None) -> int:
+    """
+    处理【资产明细】sheet
+    数据来源仅为放款明细
+    返回新增行数
+    """
+    return commit_sheet_plan(wb, plan_asset_detail_sheet(wb, loan_rows, lookups))
+
+
+# =============================================================================
+# 中登登记表 Sheet 处理函数
+# =============================================================================
+
+def plan_zhongdeng_sheet(wb, zhongdeng_rows: List[ZhongdengRecord],
+                         identities: Optional["RowIdentityIndex"] = None) -> SheetPlan:
+    plan = SheetPlan(SHEET_ZHONGDENG)
+    if not zhongdeng_rows:
+        plan.skipped = "匹配到 0 行，跳过追加"
+        print(f"[中登登记表] {plan.skipped}")
+        return plan
+
+    ws = find_sheet_by_name(wb, SHEET_ZHONGDENG)
+    gate = open_identity_gate(identities, SHEET_ZHONGDENG)
+    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
+    plan_block(plan, "zhongdeng", template_cache, ws.max_row + 1, gate.admit("zhongdeng", zhongdeng_rows))
+    print(f"[中登登记表] 新增 {plan.added} 行")
+    gate.report(plan)
+    return plan
+
+
+def process_zhongdeng_sheet(wb, zhongdeng_rows: List[ZhongdengRecord]) -> int:
+    return commit_sheet_plan(wb, plan_zhongdeng_sheet(wb, zhongdeng_rows))
+
+
+def plan_interest_sheet(wb, factoring_interest_rows: List[RepayRecord], refactoring_interest_rows: List[RepayRecord],
+                        identities: Optional["RowIdentityIndex"] = None) -> SheetPlan:
+    plan = SheetPlan(SHEET_INTEREST)
+    if not factoring_interest_rows and not refactoring_interest_rows:
+        plan.skipped = "目标日期无资金费记录，跳过"
+        print(f"[利息缴纳] {plan.skipped}")
+        return plan
+
+    ws = find_sheet_by_name(wb, SHEET_INTEREST)
+    gate = open_identity_gate(identities, SHEET_INTEREST)
+    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
+    last_row = find_last_data_row(ws)
+    for label, rows in (("保理", factoring_interest_rows), ("再保理", refactoring_interest_rows)):
+        # 两段都接在 A 列最后数据行之后（同 find_last_data_row）
+        rows = gate.admit("interest", rows)
+        block = plan_block(plan, "interest", template_cache, last_row + 1, rows)
+        last_row = block.last_data_row(last_row)
+        if rows:
+            print(f"[利息缴纳] {label}新增 {len(rows)} 行")
+
+    print(f"[利息缴纳] 合计新增 {plan.added} 行")
+    gate.report(plan)
+    return plan
+
+
+def process_interest_sheet(wb, factoring_interest_rows: List[RepayRecord], refactoring_interest_rows: List[RepayRecord]) -> int:
+    return commit_sheet_plan(wb, plan_interest_sheet(wb, factoring_interest_rows, refactoring_interest_rows))
+
+
+# =============================================================================
+# 客户表 Sheet 处理函数
+# =============================================================================
+
+def collect_customer_names_from_financing(ws, target_date: dt.date) -> List[str]:
+    """
+    从【融资及还款明细】sheet 中筛选 W 列=目标日期的行，收集 H/I/J 列名称，按出现顺序去重
+    """
+    names: List[str] = []
+    seen: set[str] = set()
+    is_target_date = DATE_NORMALIZER.matcher(target_date)
+    for row_idx in iter_scan_rows(ws, 2):
+        if not is_target_date(ws.cell(row=row_idx, column=COL_W).value):
+            continue
+        for col_idx in (COL_H, COL_I):
+            name = normalize_string(ws.cell(row=row_idx, column=col_idx).value)
+            if not name or name == "/":
+                continue
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+    return names
+
+
+def collect_existing_customer_names(ws) -> set[str]:
+    existing: set[str] = set()
+    for row_idx in iter_scan_rows(ws, 2):
+        name = normalize_string(ws.cell(row=row_idx, column=COL_E).value)
+        if name and name != "/":
+            existing.add(name)
+    return existing
+
+
+def build_asset_lookup_for_customers(ws, target_names: set[str]) -> Dict[str, Dict[str, object]]:
+    """
+    在【资产明细】sheet 中查找 P/R 列匹配的最早行，返回通道与日期信息
+    """
+    if not target_names:
+        return {}
+
+    lookup: Dict[str, Dict[str, object]] = {}
+    for row_idx in iter_scan_rows(ws, 4):
+        for col_idx in (COL_P, COL_R):
+            candidate = normalize_string(ws.cell(row=row_idx, column=col_idx).value)
+            if candidate and candidate in target_names and candidate not in lookup:
+                lookup[candidate] = {
+                    "channel": ws.cell(row=row_idx, column=COL_C).value,
+                    "first_date": ws.cell(row=row_idx, column=COL_Y).value,
+                }
+        if len(lookup) == len(target_names):
+            break
+    return lookup
+
+
+def lookup_customer_sources(path: Path, names: Iterable[str]) -> Dict[str, CustomerRecord]:
+    """
+    只为 names 中的客户读取下载客户表记录（同名取第一行），全部找到后立即停止读取；
+    找不到的名称不出现在结果中
+    """
+    pending = set(names)
+    found: Dict[str, CustomerRecord] = {}
+    if not pending:
+        return found
+    rows = iter_source_rows(path, CUSTOMER_SOURCE_COLUMNS, sheet_name=CUSTOMER_SOURCE_SHEET, data_only=True)
+    with closing(rows):
+        for row in rows:
+            name = normalize_string(row[CUSTOMER_SRC_COL_NAME - 1])
+            if name not in pending:
+                continue
+            found[name] = CustomerRecord.from_row(row)
+            pending.discard(name)
+            if not pending:
+                break
+    return found
+
+
+class CustomerSourceLookup:
+    """
+    下载客户表的按需查询：客户表计划确定新增客户后才读取，且只读取这些客户；
+    已查到 / 确认缺失的名称会记住，多日补录时后面的日期只为新出现的名称再读一次
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records: Dict[str, CustomerRecord] = {}
+        self.absent: set[str] = set()
+
+    def resolve(self, names: Sequence[str]) -> Dict[str, CustomerRecord]:
+        unknown = [name for name in names if name not in self.records and name not in self.absent]
+        if unknown:
+            found = lookup_customer_sources(self.path, unknown)
+            self.records.update(found)
+            self.absent.update(name for name in unknown if name not in found)
+        return {name: self.records[name] for name in names if name in self.records}
+
+
+def map_channel_value(value):
+    text = normalize_string(value)
+    if not text:
+        return None
+    if text == "平台推荐":
+        return "渠道合作"
+    if text == "公司自拓":
+        return "国富自营"
+    return text
+
+
+class NewCustomer:
+    """ 客户表待追加的一行：名称、资产明细信息（可能缺失）与下载客户表记录（可能缺失） """
+
+    __slots__ = ("name", "asset", "source")
+
+    def __init__(self, name: str, asset: Optional[Dict[str, object]], source: Optional[CustomerRecord]):
+        self.name = name
+        self.asset = asset
+        self.source = source
+
+
+def customer_source_column(col_idx: int):
+    """ 取下载客户表记录中 col_idx 列（CUSTOMER_SRC_COL_*）的值，记录缺失时为空 """
+    field = getattr(CustomerRecord, get_column_letter(col_idx))
+    return lambda record, row_idx: None if record.source is None else field.__get__(record.source)
+
+
+def customer_asset_field(field: str):
+    return lambda record, row_idx: record.asset.get(field) if record.asset else None
+
+
+CUSTOMER_MAPPINGS = (
+    ColumnMapping(COL_A, value_of("=ROW()-1")),
+    ColumnMapping(COL_B, customer_asset_field("channel"), map_channel_value),
+    ColumnMapping(COL_C, customer_asset_field("first_date")),
+    ColumnMapping(COL_D, customer_source_column(CUSTOMER_SRC_COL_REGION)),
+    ColumnMapping(COL_E, lambda record, row_idx: record.name),
+    ColumnMapping(COL_F, customer_source_column(CUSTOMER_SRC_COL_ROLE)),
+    ColumnMapping(COL_G, customer_source_column(CUSTOMER_SRC_COL_CODE)),
+    ColumnMapping(COL_H, customer_source_column(CUSTOMER_SRC_COL_INDUSTRY)),
+    *blank_columns(COL_I, COL_J, COL_K, COL_L, COL_M, COL_N),
+    ColumnMapping(COL_O, customer_source_column(CUSTOMER_SRC_COL_ECONOMIC)),
+    ColumnMapping(COL_P, customer_source_column(CUSTOMER_SRC_COL_SCALE)),
+    ColumnMapping(COL_Q, customer_source_column(CUSTOMER_SRC_COL_REGISTER_ADDR)),
+    ColumnMapping(COL_R, customer_source_column(CUSTOMER_SRC_COL_BUSINESS_ADDR)),
+    ColumnMapping(COL_S, customer_source_column(CUSTOMER_SRC_COL_ROLE)),
+    ColumnMapping(COL_T, customer_source_column(CUSTOMER_SRC_COL_LEGAL_REP)),
+    ColumnMapping(COL_U, customer_source_column(CUSTOMER_SRC_COL_LEGAL_ID)),
+    *blank_columns(COL_V, COL_W, COL_X, COL_Y),
+)
+
+
+def plan_customer_sheet(wb, customer_source: CustomerSourceLookup, target_date: dt.date,
+                        manifest: Optional["LedgerManifest"] = None) -> SheetPlan:
+    """ manifest 非空时，客户名称与资产明细的历史查询改为读取状态清单 """
+    plan = SheetPlan(SHEET_CUSTOMER)
+    ws_financing = find_sheet_by_name(wb, SHEET_FINANCING_REPAYMENT)
+    ws_asset = find_sheet_by_name(wb, SHEET_ASSET_DETAIL)
+    ws_customer = find_sheet_by_name(wb, SHEET_CUSTOMER)
+
+    candidate_names = manifest.customer_candidates(target_date) if manifest else None
+    if candidate_names is None:
+        candidate_names = collect_customer_names_from_financing(ws_financing, target_date)
+    if not candidate_names:
+        plan.skipped = "目标日期未发现新增客户，跳过"
+        print(f"[客户表] {plan.skipped}")
+        return plan
+
+    existing_names = manifest.customer_names if manifest else collect_existing_customer_names(ws_customer)
+    new_names = [name for name in candidate_names if name not in existing_names]
+    if not new_names:
+        plan.skipped = "目标日期客户已全部存在，跳过追加"
+        print(f"[客户表] {plan.skipped}")
+        return plan
+
+    if manifest:
+        asset_lookup = manifest.asset_lookup(set(new_names))
+    else:
+        asset_lookup = build_asset_lookup_for_customers(ws_asset, set(new_names))
+
+    source_lookup = customer_source.resolve(new_names)
+    missing_asset = [name for name in new_names if name not in asset_lookup]
+    missing_source = [name for name in new_names if name not in source_lookup]
+    records = [NewCustomer(name, asset_lookup.get(name), source_lookup.get(name)) for name in new_names]
+    template_cache = cache_template_row(ws_customer, TEMPLATE_ROW_INDEX)
+    plan_block(plan, "customer", template_cache, find_last_data_row(ws_customer) + 1, records)
+
+    print(f"[客户表] 新增 {plan.added} 行（资产明细缺失 {len(missing_asset)}，下载客户表缺失 {len(missing_source)}）")
+    if missing_asset:
+        plan.warnings.append("资产明细未找到 -> " + ", ".join(missing_asset))
+    if missing_source:
+        plan.warnings.append("下载客户表未找到 -> " + ", ".join(missing_source))
+    for warning in plan.warnings:
+        print(f"[客户表] 警告：{warning}")
+    return plan
+
+
+def process_customer_sheet(wb, customer_source: CustomerSourceLookup, target_date: dt.date,
+                           manifest: Optional["LedgerManifest"] = None) -> int:
+    return commit_sheet_plan(wb, plan_customer_sheet(wb, customer_source, target_date, manifest))
+
+
+# =============================================================================
+# 追加计划（plan / commit）
+# 每个 sheet 的处理分两步：plan_* 只读取工作簿，算出要追加的行（各列取值、平移后的公式）、
+# AI 列合并与警告，得到纯数据的 SheetPlan；commit_sheet_plan 再按模板行样式写入工作簿。
+# --dry-run 只输出计划（JSON），不保存台账。
+# =============================================================================
+
+ROW_MAPPINGS: Dict[str, Sequence[ColumnMapping]] = {
+    "financing_loan": FINANCING_LOAN_MAPPINGS,
+    "financing_factoring_repay": financing_repay_mappings("保理"),
+    "financing_refactoring_repay": financing_repay_mappings("再保理"),
+    "asset_detail": ASSET_DETAIL_MAPPINGS,
+    "zhongdeng": ZHONGDENG_MAPPINGS,
+    "interest": INTEREST_MAPPINGS,
+    "customer": CUSTOMER_MAPPINGS,
+}
+
+
+@dataclass
+class RowBlock:
+    """ 一段连续追加的行：mappings 为 ROW_MAPPINGS 的键，rows 中每行按 columns 的列顺序给出取值 """
+    mappings: str
+    first_row: int
+    columns: tuple
+    rows: List[tuple]
+
+    def last_data_row(self, default: int) -> int:
+        """ 写入后 A 列最后一个有值的行（同 find_last_data_row）；本段 A 列都为空时返回 default """
+        if COL_A in self.columns:
+            index = self.columns.index(COL_A)
+            for offset in range(len(self.rows) - 1, -1, -1):
+                if self.rows[offset][index] not in (None, ""):
+                    return self.first_row + offset
+        return default
+
+
+@dataclass
+class SheetPlan:
+    """ 一个 sheet 本次要追加的内容 """
+    title: str
+    blocks: List[RowBlock] = field(default_factory=list)
+    ai_merges: List[tuple] = field(default_factory=list)  # AI 列分组：(首行, 末行, AH 合计)
+    b_text_rows: Optional[tuple] = None                    # B 列 ISTEXT 条件格式覆盖的 (首行, 末行)
+    warnings: List[str] = field(default_factory=list)
+    skipped: Optional[str] = None                          # 不追加的原因
+
+    @property
+    def added(self) -> int:
+        return sum(len(block.rows) for block in self.blocks)
+
+
+def plan_block(plan: SheetPlan, mappings: str, template_cache, first_row: int, records: Sequence,
+               lookups: Optional[LookupFormulas] = None) -> RowBlock:
+    """ 按列映射算出从 first_row 开始的各行取值；有记录时加入 plan """
+    builder = RowBuilder(template_cache, None, ROW_MAPPINGS[mappings], lookups)
+    block = RowBlock(mappings, first_row, builder.columns,
+                     [builder.render(record, row_idx) for row_idx, record in enumerate(records, start=first_row)])
+    if block.rows:
+        plan.blocks.append(block)
+    return block
+
+
+def commit_sheet_plan(wb, plan: SheetPlan) -> int:
+    """ 把计划写入工作簿，返回新增行数 """
+    if not plan.blocks:
+        return 0
+    ws = find_sheet_by_name(wb, plan.title)
+    template_cache = cache_template_row(ws, TEMPLATE_ROW_INDEX)
+    template_height = ws.row_dimensions[TEMPLATE_ROW_INDEX].height
+    for block in plan.blocks:
+        builder = RowBuilder(template_cache, template_height, ROW_MAPPINGS[block.mappings])
+        if builder.columns != block.columns:
+            raise SystemExit(f"[{plan.title}] 追加计划与当前模板行的列不一致，请重新生成计划")
+        for row_idx, values in enumerate(block.rows, start=block.first_row):
+            builder.write(ws, row_idx, values)
+    if plan.ai_merges:
+        apply_ai_merge_groups(ws, plan.ai_merges)
+    if plan.b_text_rows:
+        apply_b_column_conditional_format(ws, *plan.b_text_rows)
+    return plan.added
+
+
+def encode_plan_value(value):
+    """ 计划中的单元格取值转为 JSON（日期转 ISO 字符串，其余非基本类型转文本） """
+    if isinstance(value, (dt.datetime, dt.date, dt.time)):
+        return value.isoformat()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def sheet_plan_to_json(plan: SheetPlan) -> Dict[str, object]:
+    """ 每行按列字母给出取值，空值省略 """
+    rows = []
+    for block in plan.blocks:
+        letters = [get_column_letter(col_idx) for col_idx in block.columns]
+        for row_idx, values in enumerate(block.rows, start=block.first_row):
+            rows.append({
+                "row": row_idx,
+                "kind": block.mappings,
+                "cells": {letter: encode_plan_value(value)
+                          for letter, value in zip(letters, values) if value not in (None, "")},
+            })
+    return {
+        "sheet": plan.title,
+        "added": plan.added,
+        "skipped": plan.skipped,
+        "rows": rows,
+        "merges": [{"range": f"AI{top}:AI{bottom}", "total": total} for top, bottom, total in plan.ai_merges if bottom > top],
+        "warnings": list(plan.warnings),
+    }
+
+
+# =============================================================================
+# 行标识索引（幂等追加）
+# 按标识列为各 sheet 的每一行算出键：
+# - 融资及还款明细：放款取融资申请号；还款取交易银行流水号（AR）、融资编号、金额，无流水号时取融资编号、还款日期、金额；
+# - 资产明细：融资申请号（W 列）；
+# - 中登登记表：登记编号与融资编号，无登记编号时取融资编号与 D 列；
+# - 利息缴纳：融资编号、日期、金额；客户表已按名称去重（plan_customer_sheet）。
+# 键取哈希后按出现次数计数，计划追加的行若台账中已有同键的行（第 n 次出现对应已有的第 n 行）则跳过，
+# 中途失败后重跑或对已处理的日期重跑都不会重复追加。索引随状态清单保存，追加后只计入新增行。
+# =============================================================================
+
+# 各 sheet 的标识列：按顺序取首列非空的一组作为该行的键，都为空的行没有标识（总是追加）
+ROW_IDENTITY_KEYS: Dict[str, tuple] = {
+    SHEET_FINANCING_REPAYMENT: ((COL_Q,), (COL_AR, COL_D, COL_AH), (COL_D, COL_AE, COL_AH)),
+    SHEET_ASSET_DETAIL: ((COL_W,),),
+    SHEET_ZHONGDENG: ((COL_J, COL_C), (COL_C, COL_D)),
+    SHEET_INTEREST: ((COL_D, COL_K, COL_U),),
+}
+
+
+def identity_part(value) -> str:
+    """ 标识列取值的规范形式：日期取 ISO 日期，数值统一为浮点，其余按文本 """
+    if isinstance(value, (dt.datetime, dt.date)):
+        return normalize_excel_date(value).isoformat()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(round(float(value), 6))
+    return normalize_string(value)
+
+
+def row_identity(title: str, get) -> Optional[str]:
+    """ get(列号) 返回该行的取值；返回行标识键的哈希，没有标识时返回 None """
+    for index, columns in enumerate(ROW_IDENTITY_KEYS.get(title, ())):
+        parts = [identity_part(get(col_idx)) for col_idx in columns]
+        if parts[0] and parts[0] != "/":
+            text = "\x1f".join([str(index), *parts])
+            return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+    return None
+
+
+class IdentityGate:
+    """ 一个 sheet 计划内的去重：同一键第 n 次出现时，台账中已有至少 n 行才跳过 """
+
+    def __init__(self, title: str, existing: Dict[str, int]):
+        self.title = title
+        self.existing = existing
+        self.seen: Counter = Counter()
+        self.skipped = 0
+
+    def admit(self, mappings: str, records: Sequence) -> list:
+        """ 按 ROW_MAPPINGS[mappings] 算出各记录的标识列取值，返回台账中尚不存在的记录 """
+        if not self.existing or not records:
+            return list(records)
+        columns = {col_idx for group in ROW_IDENTITY_KEYS[self.title] for col_idx in group}
+        builder = RowBuilder({}, None, [mapping for mapping in ROW_MAPPINGS[mappings] if mapping.target in columns])
+        admitted = []
+        for record in records:
+            key = row_identity(self.title, dict(zip(builder.columns, builder.render(record, 0))).get)
+            if key is not None:
+                self.seen[key] += 1
+                if self.seen[key] <= self.existing.get(key, 0):
+                    self.skipped += 1
+                    continue
+            admitted.append(record)
+        return admitted
+
+    def report(self, plan: SheetPlan):
+        """ 有跳过的行时记入计划警告；全部跳过时把计划标记为不追加 """
+        if not self.skipped:
+            return
+        message = f"跳过 {self.skipped} 行台账中已存在的记录"
+        plan.warnings.append(message)
+        print(f"[{self.title}] {message}")
+        if not plan.added and plan.skipped is None:
+            plan.skipped = "目标日期记录均已存在于台账，跳过追加"
+
+
+class RowIdentityIndex:
+    """ 各 sheet 行标识键（哈希）-> 台账中已有的行数 """
+
+    def __init__(self, counts: Optional[Dict[str, Dict[str, int]]] = None):
+        self.counts: Dict[str, Counter] = {title: Counter(keys) for title, keys in (counts or {}).items()}
+
+    @classmethod
+    def build(cls, wb) -> "RowIdentityIndex":
+        """ 流式引擎在扫描时已算好各 sheet 的键计数（identity_counts），openpyxl 下逐行计算 """
+        index = cls()
+        for title in ROW_IDENTITY_KEYS:
+            if title in wb.sheetnames:
+                ws = wb[title]
+                counts = getattr(ws, "identity_counts", None)
+                if counts is not None:
+                    index.counts[title] = Counter(counts)
+                    continue
+                index.absorb_rows(ws, title, iter_scan_rows(ws, LEDGER_SCAN_SPECS[title].min_row))
+        return index
+
+    def absorb_rows(self, ws, title: str, rows: Iterable[int]):
+        if title not in ROW_IDENTITY_KEYS:
+            return
+        counts = self.counts.setdefault(title, Counter())
+        for row_idx in rows:
+            key = row_identity(title, lambda col_idx: peek_cell_value(ws, row_idx, col_idx))
+            if key is not None:
+                counts[key] += 1
+
+    def absorb_plan(self, plan: SheetPlan):
+        """ 计划写入工作簿后调用：把追加的行计入索引 """
+        if plan.title not in ROW_IDENTITY_KEYS:
+            return
+        counts = self.counts.setdefault(plan.title, Counter())
+        for block in plan.blocks:
+            for values in block.rows:
+                key = row_identity(plan.title, dict(zip(block.columns, values)).get)
+                if key is not None:
+                    counts[key] += 1
+
+    def gate(self, title: str) -> IdentityGate:
+        return IdentityGate(title, self.counts.get(title, {}))
+
+    def to_json(self) -> Dict[str, Dict[str, int]]:
+        return {title: dict(counts) for title, counts in self.counts.items()}
+
+
+def open_identity_gate(identities: Optional[RowIdentityIndex], title: str) -> IdentityGate:
+    """ 未建立索引时返回放行所有行的 gate """
+    return identities.gate(title) if identities is not None else IdentityGate(title, {})
+
+
+# =============================================================================
+# 台账流式追加写入（--engine stream）
+# 不把整本台账加载为 openpyxl 对象：逐行扫描五个目标 sheet 的原始 XML 字节，
+# 只保留追加逻辑会读取的少量单元格（A 列最后数据行、模板行、按日期/名称筛选的列），
+# 已有 <row> 原样复制；新增行按模板行（样式索引 + 平移后的公式）生成后拼接到 sheetData 末尾，
+# 同时更新 dimension、合并单元格、条件格式、sharedStrings 与 styles。
+# 未修改的 zip 部件直接复制压缩字节，耗时与内存只随追加行数增长。
+# =============================================================================
 
-def map_channel_value(value):
-    text = normalize_string(value)
-    if not text:
-        return None
-    if text == "平台推荐":
-        return "渠道合作"
-    if text == "公司自拓":
-        return "国富自营"
-    return text
+LEDGER_ENGINE_OPENPYXL = "openpyxl"
+LEDGER_ENGINE_STREAM = "stream"
+LEDGER_ENGINES = (LEDGER_ENGINE_OPENPYXL, LEDGER_ENGINE_STREAM)
+STREAM_COPY_CHUNK = 1 << 20
+SAVE_ZIP_LEVEL = 6
 
 
-def append_customer_rows(
-    ws,
-    template_cache,
-    template_height,
-    template_row_index: int,
-    names: List[str],
-    asset_lookup: Dict[str, Dict[str, object]],
-    customer_source: Dict[str, Sequence]
-) -> tuple[int, List[str], List[str]]:
-    added = 0
-    missing_asset: List[str] = []
-    missing_source: List[str] = []
-    start_row = find_last_data_row(ws)
-
-    for name in names:
-        target_row = start_row + added + 1
-        apply_template_row(ws, template_cache, target_row, template_row_index, template_height)
-
-        asset_info = asset_lookup.get(name)
-        source_row = customer_source.get(name)
-        if asset_info is None:
-            missing_asset.append(name)
-        if source_row is None:
-            missing_source.append(name)
-
-        set_cell(ws, target_row, COL_A, "=ROW()-1")
-        set_cell(ws, target_row, COL_B, map_channel_value(asset_info.get("channel") if asset_info else None))
-        set_cell(ws, target_row, COL_C, asset_info.get("first_date") if asset_info else None)
-        set_cell(ws, target_row, COL_D, get_source_cell(source_row, CUSTOMER_SRC_COL_REGION))
-        set_cell(ws, target_row, COL_E, name)
-        set_cell(ws, target_row, COL_F, get_source_cell(source_row, CUSTOMER_SRC_COL_ROLE))
-        set_cell(ws, target_row, COL_G, get_source_cell(source_row, CUSTOMER_SRC_COL_CODE))
-        set_cell(ws, target_row, COL_H, get_source_cell(source_row, CUSTOMER_SRC_COL_INDUSTRY))
-        for col_idx in (COL_I, COL_J, COL_K, COL_L, COL_M, COL_N):
-            set_cell(ws, target_row, col_idx, None)
-        set_cell(ws, target_row, COL_O, get_source_cell(source_row, CUSTOMER_SRC_COL_ECONOMIC))
-        set_cell(ws, target_row, COL_P, get_source_cell(source_row, CUSTOMER_SRC_COL_SCALE))
-        set_cell(ws, target_row, COL_Q, get_source_cell(source_row, CUSTOMER_SRC_COL_REGISTER_ADDR))
-        set_cell(ws, target_row, COL_R, get_source_cell(source_row, CUSTOMER_SRC_COL_BUSINESS_ADDR))
-        set_cell(ws, target_row, COL_S, get_source_cell(source_row, CUSTOMER_SRC_COL_ROLE))
-        set_cell(ws, target_row, COL_T, get_source_cell(source_row, CUSTOMER_SRC_COL_LEGAL_REP))
-        set_cell(ws, target_row, COL_U, get_source_cell(source_row, CUSTOMER_SRC_COL_LEGAL_ID))
-        for col_idx in (COL_V, COL_W, COL_X, COL_Y):
-            set_cell(ws, target_row, col_idx, None)
-
-        added += 1
-
-    return added, missing_asset, missing_source
-
-
-def process_customer_sheet(wb, customer_source_path: Path, target_date: dt.date) -> int:
-    ws_financing = find_sheet_by_name(wb, SHEET_FINANCING_REPAYMENT)
-    ws_asset = find_sheet_by_name(wb, SHEET_ASSET_DETAIL)
-    ws_customer = find_sheet_by_name(wb, SHEET_CUSTOMER)
+@dataclass(frozen=True)
+class LedgerScanSpec:
+    """流式扫描时每个 sheet 需要保留的列（A 列始终解析，用于定位最后数据行）"""
+    min_row: int = 2
+    last_row_columns: tuple = ()        # 只保留最后数据行的取值
+    date_column: Optional[int] = None   # 保留该列日期为目标日期的行
+    distinct_columns: tuple = ()        # 每个取值只保留首次出现的行
+    companion_columns: tuple = ()       # 随被保留的行一起保留的列
+    identity_keys: tuple = ()           # 行标识列（ROW_IDENTITY_KEYS），每行只记下取值用于计数，不保留单元格
 
-    candidate_names = collect_customer_names_from_financing(ws_financing, target_date)
-    if not candidate_names:
-        print("[客户表] 目标日期未发现新增客户，跳过")
-        return 0
 
-    existing_names = collect_existing_customer_names(ws_customer)
-    new_names = [name for name in candidate_names if name not in existing_names]
-    if not new_names:
-        print("[客户表] 目标日期客户已全部存在，跳过追加")
-        return 0
+def identity_columns(identity_keys: tuple) -> tuple:
+    return tuple(sorted({col_idx for group in identity_keys for col_idx in group}))
 
-    asset_lookup = build_asset_lookup_for_customers(ws_asset, set(new_names))
-    customer_source = load_customer_source_map(customer_source_path)
 
-    template_cache = cache_template_row(ws_customer, TEMPLATE_ROW_INDEX)
-    template_height = ws_customer.row_dimensions[TEMPLATE_ROW_INDEX].height
-
-    added, missing_asset, missing_source = append_customer_rows(
-        ws_customer,
-        template_cache,
-        template_height,
-        TEMPLATE_ROW_INDEX,
-        new_names,
-        asset_lookup,
-        customer_source
-    )
+LEDGER_SCAN_SPECS: Dict[str, LedgerScanSpec] = {
+    SHEET_FINANCING_REPAYMENT: LedgerScanSpec(last_row_columns=(COL_W, COL_AE), date_column=COL_W,
+                                              companion_columns=(COL_H, COL_I),
+                                              identity_keys=ROW_IDENTITY_KEYS[SHEET_FINANCING_REPAYMENT]),
+    SHEET_ASSET_DETAIL: LedgerScanSpec(min_row=4, distinct_columns=(COL_P, COL_R), companion_columns=(COL_C, COL_Y),
+                                       identity_keys=ROW_IDENTITY_KEYS[SHEET_ASSET_DETAIL]),
+    SHEET_ZHONGDENG: LedgerScanSpec(identity_keys=ROW_IDENTITY_KEYS[SHEET_ZHONGDENG]),
+    SHEET_CUSTOMER: LedgerScanSpec(distinct_columns=(COL_E,)),
+    SHEET_INTEREST: LedgerScanSpec(identity_keys=ROW_IDENTITY_KEYS[SHEET_INTEREST]),
+}
+
+# 按 schema 顺序位于 <mergeCells> 之后的 worksheet 子元素，用于确定插入位置
+SHEET_TAIL_ELEMENTS = (
+    "phoneticPr", "conditionalFormatting", "dataValidations", "hyperlinks", "printOptions", "pageMargins",
+    "pageSetup", "headerFooter", "rowBreaks", "colBreaks", "customProperties", "cellWatches", "ignoredErrors",
+    "smartTags", "drawing", "legacyDrawing", "legacyDrawingHF", "drawingHF", "picture", "oleObjects", "controls",
+    "webPublishItems", "tableParts", "extLst",
+)
+WORKBOOK_CALC_FOLLOWERS = (
+    "oleSize", "customWorkbookViews", "pivotCaches", "smartTagPr", "smartTagTypes", "webPublishing",
+    "fileRecoveryPr", "webPublishObjects", "extLst",
+)
+STYLES_DXF_FOLLOWERS = ("tableStyles", "colors", "extLst")
+
+_XML_ATTR_RE = re.compile(rb'([\w:.-]+)="([^"]*)"')
+_XML_ENTITY_RE = re.compile(r"&(#[xX][0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);")
+_XML_ENTITIES = {"amp": "&", "lt": "<", "gt": ">", "quot": '"', "apos": "'"}
+_SHEET_DATA_RE = re.compile(rb"<([\w.-]+:)?sheetData\b[^>]*?(/?)>")
+_COLUMN_BYTES_CACHE: Dict[int, bytes] = {}
+
+
+def _xml_unescape(raw: bytes) -> str:
+    text = raw.decode("utf-8")
+    if "&" not in text:
+        return text
+
+    def replace(match) -> str:
+        entity = match.group(1)
+        if entity[0] == "#":
+            return chr(int(entity[2:], 16) if entity[1] in "xX" else int(entity[1:]))
+        return _XML_ENTITIES[entity]
+
+    return _XML_ENTITY_RE.sub(replace, text)
+
+
+def _column_bytes(col_idx: int) -> bytes:
+    letters = _COLUMN_BYTES_CACHE.get(col_idx)
+    if letters is None:
+        letters = _COLUMN_BYTES_CACHE[col_idx] = get_column_letter(col_idx).encode("ascii")
+    return letters
+
+
+def _render_text(prefix: str, text: str) -> str:
+    """ <t> 文本节点，首尾空白需要 xml:space="preserve"（与 openpyxl 一致） """
+    stripped = text.strip()
+    space = ' xml:space="preserve"' if stripped and stripped != text else ""
+    return f"<{prefix}t{space}>{escape(text)}</{prefix}t>"
+
+
+def _insert_before_first(text: str, prefix: str, names: Sequence[str], root: str, block: str) -> str:
+    """ 把 block 插到 names 中最先出现的元素之前；都不存在时插到根元素结束标签之前 """
+    match = re.search(rf"<{re.escape(prefix)}(?:{'|'.join(names)})\b", text)
+    index = match.start() if match else text.rindex(f"</{prefix}{root}>")
+    return text[:index] + block + text[index:]
+
+
+def _expand_empty_element(text: str, prefix: str, tag: str) -> str:
+    """ <tag .../> -> <tag ...></tag>，便于追加子元素 """
+    pattern = re.compile(rf"<{re.escape(prefix)}{tag}\b([^>]*?)\s*/>")
+    return pattern.sub(lambda m: f"<{prefix}{tag}{m.group(1)}></{prefix}{tag}>", text, count=1)
+
+
+def _bump_count(text: str, prefix: str, tag: str, added: int) -> str:
+    pattern = re.compile(rf'(<{re.escape(prefix)}{tag}\b[^>]*?\bcount=")(\d+)(")')
+    return pattern.sub(lambda m: f"{m.group(1)}{int(m.group(2)) + added}{m.group(3)}", text, count=1)
+
+
+def _prefix_tags(xml: str, prefix: str) -> str:
+    """ openpyxl 生成的片段不带命名空间前缀，目标部件使用前缀时补齐 """
+    if not prefix:
+        return xml
+    return re.sub(r"<(/?)(?=[A-Za-z])", rf"<\g<1>{prefix}", xml)
+
+
+class _SharedStringRef:
+    """ 扫描阶段尚未解析的共享字符串索引，所有 sheet 扫描完后一次性解析 """
+    __slots__ = ("index",)
+
+    def __init__(self, index: int):
+        self.index = index
+
+
+class XlsxZipWriter:
+    """
+    按原部件顺序写出 xlsx 的 zip 容器：
+    - 未修改的部件直接复制原压缩字节（连同 CRC），不解压也不重新压缩；
+    - 修改过的部件边生成边 deflate，长度与 CRC 写在数据描述符里，无需整体缓存。
+    """
+
+    def __init__(self, handle):
+        self._handle = handle
+        self._records: List[tuple] = []
+
+    @staticmethod
+    def _dos_datetime(date_time) -> tuple:
+        year, month, day, hour, minute, second = date_time
+        return (hour << 11) | (minute << 5) | (second // 2), ((max(year, 1980) - 1980) << 9) | (month << 5) | day
+
+    def _write_header(self, name: bytes, flags: int, method: int, date_time, crc: int, compressed: int, size: int):
+        dos_time, dos_date = self._dos_datetime(date_time)
+        offset = self._handle.tell()
+        self._handle.write(struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, flags, method, dos_time, dos_date,
+                                       crc, compressed, size, len(name), 0))
+        self._handle.write(name)
+        return offset, dos_time, dos_date
+
+    def copy_entry(self, source, info: zipfile.ZipInfo):
+        if info.flag_bits & 0x1 or info.compress_size > 0xFFFFFFFF or info.file_size > 0xFFFFFFFF:
+            raise SystemExit(f"台账包含加密或超大部件，无法使用流式引擎：{info.filename}")
+        source.seek(info.header_offset)
+        header = source.read(30)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        name = source.read(name_length)
+        source.seek(extra_length, os.SEEK_CUR)
+        flags = info.flag_bits & 0x800
+        offset, dos_time, dos_date = self._write_header(name, flags, info.compress_type, info.date_time,
+                                                        info.CRC, info.compress_size, info.file_size)
+        remaining = info.compress_size
+        while remaining:
+            chunk = source.read(min(remaining, STREAM_COPY_CHUNK))
+            if not chunk:
+                raise SystemExit(f"台账 zip 结构损坏：{info.filename}")
+            self._handle.write(chunk)
+            remaining -= len(chunk)
+        self._records.append((name, flags, info.compress_type, dos_time, dos_date, info.CRC,
+                              info.compress_size, info.file_size, offset, info.external_attr))
+
+    def write_entry(self, info: zipfile.ZipInfo, chunks: Iterable[bytes], level: int = SAVE_ZIP_LEVEL):
+        name = info.filename.encode("utf-8")
+        flags = 0x08 | (0 if info.filename.isascii() else 0x800)
+        offset, dos_time, dos_date = self._write_header(name, flags, zipfile.ZIP_DEFLATED, info.date_time, 0, 0, 0)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        crc = size = compressed = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            compressed += len(data)
+            self._handle.write(data)
+        data = compressor.flush()
+        compressed += len(data)
+        self._handle.write(data)
+        if size > 0xFFFFFFFF or compressed > 0xFFFFFFFF:
+            raise SystemExit(f"输出部件超过 4GB，无法写出：{info.filename}")
+        self._handle.write(struct.pack("<IIII", 0x08074B50, crc, compressed, size))
+        self._records.append((name, flags, zipfile.ZIP_DEFLATED, dos_time, dos_date, crc,
+                              compressed, size, offset, info.external_attr))
+
+    def write_deflated(self, info: zipfile.ZipInfo, blocks: List[bytes], crc: int, size: int):
+        """ 写出已在别处压缩好的部件（见 deflate_chunks），长度与 CRC 已知，直接写进本地文件头 """
+        name = info.filename.encode("utf-8")
+        flags = 0 if info.filename.isascii() else 0x800
+        compressed = sum(len(block) for block in blocks)
+        if size > 0xFFFFFFFF or compressed > 0xFFFFFFFF:
+            raise SystemExit(f"输出部件超过 4GB，无法写出：{info.filename}")
+        offset, dos_time, dos_date = self._write_header(name, flags, zipfile.ZIP_DEFLATED, info.date_time,
+                                                        crc, compressed, size)
+        for block in blocks:
+            self._handle.write(block)
+        self._records.append((name, flags, zipfile.ZIP_DEFLATED, dos_time, dos_date, crc,
+                              compressed, size, offset, info.external_attr))
+
+    def close(self):
+        start = self._handle.tell()
+        for name, flags, method, dos_time, dos_date, crc, compressed, size, offset, external in self._records:
+            self._handle.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 20, 20, flags, method, dos_time, dos_date,
+                                           crc, compressed, size, len(name), 0, 0, 0, 0, external, offset))
+            self._handle.write(name)
+        end = self._handle.tell()
+        count = len(self._records)
+        self._handle.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, end - start, start, 0))
+
+
+def deflate_chunks(chunks: Iterable[bytes], level: int) -> tuple:
+    """ 把部件内容压缩为原始 deflate 流，返回 (压缩块列表, CRC32, 原始长度)；zlib 压缩期间释放 GIL """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    blocks: List[bytes] = []
+    crc = size = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        data = compressor.compress(chunk)
+        if data:
+            blocks.append(data)
+    blocks.append(compressor.flush())
+    return blocks, crc, size
+
+
+class PartCompressor:
+    """
+    按部件顺序写出 zip，改写的部件在线程池中压缩：
+    - 主线程继续生成后面的部件时，前面的部件已在后台 deflate；
+    - 队首已完成的部件立即按原顺序写出，内存中只保留尚未写出的压缩字节；
+    - threads=1 时不启动线程池，直接边生成边压缩写出（与原先的串行保存一致）。
+    copy() 的部件原样复制源 zip 的压缩字节，需要在构造时传入 source。
+    """
+
+    def __init__(self, writer: XlsxZipWriter, level: int, threads: int, source=None):
+        self._writer = writer
+        self._level = level
+        self._source = source
+        self._pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self._pending = deque()
+
+    def submit(self, info: zipfile.ZipInfo, chunks: Iterable[bytes]):
+        if self._pool is None:
+            self._writer.write_entry(info, chunks, self._level)
+            return
+        self._pending.append((info, self._pool.submit(deflate_chunks, chunks, self._level)))
+        self._drain(wait=False)
+
+    def copy(self, info: zipfile.ZipInfo):
+        if not self._pending:
+            self._writer.copy_entry(self._source, info)
+            return
+        self._pending.append((info, None))
+
+    def _drain(self, wait: bool):
+        while self._pending:
+            info, future = self._pending[0]
+            if future is None:
+                self._writer.copy_entry(self._source, info)
+            elif wait or future.done():
+                self._writer.write_deflated(info, *future.result())
+            else:
+                return
+            self._pending.popleft()
+
+    def close(self):
+        """ 等待全部部件压缩完成并写出中央目录 """
+        try:
+            self._drain(wait=True)
+            self._writer.close()
+        finally:
+            self.abort()
+
+    def abort(self):
+        """ 出错时丢弃未开始的压缩任务；已开始的任务跑完后线程池才退出 """
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+class StylesPart:
+    """ styles.xml 的增量编辑：只在末尾追加新的 xf / numFmt / dxf，原有条目与索引保持不变 """
+
+    def __init__(self, payload: bytes):
+        self.text = payload.decode("utf-8")
+        match = re.search(r"<([\w.-]+:)?styleSheet\b", self.text)
+        self.prefix = (match.group(1) or "") if match else ""
+        p = re.escape(self.prefix)
+        block = re.search(rf"<{p}cellXfs\b[^>]*>(.*?)</{p}cellXfs>", self.text, re.S)
+        self.xfs: List[str] = re.findall(rf"<{p}xf\b[^>]*?/>|<{p}xf\b.*?</{p}xf>", block.group(1), re.S) if block else []
+        self.num_formats: Dict[int, str] = {}
+        for attrs in re.findall(rf"<{p}numFmt\b([^>]*?)/?>", self.text):
+            values = dict(re.findall(r'([\w:]+)="([^"]*)"', attrs))
+            self.num_formats[int(values["numFmtId"])] = _xml_unescape(values.get("formatCode", "").encode("utf-8"))
+        block = re.search(rf"<{p}dxfs\b[^>]*?(?:/>|>(.*?)</{p}dxfs>)", self.text, re.S)
+        self.dxfs: List[str] = re.findall(rf"<{p}dxf\b[^>]*?/>|<{p}dxf\b.*?</{p}dxf>", block.group(1) or "", re.S) if block else []
+        self.dxf_count = len(self.dxfs)
+        self._xf_re = re.compile(rf"<{p}xf\b([^>]*?)(/?)>")
+        self._child_re = re.compile(rf"<{p}(alignment|protection|extLst)\b(?:[^>]*?/>|.*?</{p}\1>)", re.S)
+        self.new_xfs: List[str] = []
+        self.new_num_formats: Dict[int, str] = {}
+        self.new_dxfs: List[str] = []
+        self._derived: Dict[tuple, int] = {}
+        # 与原有 dxf 完全相同时直接复用其索引
+        self._dxf_ids: Dict[str, int] = {}
+        for dxf_id, xml in enumerate(self.dxfs):
+            self._dxf_ids.setdefault(xml, dxf_id)
+
+    def _xf_xml(self, xf_id: int) -> str:
+        if xf_id < len(self.xfs):
+            return self.xfs[xf_id]
+        return self.new_xfs[xf_id - len(self.xfs)]
+
+    def _xf_parts(self, xf_id: int) -> tuple:
+        xml = self._xf_xml(xf_id)
+        head = self._xf_re.match(xml)
+        attrs = dict(re.findall(r'([\w:.-]+)="([^"]*)"', head.group(1)))
+        body = "" if head.group(2) else xml[head.end():]
+        children = {match.group(1): match.group(0) for match in self._child_re.finditer(body)}
+        return attrs, children
+
+    def number_format(self, xf_id: int) -> str:
+        fmt_id = int(self._xf_parts(xf_id)[0].get("numFmtId", 0))
+        if fmt_id in self.num_formats:
+            return self.num_formats[fmt_id]
+        if fmt_id in self.new_num_formats:
+            return self.new_num_formats[fmt_id]
+        return BUILTIN_FORMATS.get(fmt_id, BUILTIN_FORMATS[0])
+
+    def alignment(self, xf_id: int) -> Alignment:
+        raw = self._xf_parts(xf_id)[1].get("alignment")
+        if raw is None:
+            return Alignment()
+        return Alignment.from_tree(ElementTree.fromstring(self._strip_prefix(raw)))
+
+    def format_id(self, code: str) -> int:
+        if code in BUILTIN_FORMATS_REVERSE:
+            return BUILTIN_FORMATS_REVERSE[code]
+        for fmt_id, existing in (*self.num_formats.items(), *self.new_num_formats.items()):
+            if existing == code:
+                return fmt_id
+        fmt_id = max((163, *self.num_formats, *self.new_num_formats)) + 1
+        self.new_num_formats[fmt_id] = code
+        return fmt_id
+
+    def derive(self, xf_id: int, alignment: Optional[Alignment] = None, number_format: Optional[str] = None) -> int:
+        """ 在 xf_id 的基础上替换对齐方式/数字格式，返回（复用或新增的）样式索引 """
+        key = (xf_id, tuple(alignment) if alignment is not None else None, number_format)
+        derived = self._derived.get(key)
+        if derived is not None:
+            return derived
+        attrs, children = self._xf_parts(xf_id)
+        if number_format is not None:
+            attrs["numFmtId"] = str(self.format_id(number_format))
+            attrs["applyNumberFormat"] = "1"
+        if alignment is not None:
+            children["alignment"] = _prefix_tags(tostring(alignment.to_tree()).decode("utf-8"), self.prefix)
+            attrs["applyAlignment"] = "1"
+        attr_text = "".join(f' {name}="{value}"' for name, value in attrs.items())
+        body = "".join(children[name] for name in ("alignment", "protection", "extLst") if name in children)
+        xml = f"<{self.prefix}xf{attr_text}>{body}</{self.prefix}xf>" if body else f"<{self.prefix}xf{attr_text}/>"
+        derived = len(self.xfs) + len(self.new_xfs)
+        self.new_xfs.append(xml)
+        self._derived[key] = derived
+        return derived
+
+    def _strip_prefix(self, raw: str) -> str:
+        if self.prefix:
+            raw = raw.replace(f"<{self.prefix}", "<").replace(f"</{self.prefix}", "</")
+        return raw
+
+    def dxf(self, dxf_id: int) -> Optional[DifferentialStyle]:
+        """ 原有 dxf 解析为 DifferentialStyle；索引无效时返回 None """
+        if not 0 <= dxf_id < len(self.dxfs):
+            return None
+        return DifferentialStyle.from_tree(ElementTree.fromstring(self._strip_prefix(self.dxfs[dxf_id])))
+
+    def add_dxf(self, dxf) -> int:
+        xml = _prefix_tags(tostring(dxf.to_tree()).decode("utf-8"), self.prefix)
+        dxf_id = self._dxf_ids.get(xml)
+        if dxf_id is None:
+            dxf_id = self._dxf_ids[xml] = self.dxf_count + len(self.new_dxfs)
+            self.new_dxfs.append(xml)
+        return dxf_id
+
+    def render(self) -> Optional[bytes]:
+        """ 无新增条目时返回 None（原样复制） """
+        if not (self.new_xfs or self.new_num_formats or self.new_dxfs):
+            return None
+        text, p = self.text, self.prefix
+        if self.new_num_formats:
+            block = "".join(f'<{p}numFmt numFmtId="{fmt_id}" formatCode={quoteattr(code)}/>'
+                            for fmt_id, code in self.new_num_formats.items())
+            text = _expand_empty_element(text, p, "numFmts")
+            if f"</{p}numFmts>" in text:
+                text = text.replace(f"</{p}numFmts>", block + f"</{p}numFmts>", 1)
+                text = _bump_count(text, p, "numFmts", len(self.new_num_formats))
+            else:
+                # numFmts 必须是 styleSheet 的第一个子元素
+                root = re.search(rf"<{re.escape(p)}styleSheet\b[^>]*>", text)
+                block = f'<{p}numFmts count="{len(self.new_num_formats)}">{block}</{p}numFmts>'
+                text = text[:root.end()] + block + text[root.end():]
+        if self.new_xfs:
+            text = text.replace(f"</{p}cellXfs>", "".join(self.new_xfs) + f"</{p}cellXfs>", 1)
+            text = _bump_count(text, p, "cellXfs", len(self.new_xfs))
+        if self.new_dxfs:
+            text = _expand_empty_element(text, p, "dxfs")
+            if f"</{p}dxfs>" in text:
+                text = text.replace(f"</{p}dxfs>", "".join(self.new_dxfs) + f"</{p}dxfs>", 1)
+                text = _bump_count(text, p, "dxfs", len(self.new_dxfs))
+            else:
+                block = f'<{p}dxfs count="{len(self.new_dxfs)}">{"".join(self.new_dxfs)}</{p}dxfs>'
+                text = _insert_before_first(text, p, STYLES_DXF_FOLLOWERS, "styleSheet", block)
+        return text.encode("utf-8")
+
+
+class SharedStringsPart:
+    """ sharedStrings.xml：只解析被引用到的索引；新增字符串追加在末尾，已有索引不变 """
+
+    def __init__(self, reader: XlsxStreamReader):
+        self.reader = reader
+        part = reader.shared_strings_part
+        self.part = part if part and part in reader.archive.NameToInfo else None
+        self.prefix = b""
+        self.unique_count = 0
+        self.new_strings: Dict[str, int] = {}
+        self.added_refs = 0
+
+    def resolve(self, indices: Iterable[int]) -> Dict[int, str]:
+        wanted = set(indices)
+        found: Dict[int, str] = {}
+        if self.part is None:
+            return found
+        declared: Optional[int] = None
+        index = 0
+        with self.reader.open_part(self.part) as source:
+            buf, pos = b"", 0
+            si_re = si_close = None
+            while True:
+                chunk = source.read(XLSX_READ_CHUNK)
+                buf += chunk
+                if si_re is None:
+                    root = re.search(rb"<([\w.-]+:)?sst\b([^>]*?)(/?)>", buf)
+                    if root is None:
+                        if not chunk:
+                            break
+                        continue
+                    self.prefix = root.group(1) or b""
+                    unique = re.search(rb'\buniqueCount="(\d+)"', root.group(2))
+                    declared = int(unique.group(1)) if unique else None
+                    si_re = re.compile(b"<" + re.escape(self.prefix) + rb"si\b[^>]*?(/?)>")
+                    si_close = b"</" + self.prefix + b"si>"
+                    pos = root.end()
+                while True:
+                    match = si_re.search(buf, pos)
+                    if match is None:
+                        break
+                    if match.group(1):
+                        end = match.end()
+                    else:
+                        close = buf.find(si_close, match.end())
+                        if close == -1:
+                            break
+                        end = close + len(si_close)
+                    if index in wanted:
+                        found[index] = self._parse_item(buf[match.start():end])
+                    index += 1
+                    pos = end
+                buf, pos = buf[pos:], 0
+                if not chunk or (declared is not None and len(found) == len(wanted)):
+                    break
+        self.unique_count = declared if declared is not None else index
+        return found
+
+    def _parse_item(self, raw: bytes) -> str:
+        if self.prefix:
+            raw = re.sub(rb"<(/?)" + re.escape(self.prefix), rb"<\1", raw)
+        return _rich_text_content(ElementTree.fromstring(raw)).replace("x005F_", "")
+
+    def add(self, text: str) -> int:
+        index = self.new_strings.get(text)
+        if index is None:
+            index = self.new_strings[text] = self.unique_count + len(self.new_strings)
+        self.added_refs += 1
+        return index
+
+    def iter_updated(self) -> Iterator[bytes]:
+        """ 流式复制原部件：改写 <sst> 的计数属性，并在 </sst> 前追加新字符串 """
+        p = self.prefix.decode("utf-8")
+        items = "".join(f"<{p}si>{_render_text(p, text)}</{p}si>" for text in self.new_strings).encode("utf-8")
+        close = b"</" + self.prefix + b"sst>"
+        total = self.unique_count + len(self.new_strings)
+
+        def update_root(match) -> bytes:
+            attrs = re.sub(rb'\buniqueCount="\d+"', b'uniqueCount="%d"' % total, match.group(2))
+            if b"uniqueCount=" not in attrs:
+                attrs += b' uniqueCount="%d"' % total
+            attrs = re.sub(rb'\bcount="(\d+)"', lambda m: b'count="%d"' % (int(m.group(1)) + self.added_refs), attrs)
+            if match.group(3):
+                return b"<" + self.prefix + b"sst" + attrs + b">" + items + close
+            return b"<" + self.prefix + b"sst" + attrs + b">"
+
+        with self.reader.open_part(self.part) as source:
+            buf = b""
+            while True:
+                chunk = source.read(XLSX_READ_CHUNK)
+                buf += chunk
+                root = re.search(rb"<([\w.-]+:)?sst\b([^>]*?)(/?)>", buf)
+                if root is not None or not chunk:
+                    break
+            if root is None:
+                raise SystemExit("台账 sharedStrings.xml 结构异常")
+            yield buf[:root.start()] + update_root(root)
+            if root.group(3):
+                yield buf[root.end():]
+                return
+            pending = buf[root.end():]
+            while True:
+                chunk = source.read(XLSX_READ_CHUNK)
+                if not chunk:
+                    break
+                pending += chunk
+                # 保留末尾一段，确保 </sst> 不会被拆在两次输出之间
+                if len(pending) > XLSX_READ_CHUNK:
+                    yield pending[:-256]
+                    pending = pending[-256:]
+            index = pending.rindex(close)
+            yield pending[:index] + items + pending[index:]
+
+
+class _SheetMarkup:
+    """ 按 worksheet 命名空间前缀编译的标签匹配与单元格/行的 XML 拼装 """
+
+    def __init__(self, prefix: bytes):
+        p = re.escape(prefix)
+        self.prefix = prefix
+        self.text_prefix = prefix.decode("utf-8")
+        self.row_open = b"<" + prefix + b"row"
+        self.row_close = b"</" + prefix + b"row>"
+        self.data_close = b"</" + prefix + b"sheetData>"
+        self.cell_close = b"</" + prefix + b"c>"
+        self.cell_start_re = re.compile(b"<" + p + rb"c[\s>/]")
+        self.value_re = re.compile(b"<" + p + rb"v(?:\s[^>]*)?>(.*?)</" + p + rb"v>", re.S)
+        self.formula_re = re.compile(b"<" + p + rb"f\b([^>]*?)(?:/>|>(.*?)</" + p + rb"f>)", re.S)
+        self.inline_re = re.compile(b"<" + p + rb"is>(.*?)</" + p + rb"is>", re.S)
+        self.phonetic_re = re.compile(b"<" + p + rb"rPh\b.*?</" + p + rb"rPh>", re.S)
+        self.text_re = re.compile(b"<" + p + rb"t(?:\s[^>]*)?>(.*?)</" + p + rb"t>", re.S)
+
+    def cell_at(self, row: bytes, begin: int) -> tuple:
+        """ 返回从 begin 开始的 <c> 元素字节及其结束位置 """
+        tag_end = row.find(b">", begin)
+        if row[tag_end - 1] == 0x2F:
+            end = tag_end + 1
+        else:
+            end = row.find(self.cell_close, tag_end) + len(self.cell_close)
+        return row[begin:end], end
+
+    def iter_cells(self, row: bytes, start: int) -> Iterator[tuple]:
+        """ 顺序解析行内的 (列号, 单元格字节)，缺少 r 属性时按位置递增 """
+        col_idx = 0
+        pos = start
+        while True:
+            match = self.cell_start_re.search(row, pos)
+            if match is None:
+                return
+            cell, pos = self.cell_at(row, match.start())
+            ref = re.search(rb'\sr="([A-Z]+)', cell[:cell.find(b">")])
+            col_idx = _column_of(ref.group(1).decode("ascii")) if ref else col_idx + 1
+            yield col_idx, cell
+
+    def build_row(self, row_idx: int, cells: Dict[int, str], height: Optional[float]) -> bytes:
+        p = self.text_prefix
+        body = "".join(cells[col] for col in sorted(cells))
+        attrs = f' r="{row_idx}"'
+        if height:
+            attrs += f' ht="{safe_string(height)}" customHeight="1"'
+        elif not body:
+            return b""
+        return f"<{p}row{attrs}>{body}</{p}row>".encode("utf-8")
+
+    def merge_row(self, raw: bytes, cells: Dict[int, str], height: Optional[float]) -> bytes:
+        """ 新单元格覆盖已有行中的同列单元格，其余单元格与行属性保持原样 """
+        p = self.text_prefix
+        tag_end = raw.find(b">")
+        attrs = {name.decode("utf-8"): value.decode("utf-8")
+                 for name, value in _XML_ATTR_RE.findall(raw, 0, tag_end) if name != b"spans"}
+        if height:
+            attrs["ht"] = safe_string(height)
+            attrs["customHeight"] = "1"
+        merged: Dict[int, str] = {}
+        if raw[tag_end - 1] != 0x2F:
+            merged = {col_idx: cell.decode("utf-8") for col_idx, cell in self.iter_cells(raw, tag_end)}
+        for col_idx, xml in cells.items():
+            if xml:
+                merged[col_idx] = xml
+            else:
+                merged.pop(col_idx, None)
+        attr_text = "".join(f' {name}="{value}"' for name, value in attrs.items())
+        return f"<{p}row{attr_text}>{''.join(merged[col] for col in sorted(merged))}</{p}row>".encode("utf-8")
+
+
+class _RowCells:
+    """ 单行原始字节的按列取值：单元格带 r 属性时按坐标直接查找，不逐个解析 """
+    __slots__ = ("row", "start", "markup", "suffix", "has_cells", "uses_refs", "_by_col")
+
+    def __init__(self, row: bytes, row_idx: int, start: int, markup: _SheetMarkup):
+        self.row = row
+        self.start = start
+        self.markup = markup
+        self.suffix = str(row_idx).encode("ascii") + b'"'
+        first = markup.cell_start_re.search(row, start)
+        self.has_cells = first is not None
+        self.uses_refs = self.has_cells and b' r="' in row[first.start():row.find(b">", first.start())]
+        self._by_col: Optional[Dict[int, bytes]] = None
+
+    def _cells(self) -> Dict[int, bytes]:
+        if self._by_col is None:
+            self._by_col = dict(self.markup.iter_cells(self.row, self.start))
+        return self._by_col
+
+    def get(self, col_idx: int) -> Optional[bytes]:
+        if not self.has_cells:
+            return None
+        if not self.uses_refs:
+            return self._cells().get(col_idx)
+        found = self.row.find(b' r="' + _column_bytes(col_idx) + self.suffix, self.start)
+        if found == -1:
+            return None
+        return self.markup.cell_at(self.row, self.row.rfind(b"<", 0, found))[0]
+
+    def last_column(self) -> int:
+        if not self.uses_refs:
+            return max(self._cells(), default=0)
+        found = self.row.rfind(b' r="')
+        return _column_of(self.row[found + 4:self.row.find(b'"', found + 4)].decode("ascii"))
+
+
+class _LedgerSheetScanner:
+    """
+    逐行扫描台账 sheet 的原始字节：
+    - 只解析 A 列与扫描规格中的列，其余单元格不做任何处理；
+    - 最后数据行（A 列非空）之后的行保留原始字节并完整解析，追加的新行可能与其重叠，写出时按单元格合并。
+    """
+
+    def __init__(self, sheet: "StreamSheet", spec: LedgerScanSpec, dates: Iterable[dt.date], reader: XlsxStreamReader):
+        self.sheet = sheet
+        self.spec = spec
+        self.dates = set(dates)
+        self.date_styles = reader.date_styles
+        self.timedelta_styles = reader.timedelta_styles
+        self.epoch = reader.epoch
+        self.markup: Optional[_SheetMarkup] = None
+        self.shared_formulae: Dict[bytes, Translator] = {}
+        self.seen: Dict[int, set] = {col_idx: set() for col_idx in spec.distinct_columns}
+        self.identity_columns = identity_columns(spec.identity_keys)
+        self.row_idx = 0
+        self.last_row: Optional[tuple] = None
+        self.tail_rows: List[tuple] = []
+
+    def scan(self, source):
+        sheet = self.sheet
+        buf = b""
+        while True:
+            match = _SHEET_DATA_RE.search(buf)
+            if match:
+                break
+            chunk = source.read(STREAM_COPY_CHUNK)
+            if not chunk:
+                raise SystemExit(f"台账工作表缺少 sheetData：{sheet.title}")
+            buf += chunk
+        if match.group(2):
+            raise SystemExit(f"台账工作表为空，无法定位模板行：{sheet.title}")
+        markup = self.markup = sheet.markup = _SheetMarkup(match.group(1) or b"")
+
+        base, pos = 0, match.end()
+        first_row: Optional[int] = None
+        while True:
+            row_at = buf.find(markup.row_open, pos)
+            data_at = buf.find(markup.data_close, pos, len(buf) if row_at == -1 else row_at)
+            if data_at != -1:
+                break
+            row_end = self._row_end(buf, row_at) if row_at != -1 else None
+            if row_end is None:
+                chunk = source.read(STREAM_COPY_CHUNK)
+                if not chunk:
+                    raise SystemExit(f"台账工作表 XML 不完整：{sheet.title}")
+                buf += chunk
+                continue
+            if first_row is None:
+                first_row = base + row_at
+                sheet.head = buf[:row_at]
+            self._scan_row(buf[row_at:row_end], base + row_end)
+            pos = row_end
+            if pos > STREAM_COPY_CHUNK:
+                buf, base, pos = buf[pos:], base + pos, 0
+
+        if first_row is None:
+            first_row = base + data_at
+            sheet.head = buf[:data_at]
+        sheet.rest = buf[data_at:] + source.read()
+        sheet.body_start = first_row
+        if self.last_row is None:
+            sheet.body_end = first_row
+        else:
+            row_idx, values = self.last_row
+            sheet.last_data_row = row_idx
+            for col_idx, parsed in values.items():
+                if parsed is not None:
+                    sheet.load_cell(row_idx, col_idx, *parsed)
+        for row_idx, raw in self.tail_rows:
+            for col_idx, cell in markup.iter_cells(raw, raw.find(b">")):
+                sheet.load_cell(row_idx, col_idx, *self._parse_cell(cell, row_idx, col_idx))
+        sheet.tail_rows = self.tail_rows
+
+    def _row_end(self, buf: bytes, row_at: int) -> Optional[int]:
+        tag_end = buf.find(b">", row_at)
+        if tag_end == -1:
+            return None
+        if buf[tag_end - 1] == 0x2F:
+            return tag_end + 1
+        close = buf.find(self.markup.row_close, tag_end)
+        return None if close == -1 else close + len(self.markup.row_close)
+
+    def _scan_row(self, row: bytes, row_end: int):
+        sheet = self.sheet
+        tag_end = row.find(b">")
+        attrs = dict(_XML_ATTR_RE.findall(row, 0, tag_end))
+        ref = attrs.get(b"r")
+        row_idx = self.row_idx = int(ref) if ref else self.row_idx + 1
+
+        cells = _RowCells(row, row_idx, tag_end, self.markup)
+        if cells.has_cells:
+            sheet.scan_max_row = row_idx
+            sheet.scan_max_column = max(sheet.scan_max_column, cells.last_column())
+
+        if row_idx <= TEMPLATE_ROW_INDEX:
+            # 模板行及其之前的行完整解析：共享公式的主单元格只会出现在模板行之前
+            parsed_row = {col_idx: self._parse_cell(cell, row_idx, col_idx)
+                          for col_idx, cell in self.markup.iter_cells(row, tag_end)}
+            lookup = parsed_row.get
+            if row_idx == TEMPLATE_ROW_INDEX:
+                for col_idx, parsed in parsed_row.items():
+                    sheet.load_cell(row_idx, col_idx, *parsed)
+                if attrs.get(b"ht"):
+                    sheet.row_dimensions[row_idx].height = float(attrs[b"ht"])
+        else:
+            def lookup(col_idx: int):
+                return self._parse_cell(cells.get(col_idx), row_idx, col_idx)
+
+        first = lookup(COL_A)
+        if first is not None and first[0] not in (None, ""):
+            values = {COL_A: first}
+            for col_idx in self.spec.last_row_columns:
+                values[col_idx] = lookup(col_idx)
+            self.last_row = (row_idx, values)
+            self.tail_rows = []
+            sheet.body_end = row_end
+        else:
+            self.tail_rows.append((row_idx, row))
+
+        if row_idx >= self.spec.min_row:
+            self._retain(row_idx, lookup)
+
+    def _retain(self, row_idx: int, lookup):
+        spec = self.spec
+        if spec.date_column:
+            parsed = lookup(spec.date_column)
+            if parsed is not None and (isinstance(parsed[0], _SharedStringRef)
+                                       or normalize_excel_date(parsed[0]) in self.dates):
+                self._keep(row_idx, spec.date_column, parsed, lookup)
+        for col_idx in spec.distinct_columns:
+            parsed = lookup(col_idx)
+            if parsed is None:
+                continue
+            value = parsed[0]
+            key = ("s", value.index) if isinstance(value, _SharedStringRef) else normalize_string(value)
+            if key and key not in self.seen[col_idx]:
+                self.seen[col_idx].add(key)
+                self._keep(row_idx, col_idx, parsed, lookup)
+        if spec.identity_keys:
+            self._capture_identity(lookup)
+
+    def _capture_identity(self, lookup):
+        """
+        按 identity_columns 的顺序记下该行标识列的取值（共享字符串仍为索引，未解析的列为 None），
+        不建单元格；某组首列已确定非空时后面的组用不到，不再解析
+        """
+        values = dict.fromkeys(self.identity_columns)
+        for columns in self.spec.identity_keys:
+            for col_idx in columns:
+                parsed = lookup(col_idx)
+                if parsed is not None:
+                    values[col_idx] = parsed[0]
+            first = values[columns[0]]
+            if not isinstance(first, _SharedStringRef) and identity_part(first) not in ("", "/"):
+                break
+        if any(value not in (None, "") for value in values.values()):
+            self.sheet.identity_rows.append(tuple(values.values()))
+
+    def _keep(self, row_idx: int, col_idx: int, parsed: tuple, lookup):
+        self.sheet.load_cell(row_idx, col_idx, *parsed)
+        for companion in self.spec.companion_columns:
+            item = lookup(companion)
+            if item is not None:
+                self.sheet.load_cell(row_idx, companion, *item)
+
+    def _parse_cell(self, raw: Optional[bytes], row_idx: int, col_idx: int) -> Optional[tuple]:
+        """ 返回 (值, 样式索引)，取值规则与 _SheetXmlParser.convert_cell 相同；共享字符串延后解析 """
+        if raw is None:
+            return None
+        markup = self.markup
+        tag_end = raw.find(b">")
+        attrs = dict(_XML_ATTR_RE.findall(raw, 0, tag_end))
+        style_id = int(attrs.get(b"s", 0))
+        if raw[tag_end - 1] == 0x2F:
+            return None, style_id
+        body = raw[tag_end + 1:]
+
+        formula = markup.formula_re.search(body)
+        if formula is not None:
+            value = "=" + _xml_unescape(formula.group(2) or b"")
+            formula_attrs = dict(_XML_ATTR_RE.findall(formula.group(1)))
+            if formula_attrs.get(b"t") == b"shared":
+                shared_index = formula_attrs.get(b"si")
+                coordinate = f"{get_column_letter(col_idx)}{row_idx}"
+                if shared_index in self.shared_formulae:
+                    value = self.shared_formulae[shared_index].translate_formula(coordinate)
+                elif value != "=":
+                    self.shared_formulae[shared_index] = Translator(value, coordinate)
+            return value, style_id
+
+        cell_type = attrs.get(b"t", b"n")
+        if cell_type == b"inlineStr":
+            inline = markup.inline_re.search(body)
+            if inline is None:
+                return None, style_id
+            content = markup.phonetic_re.sub(b"", inline.group(1))
+            return "".join(_xml_unescape(text) for text in markup.text_re.findall(content)), style_id
+        match = markup.value_re.search(body)
+        text = match.group(1) if match else None
+        if not text:
+            return None, style_id
+        if cell_type == b"n":
+            value = _cast_number(text.decode("ascii"))
+            if style_id in self.date_styles:
+                try:
+                    value = from_excel(value, self.epoch, timedelta=style_id in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    value = "#VALUE!"
+            return value, style_id
+        if cell_type == b"s":
+            return _SharedStringRef(int(text)), style_id
+        if cell_type == b"b":
+            return bool(int(text)), style_id
+        if cell_type == b"d":
+            return from_ISO8601(text.decode("ascii")), style_id
+        return _xml_unescape(text), style_id
+
+
+class StreamCell:
+    """ 与 openpyxl Cell 用法兼容的最小单元格：样式为 styles.xml 中 cellXfs 的索引 """
+    __slots__ = ("parent", "row", "column", "_value", "_xf", "dirty")
+
+    def __init__(self, parent: "StreamSheet", row: int, column: int):
+        self.parent = parent
+        self.row = row
+        self.column = column
+        self._value = None
+        self._xf = 0
+        self.dirty = False
+
+    @property
+    def coordinate(self) -> str:
+        return f"{get_column_letter(self.column)}{self.row}"
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        # 与 openpyxl Cell._bind_value 一致：日期写入非日期格式的单元格时改用默认日期格式
+        if isinstance(value, str):
+            if ILLEGAL_CHARACTERS_RE.search(value):
+                raise IllegalCharacterError(f"{value} cannot be used in worksheets.")
+        elif isinstance(value, (dt.datetime, dt.date, dt.time, dt.timedelta)):
+            if not is_date_format(self.number_format):
+                self.number_format = get_time_format(type(value))
+        self._value = value
+        self.dirty = True
+
+    @property
+    def data_type(self) -> str:
+        value = self._value
+        if isinstance(value, bool):
+            return "b"
+        if isinstance(value, str):
+            if len(value) > 1 and value.startswith("="):
+                return "f"
+            return "e" if value in ERROR_CODES else "s"
+        if isinstance(value, (dt.datetime, dt.date, dt.time, dt.timedelta)):
+            return "d"
+        return "n"
+
+    @property
+    def _style(self) -> int:
+        return self._xf
+
+    @_style.setter
+    def _style(self, xf_id: int):
+        self._xf = xf_id
+        self.dirty = True
+
+    @property
+    def alignment(self) -> Alignment:
+        return self.parent.parent.styles.alignment(self._xf)
+
+    @alignment.setter
+    def alignment(self, value: Alignment):
+        self._xf = self.parent.parent.styles.derive(self._xf, alignment=value)
+        self.dirty = True
+
+    @property
+    def number_format(self) -> str:
+        return self.parent.parent.styles.number_format(self._xf)
+
+    @number_format.setter
+    def number_format(self, value: str):
+        self._xf = self.parent.parent.styles.derive(self._xf, number_format=value)
+        self.dirty = True
+
+
+class _StreamRowDimension:
+    __slots__ = ("height",)
+
+    def __init__(self):
+        self.height: Optional[float] = None
+
+
+class _StreamRowDimensions(dict):
+    def __missing__(self, row_idx: int) -> _StreamRowDimension:
+        dimension = self[row_idx] = _StreamRowDimension()
+        return dimension
+
+
+class _StreamConditionalFormatting:
+    """ 新增规则在写出时追加；原有规则保留在 sheet 尾部 XML 中，只支持按条件整条移除 """
+
+    def __init__(self, sheet: "StreamSheet"):
+        self.sheet = sheet
+        self.rules: List[tuple] = []
+
+    def add(self, range_string: str, cfRule):
+        self.rules.append((range_string, cfRule))
+
+    def pop_rules(self, predicate) -> List[tuple]:
+        """ 同 pop_conditional_rules：从 sheet 尾部 XML 中移除 predicate(sqref, rule) 为真的 cfRule """
+        sheet = self.sheet
+        styles = sheet.parent.styles
+        p = re.escape(sheet.markup.text_prefix)
+        block_re = re.compile(rf"<{p}conditionalFormatting\b([^>]*)>(.*?)</{p}conditionalFormatting>", re.S)
+        rule_re = re.compile(rf"<{p}cfRule\b[^>]*?/>|<{p}cfRule\b.*?</{p}cfRule>", re.S)
+        popped: List[tuple] = []
+
+        def replace_block(match) -> str:
+            sqref = dict(re.findall(r'([\w:]+)="([^"]*)"', match.group(1))).get("sqref", "")
+            body = match.group(2)
+            for raw in rule_re.findall(body):
+                try:
+                    rule = Rule.from_tree(ElementTree.fromstring(styles._strip_prefix(raw)))
+                except Exception:
+                    continue
+                rule.dxf = styles.dxf(rule.dxfId) if rule.dxfId is not None else None
+                if predicate(sqref, rule):
+                    popped.append((sqref, rule))
+                    body = body.replace(raw, "", 1)
+            if rule_re.search(body) is None:
+                return ""
+            return match.group(0)[:match.start(2) - match.start(0)] + body + match.group(0)[match.end(2) - match.start(0):]
+
+        text = block_re.sub(replace_block, sheet.rest.decode("utf-8"))
+        if popped:
+            sheet.rest = text.encode("utf-8")
+        return popped
+
+
+class StreamSheet:
+    """
+    供 append_* / process_* 复用的最小 Worksheet 接口：
+    只包含扫描阶段保留的单元格与新写入的单元格，其余已有行在写出时按原始字节复制。
+    """
+
+    def __init__(self, workbook: "StreamWorkbook", title: str, part: str):
+        self.parent = workbook
+        self.title = title
+        self.part = part
+        self.row_dimensions = _StreamRowDimensions()
+        self.conditional_formatting = _StreamConditionalFormatting(self)
+        self.merged_ranges: List[str] = []
+        self._cells: Dict[int, Dict[int, StreamCell]] = {}
+        self._max_row = 0
+        self._max_column = 0
+        # 以下由扫描阶段填充
+        self.markup: Optional[_SheetMarkup] = None
+        self.scan_max_row = 0
+        self.scan_max_column = 0
+        self.last_data_row = 0
+        self.head = b""       # 第一行 <row> 之前的原始字节（含 <dimension>）
+        self.rest = b""       # </sheetData> 及之后的原始字节
+        self.body_start = 0   # 第一行 <row> 的偏移
+        self.body_end = 0     # 最后数据行结束的偏移，此前的行原样复制
+        self.tail_rows: List[tuple] = []
+        # 行标识：扫描时各行标识列的取值，共享字符串解析后折算为 identity_counts（键 -> 行数）
+        self.identity_rows: List[tuple] = []
+        self.identity_counts: Optional[Counter] = None
+
+    @property
+    def max_row(self) -> int:
+        return max(self.scan_max_row, self._max_row)
+
+    @property
+    def max_column(self) -> int:
+        return max(self.scan_max_column, self._max_column)
+
+    def cell(self, row: int, column: int, value=None) -> StreamCell:
+        cells = self._cells.get(row)
+        if cells is None:
+            cells = self._cells[row] = {}
+            self._max_row = max(self._max_row, row)
+        cell = cells.get(column)
+        if cell is None:
+            cell = cells[column] = StreamCell(self, row, column)
+            self._max_column = max(self._max_column, column)
+        if value is not None:
+            cell.value = value
+        return cell
+
+    def __getitem__(self, row_index: int) -> tuple:
+        if not isinstance(row_index, int):
+            raise TypeError("流式引擎仅支持按行号读取整行")
+        return tuple(self.cell(row_index, col_idx) for col_idx in range(1, self.max_column + 1))
+
+    def captured_rows(self, min_row: int) -> List[int]:
+        return sorted(row_idx for row_idx in self._cells if row_idx >= min_row)
+
+    def peek_value(self, row: int, column: int):
+        cell = self._cells.get(row, {}).get(column)
+        return None if cell is None else cell._value
+
+    def compact_trailing_rows(self) -> range:
+        """ 同 compact_trailing_rows：最后数据行之后的原有行都已完整解析，直接按取值判断并丢弃原始字节 """
+        merged = re.findall(b"<" + re.escape(self.markup.prefix) + rb'mergeCell\b[^>]*?\bref="([^"]+)"', self.rest)
+        keep_until = max([self.last_data_row] + [range_boundaries(ref.decode("ascii"))[3] for ref in merged])
+        for row_idx, _ in self.tail_rows:
+            if any(cell._value not in (None, "") for cell in self._cells.get(row_idx, {}).values()):
+                keep_until = max(keep_until, row_idx)
+        keep_until = min(keep_until, self.max_row)
+        removed = range(keep_until + 1, self.max_row + 1)
+        if removed:
+            self.tail_rows = [(row_idx, raw) for row_idx, raw in self.tail_rows if row_idx not in removed]
+            for row_idx in removed:
+                self._cells.pop(row_idx, None)
+                self.row_dimensions.pop(row_idx, None)
+            self.scan_max_row = min(self.scan_max_row, keep_until)
+            self._max_row = max(self._cells, default=0)
+        return removed
+
+    def load_cell(self, row: int, column: int, value, xf_id: int):
+        """ 写入扫描得到的已有单元格（不标记为修改） """
+        cell = self.cell(row, column)
+        cell._value = value
+        cell._xf = xf_id
+        if isinstance(value, _SharedStringRef):
+            self.parent.pending_strings.append(cell)
+
+    def merge_cells(self, range_string: Optional[str] = None, start_row: Optional[int] = None,
+                    start_column: Optional[int] = None, end_row: Optional[int] = None,
+                    end_column: Optional[int] = None):
+        if range_string is None:
+            range_string = f"{get_column_letter(start_column)}{start_row}:{get_column_letter(end_column)}{end_row}"
+        min_col, min_row, max_col, max_row = range_boundaries(range_string)
+        # 与 openpyxl 一致：合并区域内除左上角外的单元格清空取值（保留样式）
+        for row_idx in range(min_row, max_row + 1):
+            for col_idx in range(min_col, max_col + 1):
+                if (row_idx, col_idx) != (min_row, min_col):
+                    self.cell(row_idx, col_idx).value = None
+        self.merged_ranges.append(range_string)
+
+    def merged_range_count(self) -> int:
+        """ 原有 <mergeCell> 数量 + 本次新增 """
+        return len(re.findall(rb"<(?:\w+:)?mergeCell[\s/>]", self.rest)) + len(self.merged_ranges)
+
+    def _dirty_cells(self) -> Dict[int, List[StreamCell]]:
+        dirty: Dict[int, List[StreamCell]] = {}
+        for row_idx, cells in self._cells.items():
+            changed = [cell for cell in cells.values() if cell.dirty]
+            if changed:
+                dirty[row_idx] = changed
+        return dirty
+
+    def has_changes(self) -> bool:
+        return bool(self.merged_ranges or self.conditional_formatting.rules or self._dirty_cells())
+
+    def render_head(self) -> bytes:
+        def replace(match) -> bytes:
+            try:
+                min_col, min_row, max_col, _ = range_boundaries(match.group(2).decode("ascii"))
+            except (TypeError, ValueError):
+                min_col = min_row = max_col = None
+            max_col = max(max_col or 1, self.max_column)
+            ref = f"{get_column_letter(min_col or 1)}{min_row or 1}:{get_column_letter(max_col)}{self.max_row}"
+            return match.group(1) + ref.encode("ascii") + match.group(3)
+
+        pattern = b"(<" + re.escape(self.markup.prefix) + rb'dimension\b[^>]*?\bref=")([^"]*)(")'
+        return re.sub(pattern, replace, self.head, count=1)
+
+    def render_rows(self) -> bytes:
+        """ 最后数据行之后的原有行 + 新增行，按行号升序输出 """
+        dirty = self._dirty_cells()
+        if dirty and min(dirty) <= self.last_data_row:
+            raise SystemExit(f"[{self.title}] 流式引擎只支持在最后数据行之后追加（第 {min(dirty)} 行被修改）")
+        tail = dict(self.tail_rows)
+        prefix = self.markup.text_prefix
+        parts: List[bytes] = []
+        for row_idx in sorted(set(tail) | set(dirty)):
+            cells = dirty.get(row_idx)
+            if cells is None:
+                parts.append(tail[row_idx])
+                continue
+            rendered = {cell.column: self.parent.render_cell(prefix, cell) for cell in cells}
+            height = self.row_dimensions[row_idx].height if row_idx in self.row_dimensions else None
+            if row_idx in tail:
+                parts.append(self.markup.merge_row(tail[row_idx], rendered, height))
+            else:
+                parts.append(self.markup.build_row(row_idx, rendered, height))
+        return b"".join(parts)
+
+    def render_rest(self) -> bytes:
+        """ </sheetData> 之后的部分：追加合并单元格与条件格式 """
+        text = self.rest.decode("utf-8")
+        prefix = self.markup.text_prefix
+        if self.merged_ranges:
+            refs = "".join(f'<{prefix}mergeCell ref="{ref}"/>' for ref in self.merged_ranges)
+            text = _expand_empty_element(text, prefix, "mergeCells")
+            close = f"</{prefix}mergeCells>"
+            if close in text:
+                text = text.replace(close, refs + close, 1)
+                text = _bump_count(text, prefix, "mergeCells", len(self.merged_ranges))
+            else:
+                block = f'<{prefix}mergeCells count="{len(self.merged_ranges)}">{refs}</{prefix}mergeCells>'
+                text = _insert_before_first(text, prefix, SHEET_TAIL_ELEMENTS, "worksheet", block)
+        if self.conditional_formatting.rules:
+            priority = max((int(value) for value in re.findall(r'\bpriority="(\d+)"', text)), default=0)
+            blocks = []
+            for range_string, rule in self.conditional_formatting.rules:
+                if not rule.priority:
+                    priority += 1
+                    rule.priority = priority
+                if rule.dxf is not None:
+                    rule.dxfId = self.parent.styles.add_dxf(rule.dxf)
+                rule_xml = _prefix_tags(tostring(rule.to_tree()).decode("utf-8"), prefix)
+                blocks.append(f'<{prefix}conditionalFormatting sqref="{range_string}">{rule_xml}'
+                              f'</{prefix}conditionalFormatting>')
+            text = _insert_before_first(text, prefix, SHEET_TAIL_ELEMENTS[2:], "worksheet", "".join(blocks))
+        return text.encode("utf-8")
+
+
+class StreamWorkbook:
+    """
+    流式台账工作簿：只为五个目标 sheet 构造 StreamSheet，用法与 openpyxl Workbook 一致
+    （sheetnames / wb[name] / save），process_* 系列函数无需区分引擎。
+    """
+
+    def __init__(self, path: Path, dates: Iterable[dt.date], identities: bool = False):
+        """ identities：同时为各 sheet 统计行标识键（identity_counts），用于重建行标识索引（状态清单可用时不需要） """
+        self.path = Path(path)
+        self.reader = XlsxStreamReader(self.path)
+        self.epoch = self.reader.epoch
+        styles = self.reader.read_part(self.reader.styles_part)
+        if styles is None:
+            raise SystemExit(f"台账缺少 styles.xml，无法使用流式引擎：{self.path}")
+        self.styles = StylesPart(styles)
+        self.shared_strings = SharedStringsPart(self.reader)
+        self.pending_strings: List[StreamCell] = []
+        self.defined_names: Dict[str, str] = {}
+        self._sheets: Dict[str, StreamSheet] = {}
+        dates = list(dates)
+        for title, spec in LEDGER_SCAN_SPECS.items():
+            part = self.reader.sheet_parts.get(title)
+            if part is None:
+                continue
+            sheet = StreamSheet(self, title, part)
+            if not identities:
+                spec = replace(spec, identity_keys=())
+            scanner = _LedgerSheetScanner(sheet, spec, dates, self.reader)
+            with self.reader.open_part(part) as source:
+                scanner.scan(source)
+            profile_rows(title, scanned=scanner.row_idx)
+            self._sheets[title] = sheet
+        self._resolve_pending_strings()
+
+    @property
+    def sheetnames(self) -> List[str]:
+        return list(self._sheets)
+
+    def __getitem__(self, title: str) -> StreamSheet:
+        return self._sheets[title]
+
+    def set_defined_name(self, name: str, ref: str):
+        """ 工作簿级定义名称，保存时写入 workbook.xml """
+        self.defined_names[name] = ref
+
+    def derive_style(self, xf_id: int, alignment: Optional[Alignment] = None, number_format: Optional[str] = None) -> int:
+        """ 供 TemplateStylePool 使用：在 xf_id 基础上替换对齐 / 数字格式 """
+        return self.styles.derive(xf_id, alignment=alignment, number_format=number_format)
+
+    def _resolve_pending_strings(self):
+        indices = {cell._value.index for cell in self.pending_strings}
+        for sheet in self._sheets.values():
+            for values in sheet.identity_rows:
+                indices.update(value.index for value in values if isinstance(value, _SharedStringRef))
+        strings = self.shared_strings.resolve(indices)
+        for cell in self.pending_strings:
+            # 同一单元格可能被多条保留规则登记
+            if isinstance(cell._value, _SharedStringRef):
+                cell._value = strings.get(cell._value.index, "")
+        self.pending_strings = []
+        for sheet in self._sheets.values():
+            if sheet.identity_rows:
+                self._count_identities(sheet, strings)
+
+    @staticmethod
+    def _count_identities(sheet: StreamSheet, strings: Dict[int, str]):
+        """ 扫描时记下的标识列取值 -> 行标识键计数；之后只保留计数 """
+        columns = identity_columns(LEDGER_SCAN_SPECS[sheet.title].identity_keys)
+        counts: Counter = Counter()
+        for values in sheet.identity_rows:
+            row = {col_idx: strings.get(value.index, "") if isinstance(value, _SharedStringRef) else value
+                   for col_idx, value in zip(columns, values)}
+            key = row_identity(sheet.title, row.get)
+            if key is not None:
+                counts[key] += 1
+        sheet.identity_counts = counts
+        sheet.identity_rows = []
+
+    def render_cell(self, prefix: str, cell: StreamCell) -> str:
+        ref = f"{get_column_letter(cell.column)}{cell.row}"
+        style = f' s="{cell._xf}"' if cell._xf else ""
+        value = cell._value
+        if value is None or value == "":
+            return f'<{prefix}c r="{ref}"{style}/>' if cell._xf else ""
+        data_type = cell.data_type
+        if data_type == "f":
+            return f'<{prefix}c r="{ref}"{style}><{prefix}f>{escape(value[1:])}</{prefix}f></{prefix}c>'
+        if data_type == "s":
+            if self.shared_strings.part is None:
+                inline = _render_text(prefix, value)
+                return f'<{prefix}c r="{ref}"{style} t="inlineStr"><{prefix}is>{inline}</{prefix}is></{prefix}c>'
+            type_attr, text = ' t="s"', str(self.shared_strings.add(value))
+        elif data_type == "b":
+            type_attr, text = ' t="b"', "1" if value else "0"
+        elif data_type == "e":
+            type_attr, text = ' t="e"', escape(value)
+        elif data_type == "d":
+            type_attr, text = "", safe_string(to_excel(value, self.epoch))
+        else:
+            type_attr, text = "", safe_string(value)
+        return f'<{prefix}c r="{ref}"{style}{type_attr}><{prefix}v>{text}</{prefix}v></{prefix}c>'
+
+    def _render_workbook_xml(self) -> bytes:
+        """ 与 openpyxl 保存时一致：打开文件时强制全量重算，新增公式无需缓存值 """
+        text = self.reader.read_part(self.reader.workbook_part).decode("utf-8")
+        match = re.search(r"<([\w.-]+:)?workbook\b", text)
+        prefix = (match.group(1) or "") if match else ""
+        if self.defined_names:
+            text = self._render_defined_names(text, prefix)
+        calc = re.search(rf"<{re.escape(prefix)}calcPr\b[^>]*?/?>", text)
+        if calc is None:
+            block = f'<{prefix}calcPr calcId="124519" fullCalcOnLoad="1"/>'
+            return _insert_before_first(text, prefix, WORKBOOK_CALC_FOLLOWERS, "workbook", block).encode("utf-8")
+        tag = calc.group(0)
+        if "fullCalcOnLoad=" in tag:
+            updated = re.sub(r'fullCalcOnLoad="[^"]*"', 'fullCalcOnLoad="1"', tag)
+        else:
+            closing = "/>" if tag.endswith("/>") else ">"
+            updated = tag[:-len(closing)].rstrip() + ' fullCalcOnLoad="1"' + closing
+        return (text[:calc.start()] + updated + text[calc.end():]).encode("utf-8")
+
+    def _render_defined_names(self, text: str, prefix: str) -> str:
+        """ 替换同名的工作簿级 definedName（无 localSheetId），其余追加到 definedNames 末尾 """
+        p = re.escape(prefix)
+        pending = dict(self.defined_names)
+
+        def replace(match) -> str:
+            attrs = dict(re.findall(r'([\w:]+)="([^"]*)"', match.group(1)))
+            name = _xml_unescape(attrs.get("name", "").encode("utf-8"))
+            if "localSheetId" in attrs or name not in pending:
+                return match.group(0)
+            return f"<{prefix}definedName{match.group(1)}>{escape(pending.pop(name))}</{prefix}definedName>"
+
+        text = re.sub(rf"<{p}definedName\b([^>]*)>.*?</{p}definedName>", replace, text, flags=re.S)
+        if not pending:
+            return text
+        added = "".join(f"<{prefix}definedName name={quoteattr(name)}>{escape(ref)}</{prefix}definedName>"
+                        for name, ref in pending.items())
+        text = _expand_empty_element(text, prefix, "definedNames")
+        close = f"</{prefix}definedNames>"
+        if close in text:
+            return text.replace(close, added + close, 1)
+        return _insert_before_first(text, prefix, ("calcPr", *WORKBOOK_CALC_FOLLOWERS), "workbook",
+                                    f"<{prefix}definedNames>{added}</{prefix}definedNames>")
+
+    def _iter_sheet_part(self, sheet: StreamSheet, head: bytes, rows: bytes, rest: bytes) -> Iterator[bytes]:
+        yield head
+        with self.reader.open_part(sheet.part) as source:
+            source.seek(sheet.body_start)
+            remaining = sheet.body_end - sheet.body_start
+            while remaining > 0:
+                chunk = source.read(min(remaining, STREAM_COPY_CHUNK))
+                if not chunk:
+                    raise SystemExit(f"台账工作表读取中断：{sheet.title}")
+                remaining -= len(chunk)
+                yield chunk
+        yield rows
+        yield rest
+
+    def close(self):
+        self.reader.close()
+
+    def save(self, output_path: Path, level: int = SAVE_ZIP_LEVEL, threads: int = 1):
+        """
+        写出到临时文件后替换目标路径（输出路径可以与台账相同），完成后关闭源文件；
+        level 只作用于改写过的部件，未修改的部件仍原样复制压缩字节。
+        """
+        output_path = Path(output_path)
+        changed = [sheet for sheet in self._sheets.values() if sheet.has_changes()]
+        # 先渲染新增行：共享字符串与样式要在所有 sheet 渲染完之后才确定
+        rendered = {sheet.part: (sheet, sheet.render_head(), sheet.render_rows(), sheet.render_rest())
+                    for sheet in changed}
+        replacements: Dict[str, bytes] = {}
+        if changed:
+            replacements[self.reader.workbook_part] = self._render_workbook_xml()
+            styles = self.styles.render()
+            if styles is not None:
+                replacements[self.reader.styles_part] = styles
+
+        fd, temp_path = tempfile.mkstemp(prefix=".ledger-", suffix=".xlsx", dir=output_path.parent)
+        try:
+            with os.fdopen(fd, "wb") as handle, open(self.path, "rb") as source:
+                compressor = PartCompressor(XlsxZipWriter(handle), level, threads, source)
+                try:
+                    for info in self.reader.archive.infolist():
+                        name = info.filename
+                        if name in rendered:
+                            compressor.submit(info, self._iter_sheet_part(*rendered[name]))
+                        elif name == self.shared_strings.part and self.shared_strings.new_strings:
+                            compressor.submit(info, self.shared_strings.iter_updated())
+                        elif name in replacements:
+                            compressor.submit(info, (replacements[name],))
+                        else:
+                            compressor.copy(info)
+                except BaseException:
+                    compressor.abort()
+                    raise
+                compressor.close()
+            self.close()
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+# =============================================================================
+# 输出保存（--compression-level / --save-threads）
+# openpyxl 的 wb.save 在单线程里依次序列化并 deflate 每个部件，大台账上往往比追加本身还慢。
+# 这里让 openpyxl 的 ExcelWriter 写入一个 zip 替身：每个部件序列化完成后交给线程池压缩，
+# 主线程同时序列化下一个工作表；流式引擎的改写部件同样经 PartCompressor 并行压缩。
+# =============================================================================
+
+SAVE_THREADS_MAX = 4
+
+
+def resolve_save_threads(requested: Optional[int]) -> int:
+    if requested is not None:
+        return max(requested, 1)
+    return max(1, min(os.cpu_count() or 1, SAVE_THREADS_MAX))
+
+
+def iter_file_chunks(path: str, remove: bool = False) -> Iterator[bytes]:
+    try:
+        with open(path, "rb") as handle:
+            while True:
+                chunk = handle.read(STREAM_COPY_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove and os.path.exists(path):
+            os.remove(path)
 
-    if added:
-        print(f"[客户表] 新增 {added} 行（资产明细缺失 {len(missing_asset)}，下载客户表缺失 {len(missing_source)}）")
+
+class PartArchive:
+    """
+    供 openpyxl ExcelWriter 写入的 zip 替身（只实现它用到的 writestr / write / namelist / close）。
+    工作表由 openpyxl 先写到临时文件、交给 write() 后立即删除：这里先建立硬链接，
+    压缩读完后再删除；文件系统不支持硬链接时读入内存。
+    """
+
+    def __init__(self, compressor: PartCompressor):
+        self._compressor = compressor
+        self._names: List[str] = []
+        self._links: List[str] = []
+
+    def _submit(self, name: str, chunks: Iterable[bytes]):
+        info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        info.external_attr = 0o600 << 16
+        self._names.append(name)
+        self._compressor.submit(info, chunks)
+
+    def writestr(self, name: str, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._submit(name, (data,))
+
+    def write(self, filename: str, arcname: str):
+        link = f"{filename}.part"
+        try:
+            os.link(filename, link)
+        except OSError:
+            with open(filename, "rb") as handle:
+                self._submit(arcname, (handle.read(),))
+            return
+        self._links.append(link)
+        self._submit(arcname, iter_file_chunks(link, remove=True))
+
+    def namelist(self) -> List[str]:
+        return list(self._names)
+
+    def close(self):
+        self._compressor.close()
+
+    def abort(self):
+        self._compressor.abort()
+        # 未开始压缩的任务不会执行到删除硬链接的 finally
+        for link in self._links:
+            if os.path.exists(link):
+                os.remove(link)
+
+
+def save_openpyxl_workbook(wb, output_path: Path, level: int = SAVE_ZIP_LEVEL, threads: int = 1):
+    """
+    等同于 wb.save(output_path)，但部件并行压缩、压缩级别可调；
+    与 StreamWorkbook.save 一样先写临时文件再替换，保存失败时原文件（可能就是台账本身）不受影响
+    """
+    output_path = Path(output_path)
+    fd, temp_path = tempfile.mkstemp(prefix=".ledger-", suffix=".xlsx", dir=output_path.parent)
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            archive = PartArchive(PartCompressor(XlsxZipWriter(handle), level, threads))
+            wb.properties.modified = dt.datetime.now(tz=dt.timezone.utc).replace(tzinfo=None)
+            try:
+                ExcelWriter(wb, archive).save()
+            except BaseException:
+                archive.abort()
+                raise
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def save_ledger_workbook(wb, output_path: Path, level: int = SAVE_ZIP_LEVEL, threads: int = 1):
+    if isinstance(wb, StreamWorkbook):
+        wb.save(output_path, level, threads)
     else:
-        print("[客户表] 未新增行")
+        save_openpyxl_workbook(wb, output_path, level, threads)
 
-    if missing_asset:
-        print("[客户表] 警告：资产明细未找到 -> " + ", ".join(missing_asset))
-    if missing_source:
-        print("[客户表] 警告：下载客户表未找到 -> " + ", ".join(missing_source))
 
-    return added
+# =============================================================================
+# 台账状态清单（manifest）
+# 与输出台账同目录的 <文件名>.manifest.json，保存每日处理需要查询的历史汇总，
+# 避免每次都全表扫描客户表 / 资产明细 / 融资及还款明细；每次追加后只吸收新增行。
+# 台账文件的 sha256 与清单记录不一致（清单缺失、台账被手工修改）时从台账重建。
+# =============================================================================
 
+MANIFEST_VERSION = 2
+MANIFEST_SUFFIX = ".manifest.json"
 
-def main():
-    args = parse_args()
-    target_date = parse_input_date(args.date)
-
-    ledger_path = Path(args.ledger).resolve()
-    loan_path = Path(args.loan).resolve()
-    factoring_path = Path(args.factoring_repay).resolve()
-    refactoring_path = Path(args.refactoring_repay).resolve()
-    zhongdeng_path = Path(args.zhongdeng).resolve()
-    customer_path = Path(args.customer).resolve()
-    output_path = Path(args.output).resolve()
 
-    # 加载台账工作簿
-    wb = load_workbook(ledger_path, data_only=False)
+def manifest_path_for(ledger_path: Path) -> Path:
+    return ledger_path.with_name(ledger_path.name + MANIFEST_SUFFIX)
+
+
+def encode_manifest_value(value):
+    """ 单元格取值转为 JSON（日期类带类型标记，便于原样还原） """
+    if isinstance(value, dt.datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, dt.date):
+        return {"date": value.isoformat()}
+    if isinstance(value, (dt.time, dt.timedelta)):
+        return str(value)
+    return value
+
+
+def decode_manifest_value(value):
+    if isinstance(value, dict):
+        if "datetime" in value:
+            return dt.datetime.fromisoformat(value["datetime"])
+        if "date" in value:
+            return dt.date.fromisoformat(value["date"])
+    return value
+
+
+class LedgerManifest:
+    """
+    - sheets：各目标 sheet 的最后数据行（A 列）与已吸收到的行号（max_row）；
+    - last_date：融资及还款明细最后数据行的日期；
+    - customer_names：客户表 E 列已有客户；
+    - asset_index：资产明细 P/R 列名称首次出现行的 C 列通道与 Y 列日期；
+    - financing_names：融资及还款明细按 W 列日期分组的 H/I 列名称（按行序去重）。
+      流式引擎只保留目标日期的行，由它重建时为 None，查询时退回扫描保留的行；
+    - identities：行标识索引（RowIdentityIndex），重建时随全表扫描建立，之后由 process_target_date 计入新增行。
+    """
+
+    def __init__(self):
+        self.ledger_sha256 = ""
+        self.sheets: Dict[str, Dict[str, int]] = {}
+        self.last_date: Optional[dt.date] = None
+        self.customer_names: set[str] = set()
+        self.asset_index: Dict[str, tuple] = {}
+        self.financing_names: Optional[Dict[dt.date, List[str]]] = {}
+        self.identities = RowIdentityIndex()
+
+    @classmethod
+    def build(cls, wb) -> "LedgerManifest":
+        manifest = cls()
+        if SHEET_FINANCING_REPAYMENT in wb.sheetnames and hasattr(wb[SHEET_FINANCING_REPAYMENT], "captured_rows"):
+            manifest.financing_names = None
+        for title in LEDGER_TARGET_SHEETS:
+            if title in wb.sheetnames:
+                ws = wb[title]
+                min_row = 4 if title == SHEET_ASSET_DETAIL else 2
+                rows = list(iter_scan_rows(ws, min_row))
+                manifest._absorb_rows(ws, title, rows)
+        manifest.identities = RowIdentityIndex.build(wb)
+        return manifest
+
+    @classmethod
+    def load_current(cls, ledger_path: Path) -> Optional["LedgerManifest"]:
+        """ 读取与台账一致的状态清单；不存在或不一致时返回 None，由调用方在加载台账后 build 重建 """
+        path = manifest_path_for(ledger_path)
+        manifest = cls.load(path)
+        if manifest is not None and manifest.ledger_sha256 == hash_file(ledger_path):
+            print(f"[manifest] 使用 {path.name}")
+            return manifest
+        reason = "不存在" if manifest is None else "与台账不一致"
+        print(f"[manifest] {path.name} {reason}，从台账重建")
+        return None
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["LedgerManifest"]:
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                payload = json.load(handle)
+            if payload.get("version") != MANIFEST_VERSION:
+                return None
+            manifest = cls()
+            manifest.ledger_sha256 = payload["ledger_sha256"]
+            manifest.sheets = payload["sheets"]
+            manifest.last_date = dt.date.fromisoformat(payload["last_date"]) if payload["last_date"] else None
+            manifest.customer_names = set(payload["customer_names"])
+            manifest.asset_index = {
+                name: (decode_manifest_value(channel), decode_manifest_value(first_date))
+                for name, (channel, first_date) in payload["asset_index"].items()
+            }
+            financing_names = payload["financing_names"]
+            manifest.financing_names = None if financing_names is None else {
+                dt.date.fromisoformat(day): names for day, names in financing_names.items()
+            }
+            manifest.identities = RowIdentityIndex(payload["identities"])
+            return manifest
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            print(f"[manifest] 读取失败，忽略：{path.name}（{exc}）")
+            return None
+
+    def save(self, ledger_path: Path):
+        """ 台账保存后调用：记录新台账的 sha256 并写到其旁边 """
+        self.ledger_sha256 = hash_file(ledger_path)
+        payload = {
+            "version": MANIFEST_VERSION,
+            "ledger_sha256": self.ledger_sha256,
+            "sheets": self.sheets,
+            "last_date": self.last_date.isoformat() if self.last_date else None,
+            "customer_names": sorted(self.customer_names),
+            "asset_index": {
+                name: [encode_manifest_value(channel), encode_manifest_value(first_date)]
+                for name, (channel, first_date) in self.asset_index.items()
+            },
+            "financing_names": None if self.financing_names is None else {
+                day.isoformat(): names for day, names in sorted(self.financing_names.items())
+            },
+            "identities": self.identities.to_json(),
+        }
+        path = manifest_path_for(ledger_path)
+        fd, temp_path = tempfile.mkstemp(prefix=f".{path.name}-", dir=path.parent)
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def absorb_new_rows(self, wb, title: str):
+        """ 追加后调用：只吸收上次记录的 max_row 之后的行 """
+        if title not in wb.sheetnames:
+            return
+        ws = wb[title]
+        start = self.sheets.get(title, {}).get("max_row", 0) + 1
+        min_row = 4 if title == SHEET_ASSET_DETAIL else 2
+        self._absorb_rows(ws, title, range(max(start, min_row), ws.max_row + 1))
+
+    def _absorb_rows(self, ws, title: str, rows: Iterable[int]):
+        if title == SHEET_FINANCING_REPAYMENT and self.financing_names is not None:
+            for row_idx in rows:
+                day = normalize_excel_date(peek_cell_value(ws, row_idx, COL_W))
+                if day is None:
+                    continue
+                names = self.financing_names.setdefault(day, [])
+                for col_idx in (COL_H, COL_I):
+                    name = normalize_string(peek_cell_value(ws, row_idx, col_idx))
+                    if name and name != "/" and name not in names:
+                        names.append(name)
+        elif title == SHEET_ASSET_DETAIL:
+            for row_idx in rows:
+                for col_idx in (COL_P, COL_R):
+                    name = normalize_string(peek_cell_value(ws, row_idx, col_idx))
+                    if name and name not in self.asset_index:
+                        self.asset_index[name] = (peek_cell_value(ws, row_idx, COL_C),
+                                                  peek_cell_value(ws, row_idx, COL_Y))
+        elif title == SHEET_CUSTOMER:
+            for row_idx in rows:
+                name = normalize_string(peek_cell_value(ws, row_idx, COL_E))
+                if name and name != "/":
+                    self.customer_names.add(name)
+        self.sheets[title] = {"last_row": find_last_data_row(ws), "max_row": ws.max_row}
+        if title == SHEET_FINANCING_REPAYMENT:
+            self.last_date = get_last_existing_date(ws)
+
+    def customer_candidates(self, target_date: dt.date) -> Optional[List[str]]:
+        """ 同 collect_customer_names_from_financing；历史不完整时返回 None """
+        if self.financing_names is None:
+            return None
+        return list(self.financing_names.get(target_date, []))
+
+    def asset_lookup(self, target_names: set[str]) -> Dict[str, Dict[str, object]]:
+        """ 同 build_asset_lookup_for_customers """
+        lookup: Dict[str, Dict[str, object]] = {}
+        for name in target_names:
+            entry = self.asset_index.get(name)
+            if entry is not None:
+                lookup[name] = {"channel": entry[0], "first_date": entry[1]}
+        return lookup
+
+
+# =============================================================================
+# 运行剖析（--profile）
+# 记录各阶段的墙钟时间、CPU 时间与进程峰值 RSS，以及各 sheet 扫描 / 追加的行数，
+# 写成一个 JSON 文档，由 ledgerDaily.ts 转发到应用日志。
+# 并发读取数据源时，各数据源在子进程内单独测量，记为 parallel 阶段。
+# Python 内存峰值（tracemalloc）只在 --profile-memory 时记录：追踪会明显拖慢执行，
+# 这时文档中 memory_tracing 为 true，各阶段耗时都是在追踪下测得的，不宜与普通剖析直接比较。
+# =============================================================================
+
+PROFILE_VERSION = 2
+PROFILE_DUMP_SUFFIX = ".prof"
+BYTES_PER_MB = 1024 * 1024
+
+
+def _windows_peak_rss_bytes() -> Optional[int]:
+    try:
+        import ctypes
+        from ctypes import wintypes
+    except ImportError:
+        return None
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    try:
+        kernel32 = ctypes.WinDLL("kernel32")
+        psapi = ctypes.WinDLL("psapi")
+    except (AttributeError, OSError):
+        return None
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = (wintypes.HANDLE, ctypes.c_void_p, wintypes.DWORD)
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """ 当前进程启动以来的峰值常驻内存；无法获取时返回 None """
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss_bytes()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def to_mb(value: Optional[int]) -> Optional[float]:
+    return None if value is None else round(value / BYTES_PER_MB, 1)
+
+
+class PhaseTimer:
+    """
+    单个阶段的测量：墙钟时间、CPU 时间，trace_memory 时还有 Python 内存峰值。
+    阶段可以嵌套：内层开始时会重置 tracemalloc 峰值，结束时把自己的峰值交给外层取最大值。
+    非主线程（台账后台加载）只统计本线程 CPU，不重置 tracemalloc 峰值，以免干扰主线程正在测量的阶段。
+    """
+
+    active: List["PhaseTimer"] = []
+
+    def __init__(self, trace_memory: bool = False):
+        self.on_main_thread = threading.current_thread() is threading.main_thread()
+        self.cpu_clock = time.process_time if self.on_main_thread else time.thread_time
+        self.trace_memory = trace_memory and self.on_main_thread
+        self.owns_tracing = False
+        self.nested_peak = 0
+        if self.trace_memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                self.owns_tracing = True
+            PhaseTimer.active.append(self)
+        self.wall_started = time.perf_counter()
+        self.cpu_started = self.cpu_clock()
+
+    def stop(self) -> Dict[str, object]:
+        stats: Dict[str, object] = {
+            "wall_s": round(time.perf_counter() - self.wall_started, 3),
+            "cpu_s": round(self.cpu_clock() - self.cpu_started, 3),
+            "py_peak_mb": None,
+        }
+        if self.trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.nested_peak)
+            stats["py_peak_mb"] = to_mb(peak)
+            PhaseTimer.active.remove(self)
+            if PhaseTimer.active:
+                parent = PhaseTimer.active[-1]
+                parent.nested_peak = max(parent.nested_peak, peak)
+            if self.owns_tracing:
+                tracemalloc.stop()
+        stats["rss_peak_mb"] = to_mb(peak_rss_bytes())
+        stats["pid"] = os.getpid()
+        return stats
+
+
+def measure_call(trace_memory: bool, fn, *args):
+    """ 执行 fn(*args) 并返回 (结果, 阶段指标)；可直接提交到进程池或线程池 """
+    timer = PhaseTimer(trace_memory)
+    result = fn(*args)
+    return result, timer.stop()
+
+
+class RunProfile:
+    """ 一次 update_ledger 的剖析结果；通过 ACTIVE_PROFILE 供各处理函数登记，未开启时为 None """
+
+    def __init__(self, hotspot_limit: int = 0, trace_memory: bool = False):
+        self.hotspot_limit = hotspot_limit
+        self.trace_memory = trace_memory
+        self.phases: List[Dict[str, object]] = []
+        self.sheets: Dict[str, Dict[str, int]] = {}
+        self.sources: Dict[str, int] = {}
+        self.profiler = cProfile.Profile() if hotspot_limit > 0 else None
+        self.timer: Optional[PhaseTimer] = None
+        self.total: Dict[str, object] = {}
+
+    def start(self):
+        self.timer = PhaseTimer(self.trace_memory)
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.total = self.timer.stop()
+
+    @contextmanager
+    def phase(self, name: str, **fields):
+        timer = PhaseTimer(self.trace_memory)
+        try:
+            yield
+        finally:
+            self.add_phase(name, timer.stop(), **fields)
+
+    def add_phase(self, name: str, stats: Dict[str, object], **fields):
+        self.phases.append({"name": name, **fields, **stats})
+
+    def add_rows(self, title: str, scanned: int = 0, appended: int = 0):
+        entry = self.sheets.setdefault(title, {"scanned": 0, "appended": 0})
+        entry["scanned"] += scanned
+        entry["appended"] += appended
+
+    def count_scanned(self, title: str, rows: Iterable[int]) -> Iterator[int]:
+        """ 包装 iter_scan_rows 的结果，按实际遍历到的行计数（提前 break 的扫描只计已读行） """
+        entry = self.sheets.setdefault(title, {"scanned": 0, "appended": 0})
+        for row_idx in rows:
+            entry["scanned"] += 1
+            yield row_idx
+
+    def add_sources(self, sources: "SourceRows"):
+        def bucket_rows(buckets: Dict[dt.date, Dict[str, List[RepayRecord]]]) -> int:
+            return sum(len(rows) for by_fee in buckets.values() for rows in by_fee.values())
+
+        self.sources = {
+            "loan": sum(len(rows) for rows in sources.loan_rows.values()),
+            "factoring_repay": bucket_rows(sources.factoring_buckets),
+            "refactoring_repay": bucket_rows(sources.refactoring_buckets),
+            "zhongdeng": sum(len(rows) for rows in sources.zhongdeng_rows.values()),
+            # 下载客户表按需查询，这里是实际查到的客户数
+            "customer": len(sources.customer_source.records),
+        }
+
+    def hotspots(self) -> List[Dict[str, object]]:
+        """ cProfile 统计中自身耗时最多的函数（只覆盖主进程主线程） """
+        if self.profiler is None:
+            return []
+        stats = pstats.Stats(self.profiler).stats
+        ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:self.hotspot_limit]
+        return [
+            {
+                "function": pstats.func_std_string(func),
+                "calls": calls,
+                "primitive_calls": primitive_calls,
+                "tottime_s": round(tottime, 4),
+                "cumtime_s": round(cumtime, 4),
+            }
+            for func, (primitive_calls, calls, tottime, cumtime, _callers) in ranked
+        ]
+
+    def write(self, path: Path, args: argparse.Namespace, result: Dict[str, object]):
+        document = {
+            "version": PROFILE_VERSION,
+            "output": result["output"],
+            "added": result["added"],
+            "engine": args.engine,
+            "dates": [f"{day:%Y%m%d}" for day in resolve_target_dates(args)],
+            # 为 true 时各阶段耗时在 tracemalloc 追踪下测得，偏大
+            "memory_tracing": self.trace_memory,
+            "total": self.total,
+            "phases": self.phases,
+            "sheets": self.sheets,
+            "sources": self.sources,
+        }
+        if self.profiler is not None:
+            dump_path = path.with_name(path.name + PROFILE_DUMP_SUFFIX)
+            self.profiler.dump_stats(str(dump_path))
+            document["hotspots"] = self.hotspots()
+            document["cprofile_dump"] = str(dump_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(document, handle, ensure_ascii=False, indent=2)
+        print(f"[profile] 总耗时 {self.total['wall_s']}s（CPU {self.total['cpu_s']}s，RSS 峰值 "
+              f"{self.total['rss_peak_mb']} MB）-> {path}")
+
+
+ACTIVE_PROFILE: Optional[RunProfile] = None
+
+
+@contextmanager
+def profile_phase(name: str, **fields):
+    """ 剖析开启时把代码块记为一个阶段，否则什么都不做 """
+    if ACTIVE_PROFILE is None:
+        yield
+        return
+    with ACTIVE_PROFILE.phase(name, **fields):
+        yield
+
+
+def profile_rows(title: str, scanned: int = 0, appended: int = 0):
+    if ACTIVE_PROFILE is not None:
+        ACTIVE_PROFILE.add_rows(title, scanned, appended)
+
+
+def submit_measured(executor, fn, *args):
+    """ 同 executor.submit；剖析开启时改为在执行方（子进程 / 线程）内测量，配合 measured_result 取回 """
+    if ACTIVE_PROFILE is None:
+        return executor.submit(fn, *args)
+    return executor.submit(measure_call, ACTIVE_PROFILE.trace_memory, fn, *args)
+
+
+def measured_result(future, name: str):
+    result = future.result()
+    if ACTIVE_PROFILE is None:
+        return result
+    value, stats = result
+    ACTIVE_PROFILE.add_phase(name, stats, parallel=True)
+    return value
+
 
-    # 收集数据（统一查询条件）
-    loan_rows = collect_loan_rows(loan_path, target_date)
-    factoring_repay_rows = collect_repay_rows(factoring_path, target_date, fee_type="本金")
-    refactoring_repay_rows = collect_repay_rows(refactoring_path, target_date, fee_type="本金")
-    factoring_interest_rows = collect_repay_rows(factoring_path, target_date, fee_type="资金费")
-    refactoring_interest_rows = collect_repay_rows(refactoring_path, target_date, fee_type="资金费")
-    finance_codes = set()
+# =============================================================================
+# 数据源并发读取
+# =============================================================================
+
+@dataclass
+class SourcePaths:
+    ledger: Path
+    loan: Path
+    factoring_repay: Path
+    refactoring_repay: Path
+    zhongdeng: Path
+    customer: Path
+
+
+@dataclass
+class SourceRows:
+    """各数据源按日期筛选后的记录（SourceRecord 按取值元组 pickle，可廉价地跨进程传递）"""
+    loan_rows: Dict[dt.date, List[LoanRecord]]
+    factoring_buckets: Dict[dt.date, Dict[str, List[RepayRecord]]]
+    refactoring_buckets: Dict[dt.date, Dict[str, List[RepayRecord]]]
+    zhongdeng_rows: Dict[dt.date, List[ZhongdengRecord]]
+    customer_source: CustomerSourceLookup
+
+
+def collect_finance_codes(loan_rows: Iterable[LoanRecord]) -> set[str]:
+    finance_codes: set[str] = set()
     for row in loan_rows:
-        code = normalize_string(row[LOAN_COL_L - 1])
+        code = normalize_string(row.L)
         if code:
             finance_codes.add(code)
-    zhongdeng_rows = collect_zhongdeng_rows(zhongdeng_path, finance_codes)
+    return finance_codes
+
+
+def finance_codes_by_date(loan_rows: Dict[dt.date, List[LoanRecord]]) -> Dict[dt.date, set[str]]:
+    return {day: collect_finance_codes(rows) for day, rows in loan_rows.items()}
+
+
+def load_ledger_workbook(ledger_path: Path, engine: str = LEDGER_ENGINE_OPENPYXL, dates: Sequence[dt.date] = (),
+                         identities: bool = False):
+    if engine == LEDGER_ENGINE_STREAM:
+        return StreamWorkbook(ledger_path, dates, identities)
+    return load_workbook(ledger_path, data_only=False)
+
+
+def resolve_worker_count(requested: Optional[int]) -> int:
+    if requested is not None:
+        return max(requested, 1)
+    # 预读的四个数据源各占一个进程即可，再多没有收益（下载客户表由客户表计划按需查询）
+    return min(INGEST_MAX_WORKERS, os.cpu_count() or 1)
+
+
+def ingest_serial(paths: SourcePaths, dates: List[dt.date], cache: Optional[SourceCache],
+                  engine: str = LEDGER_ENGINE_OPENPYXL, with_ledger: bool = True, identities: bool = False):
+    wb = None
+    if with_ledger:
+        with profile_phase("load_ledger"):
+            wb = load_ledger_workbook(paths.ledger, engine, dates, identities)
+    with profile_phase("collect_loan"):
+        loan_rows = collect_loan_rows_by_date(paths.loan, dates, cache)
+    with profile_phase("collect_factoring_repay"):
+        factoring_buckets = collect_repay_buckets_by_date(paths.factoring_repay, dates, cache=cache)
+    with profile_phase("collect_refactoring_repay"):
+        refactoring_buckets = collect_repay_buckets_by_date(paths.refactoring_repay, dates, cache=cache)
+    with profile_phase("collect_zhongdeng"):
+        zhongdeng_rows = collect_zhongdeng_rows_by_date(paths.zhongdeng, finance_codes_by_date(loan_rows), cache)
+    sources = SourceRows(
+        loan_rows=loan_rows,
+        factoring_buckets=factoring_buckets,
+        refactoring_buckets=refactoring_buckets,
+        zhongdeng_rows=zhongdeng_rows,
+        customer_source=CustomerSourceLookup(paths.customer),
+    )
+    return wb, sources
+
+
+def ingest_sources(paths: SourcePaths, dates: List[dt.date], workers: int, cache: Optional[SourceCache] = None,
+                   engine: str = LEDGER_ENGINE_OPENPYXL, with_ledger: bool = True, identities: bool = False):
+    """
+    并发读取台账与四个按日期筛选的数据源（每个数据源只扫描一次，同时筛选所有目标日期）：
+    - 数据源在进程池中解析，返回普通元组；
+    - 下载客户表不预读，由客户表计划按新增客户名称查询（CustomerSourceLookup）；
+    - 台账在本进程的后台线程中加载（Workbook 对象无法廉价地跨进程传递）；
+    - 中登登记表依赖放款明细的融资申请号，放款明细就绪后立即提交。
+    with_ledger=False 时只读取数据源，返回的工作簿为 None（常驻 worker 已缓存台账时使用）；
+    identities 见 StreamWorkbook。
+    """
+    if workers <= 1:
+        return ingest_serial(paths, dates, cache, engine, with_ledger, identities)
+
+    with ThreadPoolExecutor(max_workers=1) as ledger_loader, ProcessPoolExecutor(max_workers=workers) as pool:
+        ledger_future = (submit_measured(ledger_loader, load_ledger_workbook, paths.ledger, engine, dates, identities)
+                         if with_ledger else None)
+        loan_future = submit_measured(pool, collect_loan_rows_by_date, paths.loan, dates, cache)
+        factoring_future = submit_measured(pool, collect_repay_buckets_by_date, paths.factoring_repay, dates, None, cache)
+        refactoring_future = submit_measured(pool, collect_repay_buckets_by_date, paths.refactoring_repay, dates, None, cache)
+
+        loan_rows = measured_result(loan_future, "collect_loan")
+        zhongdeng_future = submit_measured(pool, collect_zhongdeng_rows_by_date, paths.zhongdeng,
+                                           finance_codes_by_date(loan_rows), cache)
+
+        sources = SourceRows(
+            loan_rows=loan_rows,
+            factoring_buckets=measured_result(factoring_future, "collect_factoring_repay"),
+            refactoring_buckets=measured_result(refactoring_future, "collect_refactoring_repay"),
+            zhongdeng_rows=measured_result(zhongdeng_future, "collect_zhongdeng"),
+            customer_source=CustomerSourceLookup(paths.customer),
+        )
+        wb = measured_result(ledger_future, "load_ledger") if ledger_future else None
+    return wb, sources
+
+
+def build_source_cache(args: argparse.Namespace) -> Optional[SourceCache]:
+    if args.no_cache:
+        return None
+    cache_dir = Path(args.cache_dir).resolve() if args.cache_dir else default_cache_dir()
+    return SourceCache(cache_dir, max(args.cache_max_mb, 0) * 1024 * 1024)
+
+
+def process_target_date(wb, sources: SourceRows, target_date: dt.date, manifest: Optional[LedgerManifest] = None,
+                        lookups: Optional[LookupFormulas] = None,
+                        identities: Optional[RowIdentityIndex] = None) -> List[SheetPlan]:
+    """
+    按单日规则依次为各个 sheet 生成追加计划并写入，返回各 sheet 的计划；
+    后面的 sheet 依赖前面已写入的行（客户表读取融资及还款明细），所以逐个 sheet 先计划后写入，
+    每个 sheet 写入后把新增行吸收进状态清单与行标识索引。
+    """
+    loan_rows = sources.loan_rows.get(target_date, [])
+    factoring_buckets = sources.factoring_buckets.get(target_date, {})
+    refactoring_buckets = sources.refactoring_buckets.get(target_date, {})
+    factoring_repay_rows = factoring_buckets.get(FEE_TYPE_PRINCIPAL, [])
+    refactoring_repay_rows = refactoring_buckets.get(FEE_TYPE_PRINCIPAL, [])
+    factoring_interest_rows = factoring_buckets.get(FEE_TYPE_INTEREST, [])
+    refactoring_interest_rows = refactoring_buckets.get(FEE_TYPE_INTEREST, [])
+    zhongdeng_rows = sources.zhongdeng_rows.get(target_date, [])
+
+    planners = (
+        (SHEET_FINANCING_REPAYMENT, lambda: plan_financing_repayment_sheet(
+            wb, loan_rows, factoring_repay_rows, refactoring_repay_rows, target_date, lookups, identities)),
+        (SHEET_ASSET_DETAIL, lambda: plan_asset_detail_sheet(wb, loan_rows, lookups, identities)),
+        (SHEET_ZHONGDENG, lambda: plan_zhongdeng_sheet(wb, zhongdeng_rows, identities)),
+        (SHEET_CUSTOMER, lambda: plan_customer_sheet(wb, sources.customer_source, target_date, manifest)),
+        (SHEET_INTEREST, lambda: plan_interest_sheet(wb, factoring_interest_rows, refactoring_interest_rows, identities)),
+    )
+    plans: List[SheetPlan] = []
+    for title, planner in planners:
+        with profile_phase(f"process:{title}", date=f"{target_date:%Y%m%d}"):
+            plan = planner()
+            commit_sheet_plan(wb, plan)
+            if manifest is not None:
+                manifest.absorb_new_rows(wb, title)
+            if identities is not None:
+                identities.absorb_plan(plan)
+        profile_rows(title, appended=plan.added)
+        plans.append(plan)
+    return plans
+
+
+def update_ledger(args: argparse.Namespace, memo: Optional["WorkerMemo"] = None) -> Dict[str, object]:
+    """ 执行一次台账更新，返回输出路径与新增行数；memo 非空时复用常驻 worker 的内存缓存 """
+    global ACTIVE_PROFILE
+    if not args.profile:
+        return run_ledger_update(args, memo)
+
+    profile = ACTIVE_PROFILE = RunProfile(max(args.profile_hotspots, 0), args.profile_memory)
+    profile.start()
+    try:
+        result = run_ledger_update(args, memo)
+    finally:
+        profile.stop()
+        ACTIVE_PROFILE = None
+    profile.write(Path(args.profile).resolve(), args, result)
+    result["profile"] = str(Path(args.profile).resolve())
+    return result
+
+
+def run_ledger_update(args: argparse.Namespace, memo: Optional["WorkerMemo"] = None) -> Dict[str, object]:
+    target_dates = resolve_target_dates(args)
+
+    paths = SourcePaths(
+        ledger=Path(args.ledger).resolve(),
+        loan=Path(args.loan).resolve(),
+        factoring_repay=Path(args.factoring_repay).resolve(),
+        refactoring_repay=Path(args.refactoring_repay).resolve(),
+        zhongdeng=Path(args.zhongdeng).resolve(),
+        customer=Path(args.customer).resolve(),
+    )
+    dry_run = args.dry_run is not None
+    # 预览只需要追加逻辑读取的少量单元格：总是用流式引擎扫描，不整本加载台账
+    engine = LEDGER_ENGINE_STREAM if dry_run else args.engine
+    if args.rewrite_lookups and engine == LEDGER_ENGINE_STREAM and not dry_run:
+        raise SystemExit("流式引擎只追加新行，不支持 --rewrite-lookups，请改用 --engine openpyxl")
+    lookups = LookupFormulas(args.lookup_mode)
+
+    # 并发加载台账工作簿并收集数据（统一查询条件）
+    # 保理/再保理还款明细各只读取一次，同时拆分出本金与资金费
+    workers = resolve_worker_count(args.workers)
+    cache = build_source_cache(args)
+    manifest = None
+    if not args.no_manifest:
+        with profile_phase("manifest_load"):
+            manifest = LedgerManifest.load_current(paths.ledger)
+    # 状态清单可用时已带有行标识索引，流式引擎不必保留每行的标识列
+    identities = manifest is None
+    with profile_phase("ingest", workers=workers):
+        if memo is None:
+            wb, sources = ingest_sources(paths, target_dates, workers, cache, engine, identities=identities)
+        else:
+            wb, sources = memo.ingest(paths, target_dates, workers, cache, engine, identities)
+
+    with profile_phase("compact"):
+        compact_ledger_sheets(wb)
+    if args.no_manifest:
+        with profile_phase("identity_index"):
+            identities = RowIdentityIndex.build(wb)
+    else:
+        if manifest is None:
+            with profile_phase("manifest_build"):
+                manifest = LedgerManifest.build(wb)
+        identities = manifest.identities
+
+    # 多日补录：在同一个内存工作簿上按日期升序逐日处理，效果等同于逐日运行
+    plans: Dict[dt.date, List[SheetPlan]] = {}
+    for target_date in target_dates:
+        if len(target_dates) > 1:
+            print(f"[ledger_daily] 处理日期 {target_date:%Y%m%d}")
+        plans[target_date] = process_target_date(wb, sources, target_date, manifest, lookups, identities)
+    total_added = sum(plan.added for day_plans in plans.values() for plan in day_plans)
+    if ACTIVE_PROFILE is not None:
+        ACTIVE_PROFILE.add_sources(sources)
+    if dry_run:
+        # 计划已写入内存中的流式工作簿（后续日期 / sheet 依赖前面的行），但不保存
+        wb.close()
+        return write_dry_run_plan(args, plans, total_added)
 
-    # 处理各个 sheet
-    total_added = 0
-    total_added += process_financing_repayment_sheet(wb, loan_rows, factoring_repay_rows, refactoring_repay_rows, target_date)
-    total_added += process_asset_detail_sheet(wb, loan_rows, target_date)
-    total_added += process_zhongdeng_sheet(wb, zhongdeng_rows)
-    total_added += process_customer_sheet(wb, customer_path, target_date)
-    total_added += process_interest_sheet(wb, factoring_interest_rows, refactoring_interest_rows)
+    output_path = Path(args.output).resolve()
+    with profile_phase("lookups"):
+        lookups.finalize(wb, rewrite=args.rewrite_lookups)
 
     # 保存输出
-    wb.save(output_path)
+    save_threads = resolve_save_threads(args.save_threads)
+    with profile_phase("save", threads=save_threads, level=args.compression_level):
+        save_ledger_workbook(wb, output_path, args.compression_level, save_threads)
+    if manifest is not None:
+        with profile_phase("manifest_save"):
+            manifest.save(output_path)
     print(f"[ledger_daily] 完成写入 -> {output_path}，总计新增 {total_added} 行")
+    return {"output": str(output_path), "added": total_added}
+
+
+DRY_RUN_STDOUT = "-"
+PLAN_VERSION = 1
+
+
+def write_dry_run_plan(args: argparse.Namespace, plans: Dict[dt.date, List[SheetPlan]], total_added: int) -> Dict[str, object]:
+    """ --dry-run：汇总各日期的计划；指定了文件时写出，结果中总是带上计划（worker 直接返回给调用方） """
+    document = {
+        "version": PLAN_VERSION,
+        "ledger": str(Path(args.ledger).resolve()),
+        "added": total_added,
+        "dates": [
+            {"date": f"{day:%Y%m%d}", "sheets": [sheet_plan_to_json(plan) for plan in day_plans]}
+            for day, day_plans in plans.items()
+        ],
+    }
+    result: Dict[str, object] = {"output": None, "added": total_added, "dryRun": True, "plan": document}
+    if args.dry_run != DRY_RUN_STDOUT:
+        plan_path = Path(args.dry_run).resolve()
+        with open(plan_path, "w", encoding="utf-8") as handle:
+            json.dump(document, handle, ensure_ascii=False, indent=2)
+        result["output"] = str(plan_path)
+    print(f"[ledger_daily] 预览完成（未保存台账），计划新增 {total_added} 行")
+    return result
+
+
+# =============================================================================
+# 常驻 worker 模式（--worker）
+# 由 Electron 主进程启动一次后反复复用：stdin 每行一个 JSON 请求，stdout 每行一个 JSON 响应。
+#   {"id": 1, "command": "run", "argv": ["--ledger", "...", "--date", "20251029", ...]}
+#   {"id": 1, "ok": true, "result": {"output": "...", "added": 12, "elapsed": 3.2, "ledgerCache": "hit", ...}}
+#   {"id": 2, "ok": false, "error": "..."}
+# command 还支持 ping / shutdown。进度日志统一写到 stderr，stdout 只输出协议行。
+# 台账与数据源按 (路径, mtime, 大小) 缓存 pickle 快照：每次请求拿到的都是未修改的副本。
+# =============================================================================
+
+WORKER_FLAG = "--worker"
+WORKER_CACHE_DEFAULT_MAX_MB = 512
+
+
+def parse_worker_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Long-lived ledger worker (JSON lines on stdin/stdout).")
+    parser.add_argument(WORKER_FLAG, action="store_true", help="以常驻 worker 模式运行")
+    parser.add_argument("--worker-cache-mb", type=int, default=WORKER_CACHE_DEFAULT_MAX_MB,
+                        help="内存缓存上限（MB），按最近使用淘汰；0 表示不缓存")
+    return parser.parse_args(argv)
+
+
+def file_fingerprint(path: Path) -> tuple:
+    stat = path.stat()
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def restore_workbook_snapshot(wb):
+    """ openpyxl 的 DimensionHolder 继承自 defaultdict，pickle 往返后 default_factory 丢失，需重新绑定 """
+    for ws in wb.worksheets:
+        if hasattr(ws, "row_dimensions"):
+            ws.row_dimensions.default_factory = ws._add_row
+            ws.column_dimensions.default_factory = ws._add_column
+    return wb
+
+
+class WorkerMemo:
+    """
+    常驻 worker 的内存缓存：值以 pickle 快照保存，取出时反序列化为新对象，
+    后续处理对工作簿的修改不会污染缓存；总大小按快照字节数做 LRU 限制。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.total = 0
+        self.last_status: Dict[str, str] = {}
+
+    def get(self, key: tuple):
+        payload = self.entries.get(key)
+        if payload is None:
+            return None
+        self.entries.move_to_end(key)
+        return pickle.loads(payload)
+
+    def put(self, key: tuple, value):
+        if self.max_bytes <= 0:
+            return
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            print(f"[worker] 快照 {len(payload) / 1024 / 1024:.1f} MB 超过缓存上限，不缓存：{key[0]}")
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.total -= len(previous)
+        self.entries[key] = payload
+        self.total += len(payload)
+        while self.total > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total -= len(evicted)
+
+    def ingest(self, paths: SourcePaths, dates: List[dt.date], workers: int, cache: Optional[SourceCache], engine: str,
+               identities: bool = False):
+        """
+        同 ingest_sources，但优先使用内存快照。
+        流式引擎的工作簿持有打开的 zip 且扫描结果依赖目标日期，不做缓存（其加载本身只扫描目标 sheet）。
+        """
+        ledger_key = ("ledger", file_fingerprint(paths.ledger)) if engine == LEDGER_ENGINE_OPENPYXL else None
+        sources_key = (
+            "sources",
+            tuple(file_fingerprint(path) for path in (paths.loan, paths.factoring_repay, paths.refactoring_repay,
+                                                      paths.zhongdeng, paths.customer)),
+            tuple(dates),
+        )
+        wb = self.get(ledger_key) if ledger_key else None
+        if wb is not None:
+            restore_workbook_snapshot(wb)
+        sources = self.get(sources_key)
+        self.last_status = {
+            "ledgerCache": "off" if ledger_key is None else ("hit" if wb is not None else "miss"),
+            "sourcesCache": "hit" if sources is not None else "miss",
+        }
+        if sources is None:
+            loaded, sources = ingest_sources(paths, dates, workers, cache, engine, wb is None, identities)
+            self.put(sources_key, sources)
+            if wb is None:
+                wb = loaded
+                if ledger_key:
+                    self.put(ledger_key, wb)
+        elif wb is None:
+            wb = load_ledger_workbook(paths.ledger, engine, dates, identities)
+            if ledger_key:
+                self.put(ledger_key, wb)
+        print(f"[worker] 台账缓存 {self.last_status['ledgerCache']}，数据源缓存 {self.last_status['sourcesCache']}，"
+              f"占用 {self.total / 1024 / 1024:.1f} MB")
+        return wb, sources
+
+
+def handle_worker_request(request: Dict[str, object], memo: WorkerMemo) -> Dict[str, object]:
+    command = request.get("command", "run")
+    if command == "ping":
+        return {"pid": os.getpid()}
+    if command != "run":
+        raise SystemExit(f"未知的 worker 命令：{command}")
+    argv = request.get("argv")
+    if not isinstance(argv, list):
+        raise SystemExit("worker 请求缺少 argv 参数列表")
+    started = time.perf_counter()
+    result = update_ledger(parse_args([str(item) for item in argv]), memo)
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    result.update(memo.last_status)
+    return result
+
+
+def claim_stdout():
+    """ 返回独占原 stdout 的输出流；fd 1 改指向 stderr，进度日志（包括进程池子进程的输出）不会混入 """
+    stream = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", buffering=1)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return stream
+
+
+def run_worker(options: argparse.Namespace):
+    protocol = claim_stdout()
+    memo = WorkerMemo(max(options.worker_cache_mb, 0) * 1024 * 1024)
+    print(f"[worker] 已启动，pid={os.getpid()}，缓存上限 {options.worker_cache_mb} MB")
+
+    for raw in sys.stdin.buffer:
+        line = raw.decode("utf-8").strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("command") == "shutdown":
+                protocol.write(json.dumps({"id": request_id, "ok": True, "result": {}}) + "\n")
+                break
+            response = {"id": request_id, "ok": True, "result": handle_worker_request(request, memo)}
+        except SystemExit as exc:
+            # 业务校验与 argparse 都以 SystemExit 结束，worker 只把它当作本次请求失败
+            message = exc.code if isinstance(exc.code, str) else f"参数错误（退出码 {exc.code}），详见日志"
+            response = {"id": request_id, "ok": False, "error": message}
+        except Exception as exc:
+            traceback.print_exc()
+            response = {"id": request_id, "ok": False, "error": f"{type(exc).__name__}: {exc}"}
+        sys.stdout.flush()
+        protocol.write(json.dumps(response, ensure_ascii=False) + "\n")
+    protocol.close()
+
+
+def main():
+    if WORKER_FLAG in sys.argv[1:]:
+        run_worker(parse_worker_args())
+        return
+    args = parse_args()
+    if args.dry_run != DRY_RUN_STDOUT:
+        update_ledger(args)
+        return
+    # 计划 JSON 独占 stdout，日志改走 stderr
+    plan_out = claim_stdout()
+    result = update_ledger(args)
+    json.dump(result["plan"], plan_out, ensure_ascii=False)
+    plan_out.write("\n")
+    plan_out.close()
 
 
 if __name__ == "__main__":
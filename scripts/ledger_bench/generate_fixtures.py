@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+台账基准测试用的合成数据生成器。
+
+生成一本台账（融资及还款明细 / 资产明细 / 中登登记表 / 客户表 / 利息缴纳，第 10 行为模板行）
+与五个数据源导出（放款明细、保理 / 再保理融资还款明细、中登登记表、客户表 sheet1），
+列布局与 resources/python/ledger_daily.py 读取的列一致；--rows 从 1 万到 100 万均可。
+
+数据源覆盖 --days 天，最后一天为目标日期；台账中已有目标日期之前的数据。
+同样的参数（含 --seed）总是生成相同内容。用法：
+
+    python scripts/ledger_bench/generate_fixtures.py --rows 10000 --out /tmp/ledger_bench/10000
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import random
+from pathlib import Path
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+FIXTURE_VERSION = 2
+FIXTURE_META = "fixture.json"
+TEMPLATE_ROW_INDEX = 10
+
+LOAN_WIDTH = 58  # A..BF
+REPAY_WIDTH = 34  # A..AH
+ZHONGDENG_WIDTH = 25  # A..Y
+CUSTOMER_WIDTH = 12  # A..L
+FINANCING_WIDTH = 44  # A..AR
+ASSET_WIDTH = 35
+ZHONGDENG_LEDGER_WIDTH = 25
+CUSTOMER_LEDGER_WIDTH = 20
+INTEREST_WIDTH = 25
+
+FEE_TYPES = ("本金", "本金", "资金费", "罚息")
+CHANNELS = ("平台推荐", "公司自拓")
+VISIBILITY = ("明保", "暗保", "其他")
+RECOURSE = ("有追", "无追")
+BUSINESS_MODES = ("直接投放", "间接")
+
+THIN = Side(style="thin", color="FF999999")
+TEMPLATE_FONT = Font(name="宋体", size=10)
+TEMPLATE_FILL = PatternFill("solid", start_color="FFDDEEFF")
+TEMPLATE_BORDER = Border(left=THIN, right=THIN, top=THIN, bottom=THIN)
+TEMPLATE_ALIGNMENT = Alignment(horizontal="center", vertical="center", wrap_text=True)
+DATE_FORMAT = "yyyy-mm-dd"
+AMOUNT_FORMAT = "#,##0.00"
+
+
+class FixtureSpec:
+    """ 各 sheet / 数据源的行数都由 rows 推出，保持与真实台账相近的比例 """
+
+    def __init__(self, rows: int, days: int, seed: int):
+        self.rows = rows
+        self.days = max(days, 2)
+        self.seed = seed
+        self.target_date = dt.datetime(2025, 10, 1) + dt.timedelta(days=self.days - 1)
+        self.dates = [self.target_date - dt.timedelta(days=offset) for offset in range(self.days - 1, -1, -1)]
+        self.customer_count = max(rows // 20, 60)
+        self.names = [f"合成客户{index:06d}有限公司" for index in range(self.customer_count)]
+        # 台账客户表已收录前 90% 的客户，其余只出现在数据源里
+        self.known_names = self.names[: self.customer_count * 9 // 10]
+
+    def meta(self) -> dict:
+        return {
+            "version": FIXTURE_VERSION,
+            "rows": self.rows,
+            "days": self.days,
+            "seed": self.seed,
+            "target_date": f"{self.target_date:%Y%m%d}",
+        }
+
+
+def styled_cell(ws, value, number_format: str = "General") -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    cell.font = TEMPLATE_FONT
+    cell.fill = TEMPLATE_FILL
+    cell.border = TEMPLATE_BORDER
+    cell.alignment = TEMPLATE_ALIGNMENT
+    cell.number_format = number_format
+    return cell
+
+
+def append_header(ws, width: int, prefix: str, blank_rows: int = 0):
+    ws.append([f"{prefix}{col}" for col in range(1, width + 1)])
+    for _ in range(blank_rows):
+        ws.append([])
+
+
+# =============================================================================
+# 台账
+# =============================================================================
+
+def financing_row(spec: FixtureSpec, rng: random.Random, row_idx: int, day: dt.datetime, is_loan: bool) -> list:
+    row = [None] * FINANCING_WIDTH
+    row[0] = f"=ROW()-{TEMPLATE_ROW_INDEX - 1}"
+    row[1] = f'=IF(C{row_idx}="","",1)'
+    row[3] = f"BIZ{row_idx:08d}"
+    row[4] = "应收账款"
+    row[5] = rng.choice(VISIBILITY)
+    row[7] = rng.choice(spec.names)
+    row[8] = rng.choice(spec.names)
+    row[12] = f"=SUM($U${TEMPLATE_ROW_INDEX}:U{row_idx})"
+    row[14] = f'=G{row_idx}&"-"&T{row_idx}'
+    row[32] = f"FIN{row_idx:08d}"
+    row[38] = f"=AH{row_idx}-AI{row_idx}"
+    row[40] = f"=VLOOKUP(AG{row_idx},$P:$W,8,0)"
+    row[42] = f"=XLOOKUP(AG{row_idx},$P:$P,$AD:$AD)"
+    if is_loan:
+        row[15] = f"FIN{row_idx:08d}"
+        row[20] = round(rng.uniform(1e4, 1e7), 2)
+        row[22] = day
+        row[24] = f"=V{row_idx}*Z{row_idx}/360"
+        row[25] = rng.choice((0.0525, 0.06, 0.065))
+    else:
+        row[30] = day
+        row[33] = round(rng.uniform(1e3, 1e6), 2)
+        row[43] = f"BANK{row_idx:08d}"
+    return row
+
+
+def write_financing_sheet(wb, spec: FixtureSpec, rng: random.Random):
+    ws = wb.create_sheet("融资及还款明细")
+    append_header(ws, FINANCING_WIDTH, "融资", blank_rows=TEMPLATE_ROW_INDEX - 2)
+    history = spec.dates[:-1]
+    row_idx = TEMPLATE_ROW_INDEX
+    for index in range(spec.rows):
+        day = history[index * len(history) // spec.rows]
+        values = financing_row(spec, rng, row_idx, day, is_loan=index % 3 == 0)
+        if row_idx == TEMPLATE_ROW_INDEX:
+            formats = {20: AMOUNT_FORMAT, 22: DATE_FORMAT, 25: "0.00%", 30: DATE_FORMAT, 33: AMOUNT_FORMAT}
+            values = [styled_cell(ws, value, formats.get(col, "General")) for col, value in enumerate(values)]
+        ws.append(values)
+        row_idx += 1
+
+
+def write_asset_sheet(wb, spec: FixtureSpec, rng: random.Random):
+    ws = wb.create_sheet("资产明细")
+    append_header(ws, ASSET_WIDTH, "资产", blank_rows=2)
+    row_idx = 4
+    for index in range(max(spec.rows // 2, TEMPLATE_ROW_INDEX)):
+        row = [None] * ASSET_WIDTH
+        row[0] = "=ROW()-3"
+        row[1] = f"=A{row_idx}*1"
+        row[2] = rng.choice(CHANNELS)
+        row[14] = f"=XLOOKUP(AG{row_idx},中登登记表!$J:$J,中登登记表!$U:$U)"
+        row[15] = spec.names[index % spec.customer_count]
+        row[17] = rng.choice(spec.names)
+        row[24] = spec.dates[0] - dt.timedelta(days=index % 365)
+        row[28] = f"=Z{row_idx}-AA{row_idx}"
+        row[32] = f"FIN{index:08d}"
+        if row_idx == TEMPLATE_ROW_INDEX:
+            row = [styled_cell(ws, value, DATE_FORMAT if col == 24 else "General") for col, value in enumerate(row)]
+        ws.append(row)
+        row_idx += 1
+
+
+def write_zhongdeng_ledger_sheet(wb, spec: FixtureSpec, rng: random.Random):
+    ws = wb.create_sheet("中登登记表")
+    append_header(ws, ZHONGDENG_LEDGER_WIDTH, "中登")
+    for row_idx in range(2, max(spec.rows // 2, TEMPLATE_ROW_INDEX) + 2):
+        row = [None] * ZHONGDENG_LEDGER_WIDTH
+        row[0] = "=ROW()-1"
+        row[2] = f"FIN{row_idx:08d}"
+        row[9] = f"REG{row_idx:08d}"
+        row[20] = rng.choice(("应收账款质押", "应收账款转让"))
+        if row_idx == TEMPLATE_ROW_INDEX:
+            row = [styled_cell(ws, value) for value in row]
+        ws.append(row)
+
+
+def write_customer_ledger_sheet(wb, spec: FixtureSpec):
+    ws = wb.create_sheet("客户表")
+    append_header(ws, CUSTOMER_LEDGER_WIDTH, "客户")
+    for index, name in enumerate(spec.known_names):
+        row_idx = index + 2
+        row = [None] * CUSTOMER_LEDGER_WIDTH
+        row[0] = "=ROW()-1"
+        row[1] = f"CUST{index:06d}"
+        row[4] = name
+        if row_idx == TEMPLATE_ROW_INDEX:
+            row = [styled_cell(ws, value) for value in row]
+        ws.append(row)
+
+
+def write_interest_sheet(wb, spec: FixtureSpec, rng: random.Random):
+    ws = wb.create_sheet("利息缴纳")
+    append_header(ws, INTEREST_WIDTH, "利息")
+    for row_idx in range(2, max(spec.rows // 10, TEMPLATE_ROW_INDEX) + 2):
+        row = [None] * INTEREST_WIDTH
+        row[0] = "=ROW()-1"
+        row[1] = f"=A{row_idx}"
+        row[3] = f"FIN{row_idx:08d}"
+        row[17] = rng.choice((0.05, 0.06))
+        row[23] = f"=U{row_idx}/2"
+        if row_idx == TEMPLATE_ROW_INDEX:
+            row = [styled_cell(ws, value) for value in row]
+        ws.append(row)
+
+
+def write_ledger(path: Path, spec: FixtureSpec, rng: random.Random):
+    wb = Workbook(write_only=True)
+    write_financing_sheet(wb, spec, rng)
+    write_asset_sheet(wb, spec, rng)
+    write_zhongdeng_ledger_sheet(wb, spec, rng)
+    write_customer_ledger_sheet(wb, spec)
+    write_interest_sheet(wb, spec, rng)
+    wb.save(path)
+
+
+# =============================================================================
+# 数据源导出
+# =============================================================================
+
+def write_loan_source(path: Path, spec: FixtureSpec, rng: random.Random):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    append_header(ws, LOAN_WIDTH, "放款")
+    for index in range(spec.rows):
+        day = spec.dates[index % spec.days]
+        row = [None] * LOAN_WIDTH
+        row[1] = rng.choice(CHANNELS)
+        row[2] = rng.choice(spec.names)
+        row[6] = rng.choice(spec.names)
+        row[9] = rng.choice((None, "J"))
+        row[10] = f"PRJ{index:08d}"
+        row[11] = f"FIN{index:08d}"
+        row[12] = f"CON{index:08d}"
+        row[13] = rng.choice(spec.names)
+        # 日期列混合 datetime 与文本，覆盖两种解析路径
+        row[15] = day if index % 3 else f"{day:%Y-%m-%d}"
+        row[16] = round(rng.uniform(1e4, 1e7), 2)
+        row[18] = f"ACC{index:08d}"
+        row[19] = day + dt.timedelta(days=90)
+        row[20] = rng.choice((90, 180, 360))
+        row[24] = rng.choice(BUSINESS_MODES)
+        row[26] = f"LN{index:08d}"
+        row[28] = rng.choice(("银行", "信托"))
+        row[30] = "应收账款业务"
+        row[31] = rng.choice(RECOURSE)
+        row[32] = rng.choice(VISIBILITY)
+        row[35] = round(rng.uniform(1e4, 1e7), 2)
+        row[36] = rng.choice(spec.names)
+        row[37] = day
+        row[39] = f"REG{index:08d}"
+        row[40] = day + dt.timedelta(days=90)
+        row[42] = round(rng.uniform(0.5, 1.0), 4)
+        row[48] = round(rng.uniform(1e3, 1e6), 2)
+        row[51] = rng.choice((None, "", "AZ"))
+        row[54] = rng.choice(("一次性", "分期"))
+        row[57] = rng.choice((0.0525, 0.06, "面议"))
+        ws.append(row)
+    wb.save(path)
+
+
+def write_repay_source(path: Path, spec: FixtureSpec, rng: random.Random, serial_offset: int):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    append_header(ws, REPAY_WIDTH, "还款")
+    excel_epoch = dt.datetime(1899, 12, 30)
+    for index in range(spec.rows):
+        day = spec.dates[index % spec.days]
+        row = [None] * REPAY_WIDTH
+        row[1] = rng.choice(spec.names)
+        row[2] = rng.choice(spec.names)
+        row[5] = rng.choice(("银行", "信托"))
+        row[6] = f"BIZ{index:08d}"
+        row[7] = "保理业务"
+        row[9] = rng.choice(VISIBILITY[:2])
+        row[12] = f"PRJ{index:08d}"
+        row[14] = f"FIN{rng.randrange(spec.rows):08d}"
+        row[23] = 365
+        row[24] = rng.choice((None, 360))
+        row[27] = rng.choice(FEE_TYPES)
+        row[28] = f"{day:%Y-%m-%d}~2025-12-31"
+        row[29] = round(rng.uniform(1e3, 1e5), 2)
+        # 日期列混合 datetime 与 Excel 序列号：按日期轮转，每个日期（含目标日期）每 4 笔中有 1 笔为序列号
+        row[30] = day if (index // spec.days) % 4 else float((day - excel_epoch).days)
+        row[32] = round(rng.uniform(1e2, 1e6), 2)
+        # 同一日期相邻的三笔共用一个流水号，覆盖 AI 列合并
+        row[33] = f"BANK{index // (3 * spec.days) + serial_offset:08d}-{index % spec.days:03d}" if index % 5 else None
+        ws.append(row)
+    wb.save(path)
+
+
+def write_zhongdeng_source(path: Path, spec: FixtureSpec, rng: random.Random):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("中登登记表")
+    append_header(ws, ZHONGDENG_WIDTH, "中登")
+    for index in range(spec.rows):
+        row = [f"z{col}_{index}" for col in range(1, ZHONGDENG_WIDTH + 1)]
+        row[2] = f"FIN{index % spec.rows:08d}"
+        row[5] = rng.choice(("初始登记", "初始登记", "变更登记"))
+        row[6] = 100000000 + index
+        row[8] = f"REG{index % (spec.rows + 37):08d}" if index % 11 else None
+        ws.append(row)
+    wb.save(path)
+
+
+def write_customer_source(path: Path, spec: FixtureSpec):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("sheet1")
+    append_header(ws, CUSTOMER_WIDTH, "客户")
+    for index, name in enumerate(spec.names):
+        ws.append([name] + [f"c{col}_{index}" for col in range(2, CUSTOMER_WIDTH + 1)])
+    wb.save(path)
+
+
+FIXTURE_FILES = {
+    "ledger": "ledger.xlsx",
+    "loan": "loan.xlsx",
+    "factoring_repay": "factoring_repay.xlsx",
+    "refactoring_repay": "refactoring_repay.xlsx",
+    "zhongdeng": "zhongdeng.xlsx",
+    "customer": "customer.xlsx",
+}
+
+
+def generate(out_dir: Path, rows: int, days: int = 30, seed: int = 20251001) -> dict:
+    """ 生成全部文件并写出 fixture.json，返回其内容（含各文件路径） """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    spec = FixtureSpec(rows, days, seed)
+    paths = {kind: out_dir / name for kind, name in FIXTURE_FILES.items()}
+    # 每个文件使用独立的随机序列，单独重新生成某个文件时结果不变
+    write_ledger(paths["ledger"], spec, random.Random(f"{seed}:ledger"))
+    write_loan_source(paths["loan"], spec, random.Random(f"{seed}:loan"))
+    write_repay_source(paths["factoring_repay"], spec, random.Random(f"{seed}:factoring"), 0)
+    write_repay_source(paths["refactoring_repay"], spec, random.Random(f"{seed}:refactoring"), rows)
+    write_zhongdeng_source(paths["zhongdeng"], spec, random.Random(f"{seed}:zhongdeng"))
+    write_customer_source(paths["customer"], spec)
+
+    meta = {**spec.meta(), "files": FIXTURE_FILES}
+    with open(out_dir / FIXTURE_META, "w", encoding="utf-8") as handle:
+        json.dump(meta, handle, ensure_ascii=False, indent=2)
+    return meta
+
+
+def load_or_generate(out_dir: Path, rows: int, days: int = 30, seed: int = 20251001) -> dict:
+    """ 目录中已有参数相同的数据时直接复用（100 万行的数据生成需要数分钟） """
+    try:
+        with open(out_dir / FIXTURE_META, "r", encoding="utf-8") as handle:
+            meta = json.load(handle)
+        expected = FixtureSpec(rows, days, seed).meta()
+        if all(meta.get(key) == value for key, value in expected.items()) and all(
+            (out_dir / name).exists() for name in FIXTURE_FILES.values()
+        ):
+            return meta
+    except (OSError, ValueError):
+        pass
+    print(f"[bench] 生成 {rows} 行合成数据 -> {out_dir}")
+    return generate(out_dir, rows, days, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic ledger + source exports for benchmarks.")
+    parser.add_argument("--rows", type=int, required=True, help="台账融资及还款明细与各数据源的行数（1 万 ~ 100 万）")
+    parser.add_argument("--days", type=int, default=30, help="数据源覆盖的天数，最后一天为目标日期")
+    parser.add_argument("--seed", type=int, default=20251001, help="随机种子")
+    parser.add_argument("--out", required=True, help="输出目录")
+    args = parser.parse_args()
+    meta = generate(Path(args.out), args.rows, args.days, args.seed)
+    print(f"[bench] 已生成 {args.rows} 行合成数据，目标日期 {meta['target_date']} -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
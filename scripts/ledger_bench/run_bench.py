@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+resources/python/ledger_daily.py 的基准测试。
+
+在合成数据（generate_fixtures.py）上逐个测量：
+- 各 collect_* 数据源读取函数与台账加载；
+- 各 process_*_sheet（每次从同一份台账快照开始，先补齐前面的 sheet 步骤再计时）与保存；
+- 端到端 main()（独立子进程，openpyxl 与 stream 两种引擎）；
+- 引擎一致性（engine_equivalence）：两种引擎 main() 的输出逐单元格比较取值与样式，以及合并单元格与条件格式，
+  并检查还款日期列（源数据中混有 Excel 序列号）都显示为日期。
+
+进程内的用例记录多次运行的最短墙钟时间与一次 tracemalloc 峰值；端到端用例记录最短墙钟时间与子进程峰值 RSS。
+结果与 baseline.json 中同一 --rows 的基线比较，超过阈值或引擎一致性检查发现问题即以退出码 1 结束。
+只依赖 openpyxl，可离线运行（Linux）。
+
+    python scripts/ledger_bench/run_bench.py --rows 10000
+    python scripts/ledger_bench/run_bench.py --rows 100000 --repeat 1 --cases collect_
+    python scripts/ledger_bench/run_bench.py --rows 10000 --update-baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import copy
+import datetime as dt
+import importlib.util
+import io
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from generate_fixtures import load_or_generate  # noqa: E402
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+LEDGER_SCRIPT = ROOT_DIR / "resources" / "python" / "ledger_daily.py"
+BASELINE_PATH = Path(__file__).resolve().with_name("baseline.json")
+BASELINE_VERSION = 1
+DEFAULT_THRESHOLD = 0.25
+# 小于这些绝对差值的变化视为噪声，不判为回退
+WALL_NOISE_S = 0.05
+MEMORY_NOISE_MB = 2.0
+BYTES_PER_MB = 1024 * 1024
+LEDGER_ENGINES = ("openpyxl", "stream")
+ENGINE_EQUIVALENCE_CASE = "engine_equivalence"
+# 差异较多时只打印前若干条
+MAX_REPORTED_DIFFERENCES = 20
+# 还款导出 AE 列（还款日期）混有 datetime 与 Excel 序列号（见 generate_fixtures.write_repay_source），
+# 写入台账的这些列不论源取值是哪种都必须显示为日期；两种引擎若同样写成数字，逐单元格比较发现不了
+REPAY_SOURCE_DATE_COLUMN = 31
+REPAY_DATE_COLUMNS = {"融资及还款明细": ("AE", "AJ"), "利息缴纳": ("K",)}
+
+
+def load_ledger_daily():
+    """ 按文件路径导入台账脚本（它不是包的一部分）；注册到 sys.modules 以便 pickle 其中的类 """
+    spec = importlib.util.spec_from_file_location("ledger_daily", LEDGER_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["ledger_daily"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class BenchCase:
+    """ prepare() 不计时，返回 run() 的输入；run(state) 计时 """
+
+    def __init__(self, name: str, run: Callable, prepare: Optional[Callable] = None):
+        self.name = name
+        self.run = run
+        self.prepare = prepare or (lambda: None)
+
+
+def quiet():
+    """ 台账脚本逐步打印日志，测量时丢弃 """
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def measure_in_process(case: BenchCase, repeat: int) -> Dict[str, float]:
+    walls: List[float] = []
+    for _ in range(repeat):
+        with quiet():
+            state = case.prepare()
+            started = time.perf_counter()
+            case.run(state)
+            walls.append(time.perf_counter() - started)
+
+    # 内存单独跑一次：tracemalloc 会明显拖慢执行，不与计时混在一起
+    with quiet():
+        state = case.prepare()
+        tracemalloc.start()
+        try:
+            case.run(state)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {"wall_s": round(min(walls), 4), "py_peak_mb": round(peak / BYTES_PER_MB, 2)}
+
+
+def measure_main(argv: List[str], repeat: int, log_dir: Path) -> Dict[str, float]:
+    """ 以子进程运行台账脚本，os.wait4 取得该子进程自己的峰值 RSS """
+    walls: List[float] = []
+    peak_rss = 0
+    for attempt in range(repeat):
+        log_path = log_dir / f"main-{attempt}.log"
+        with open(log_path, "wb") as log:
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, str(LEDGER_SCRIPT), *argv], stdout=log, stderr=subprocess.STDOUT,
+                                       env={**os.environ, "PYTHONIOENCODING": "utf-8"})
+            _, status, usage = os.wait4(process.pid, 0)
+            walls.append(time.perf_counter() - started)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise SystemExit(f"ledger_daily.py 运行失败（退出码 {process.returncode}）：\n"
+                             + log_path.read_text(encoding="utf-8", errors="replace")[-4000:])
+        # Linux 的 ru_maxrss 以 KB 计
+        peak_rss = max(peak_rss, usage.ru_maxrss * 1024)
+    return {"wall_s": round(min(walls), 4), "rss_peak_mb": round(peak_rss / BYTES_PER_MB, 2)}
+
+
+def build_cases(ld, fixture: Dict[str, object], fixture_dir: Path) -> List[BenchCase]:
+    files = {kind: fixture_dir / name for kind, name in fixture["files"].items()}
+    target_date = dt.datetime.strptime(fixture["target_date"], "%Y%m%d").date()
+    dates = [target_date]
+
+    with quiet():
+        loan_rows = ld.collect_loan_rows_by_date(files["loan"], dates)
+        codes_by_date = ld.finance_codes_by_date(loan_rows)
+        factoring = ld.collect_repay_buckets_by_date(files["factoring_repay"], dates)[target_date]
+        refactoring = ld.collect_repay_buckets_by_date(files["refactoring_repay"], dates)[target_date]
+        zhongdeng_rows = ld.collect_zhongdeng_rows_by_date(files["zhongdeng"], codes_by_date)[target_date]
+        snapshot = pickle.dumps(ld.load_ledger_workbook(files["ledger"]), protocol=pickle.HIGHEST_PROTOCOL)
+    loans = loan_rows[target_date]
+    # 客户表计划查询的是融资及还款明细 H/I 列的新客户，这里取放款明细对应的 C/G 列近似
+    loan_names = {name for loan in loans for name in (ld.normalize_string(loan.C), ld.normalize_string(loan.G)) if name}
+    principal, interest = ld.FEE_TYPE_PRINCIPAL, ld.FEE_TYPE_INTEREST
+
+    sheet_steps = [
+        ("process_financing_repayment_sheet", lambda wb: ld.process_financing_repayment_sheet(
+            wb, loans, factoring.get(principal, []), refactoring.get(principal, []), target_date)),
+        ("process_asset_detail_sheet", lambda wb: ld.process_asset_detail_sheet(wb, loans, target_date)),
+        ("process_zhongdeng_sheet", lambda wb: ld.process_zhongdeng_sheet(wb, zhongdeng_rows)),
+        ("process_customer_sheet", lambda wb: ld.process_customer_sheet(
+            wb, ld.CustomerSourceLookup(files["customer"]), target_date)),
+        ("process_interest_sheet", lambda wb: ld.process_interest_sheet(
+            wb, factoring.get(interest, []), refactoring.get(interest, []))),
+    ]
+
+    def workbook_before(step_index: int):
+        """ 台账快照 + 前面各 sheet 步骤的结果，与 process_target_date 中该步骤看到的状态一致 """
+        def prepare():
+            wb = ld.restore_workbook_snapshot(pickle.loads(snapshot))
+            ld.compact_ledger_sheets(wb)
+            for _, step in sheet_steps[:step_index]:
+                step(wb)
+            return wb
+        return prepare
+
+    cases = [
+        BenchCase("collect_loan_rows_by_date", lambda _: ld.collect_loan_rows_by_date(files["loan"], dates)),
+        BenchCase("collect_repay_buckets_by_date[factoring]",
+                  lambda _: ld.collect_repay_buckets_by_date(files["factoring_repay"], dates)),
+        BenchCase("collect_repay_buckets_by_date[refactoring]",
+                  lambda _: ld.collect_repay_buckets_by_date(files["refactoring_repay"], dates)),
+        BenchCase("collect_zhongdeng_rows_by_date",
+                  lambda _: ld.collect_zhongdeng_rows_by_date(files["zhongdeng"], codes_by_date)),
+        BenchCase("lookup_customer_sources", lambda _: ld.lookup_customer_sources(files["customer"], loan_names)),
+        BenchCase("load_ledger_workbook[openpyxl]", lambda _: ld.load_ledger_workbook(files["ledger"])),
+        BenchCase("load_ledger_workbook[stream]",
+                  lambda _: ld.load_ledger_workbook(files["ledger"], ld.LEDGER_ENGINE_STREAM, dates)),
+    ]
+    for index, (name, step) in enumerate(sheet_steps):
+        cases.append(BenchCase(name, step, workbook_before(index)))
+    output = Path(tempfile.gettempdir()) / "ledger_bench_save.xlsx"
+    for level in (1, ld.SAVE_ZIP_LEVEL):
+        cases.append(BenchCase(f"save_ledger_workbook[level={level}]",
+                               lambda wb, level=level: ld.save_ledger_workbook(wb, output, level, 1),
+                               workbook_before(len(sheet_steps))))
+    return cases
+
+
+def main_argv(fixture: Dict[str, object], fixture_dir: Path, work_dir: Path, engine: str) -> List[str]:
+    files = {kind: str(fixture_dir / name) for kind, name in fixture["files"].items()}
+    return [
+        "--ledger", files["ledger"],
+        "--loan", files["loan"],
+        "--factoring-repay", files["factoring_repay"],
+        "--refactoring-repay", files["refactoring_repay"],
+        "--zhongdeng", files["zhongdeng"],
+        "--customer", files["customer"],
+        "--date", str(fixture["target_date"]),
+        "--output", str(work_dir / f"ledger_out_{engine}.xlsx"),
+        "--engine", engine,
+        "--no-cache", "--no-manifest", "--workers", "1",
+    ]
+
+
+def style_signature(cell, cache: Dict[int, tuple]) -> tuple:
+    """ 单元格完整样式的可比较形式（两个工作簿的样式表索引不同，按内容比较）；按 style_id 缓存 """
+    style_id = cell.style_id
+    signature = cache.get(style_id)
+    if signature is None:
+        signature = cache[style_id] = (
+            cell.number_format,
+            copy.copy(cell.font),
+            copy.copy(cell.fill),
+            copy.copy(cell.border),
+            copy.copy(cell.alignment),
+            copy.copy(cell.protection),
+        )
+    return signature
+
+
+def conditional_formats(ws) -> List[tuple]:
+    rules = []
+    for cf in ws.conditional_formatting:
+        for rule in cf.rules:
+            rules.append((str(cf.sqref), rule.type, rule.operator, tuple(rule.formula or ()), rule.stopIfTrue,
+                          rule.priority, rule.dxf))
+    return sorted(rules, key=repr)
+
+
+def workbook_differences(expected, actual) -> List[str]:
+    """ 逐 sheet 比较取值、样式、合并单元格与条件格式，返回差异说明（为空表示一致） """
+    if expected.sheetnames != actual.sheetnames:
+        return [f"sheet 列表不同：{expected.sheetnames} != {actual.sheetnames}"]
+    differences: List[str] = []
+    expected_styles: Dict[int, tuple] = {}
+    actual_styles: Dict[int, tuple] = {}
+    for title in expected.sheetnames:
+        ws_expected, ws_actual = expected[title], actual[title]
+        max_row = max(ws_expected.max_row, ws_actual.max_row)
+        max_column = max(ws_expected.max_column, ws_actual.max_column)
+        rows = zip(ws_expected.iter_rows(min_row=1, max_row=max_row, max_col=max_column),
+                   ws_actual.iter_rows(min_row=1, max_row=max_row, max_col=max_column))
+        for expected_row, actual_row in rows:
+            for expected_cell, actual_cell in zip(expected_row, actual_row):
+                if expected_cell.value != actual_cell.value:
+                    differences.append(f"{title}!{expected_cell.coordinate} 取值：{expected_cell.value!r} != {actual_cell.value!r}")
+                elif style_signature(expected_cell, expected_styles) != style_signature(actual_cell, actual_styles):
+                    differences.append(f"{title}!{expected_cell.coordinate} 样式不同")
+        expected_merges = sorted(str(ref) for ref in ws_expected.merged_cells.ranges)
+        actual_merges = sorted(str(ref) for ref in ws_actual.merged_cells.ranges)
+        if expected_merges != actual_merges:
+            missing = sorted(set(expected_merges) - set(actual_merges))
+            extra = sorted(set(actual_merges) - set(expected_merges))
+            differences.append(f"{title} 合并单元格：缺少 {missing[:5]}，多出 {extra[:5]}")
+        if conditional_formats(ws_expected) != conditional_formats(ws_actual):
+            differences.append(f"{title} 条件格式：{conditional_formats(ws_expected)} != {conditional_formats(ws_actual)}")
+    return differences
+
+
+def serial_dated_repay_rows(fixture: Dict[str, object], fixture_dir: Path) -> int:
+    """ 数据源中目标日期以序列号记录还款日期的行数（为 0 时日期列检查没有覆盖到序列号） """
+    from openpyxl import load_workbook
+    from openpyxl.utils.datetime import to_excel
+
+    target_date = dt.datetime.strptime(str(fixture["target_date"]), "%Y%m%d")
+    serial = to_excel(target_date)
+    count = 0
+    for kind in ("factoring_repay", "refactoring_repay"):
+        wb = load_workbook(fixture_dir / fixture["files"][kind], read_only=True)
+        try:
+            for (value,) in wb.worksheets[0].iter_rows(min_col=REPAY_SOURCE_DATE_COLUMN, max_col=REPAY_SOURCE_DATE_COLUMN,
+                                                      values_only=True):
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and value == serial:
+                    count += 1
+        finally:
+            wb.close()
+    return count
+
+
+def undated_cells(engine: str, wb) -> List[str]:
+    """ 还款日期列中显示为数字的单元格（序列号写入了非日期格式） """
+    problems = []
+    for title, columns in REPAY_DATE_COLUMNS.items():
+        ws = wb[title]
+        for letter in columns:
+            for cell in ws[letter]:
+                if isinstance(cell.value, (int, float)) and not isinstance(cell.value, bool):
+                    problems.append(f"{engine}: {title}!{cell.coordinate} 还款日期显示为数字：{cell.value!r}")
+    return problems
+
+
+def check_engine_equivalence(outputs: Dict[str, Path], fixture: Dict[str, object], fixture_dir: Path) -> List[str]:
+    """ 以 openpyxl 引擎的输出为准比较 stream 引擎的输出，并检查两者的还款日期列都显示为日期 """
+    from openpyxl import load_workbook
+
+    workbooks = {engine: load_workbook(path) for engine, path in outputs.items()}
+    differences = workbook_differences(workbooks["openpyxl"], workbooks["stream"])
+    if not serial_dated_repay_rows(fixture, fixture_dir):
+        differences.append(f"合成数据中 {fixture['target_date']} 没有以序列号记录还款日期的行，日期列检查没有覆盖序列号")
+    for engine, wb in workbooks.items():
+        differences.extend(undated_cells(engine, wb))
+    if differences:
+        shown = differences[:MAX_REPORTED_DIFFERENCES]
+        more = len(differences) - len(shown)
+        print(f"[bench] {ENGINE_EQUIVALENCE_CASE}: 发现 {len(differences)} 处问题：\n  " + "\n  ".join(shown)
+              + (f"\n  ……另有 {more} 处" if more else ""))
+    else:
+        print(f"[bench] {ENGINE_EQUIVALENCE_CASE}: 两种引擎的输出一致，还款日期列均显示为日期")
+    return differences
+
+
+def run_benchmarks(args: argparse.Namespace) -> Tuple[Dict[str, Dict[str, float]], List[str]]:
+    """ 返回 (各用例指标, 引擎一致性差异) """
+    fixture_dir = Path(args.fixtures_dir) / str(args.rows)
+    fixture = load_or_generate(fixture_dir, args.rows)
+    results: Dict[str, Dict[str, float]] = {}
+    differences: List[str] = []
+    with tempfile.TemporaryDirectory(prefix="ledger_bench_") as tmp:
+        work_dir = Path(tmp)
+        # 端到端用例最先运行：Linux 上子进程的 ru_maxrss 至少是 fork 时父进程的 RSS，
+        # 父进程加载台账快照之后再启动子进程，峰值 RSS 会被父进程抬高
+        outputs: Dict[str, Path] = {}
+        for engine in LEDGER_ENGINES:
+            name = f"main[{engine}]"
+            argv = main_argv(fixture, fixture_dir, work_dir, engine)
+            if selected(args, name):
+                results[name] = measure_main(argv, args.repeat, work_dir)
+                print(f"[bench] {name}: {results[name]}")
+            elif selected(args, ENGINE_EQUIVALENCE_CASE):
+                # 只做一致性检查时各引擎运行一次，不计入指标
+                measure_main(argv, 1, work_dir)
+            outputs[engine] = Path(argv[argv.index("--output") + 1])
+        if selected(args, ENGINE_EQUIVALENCE_CASE):
+            differences = check_engine_equivalence(outputs, fixture, fixture_dir)
+
+        ld = load_ledger_daily()
+        for case in build_cases(ld, fixture, fixture_dir):
+            if selected(args, case.name):
+                results[case.name] = measure_in_process(case, args.repeat)
+                print(f"[bench] {case.name}: {results[case.name]}")
+    return results, differences
+
+
+def selected(args: argparse.Namespace, name: str) -> bool:
+    return not args.cases or any(token in name for token in args.cases)
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": str(os.cpu_count()),
+    }
+
+
+def load_baseline() -> Dict[str, object]:
+    try:
+        with open(BASELINE_PATH, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+    except FileNotFoundError:
+        return {"version": BASELINE_VERSION, "threshold": DEFAULT_THRESHOLD, "results": {}}
+    if baseline.get("version") != BASELINE_VERSION:
+        raise SystemExit(f"基线文件版本不匹配：{BASELINE_PATH}")
+    return baseline
+
+
+def compare(results: Dict[str, Dict[str, float]], expected: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """ 返回超过阈值的回退说明；基线中没有的用例或指标不参与比较 """
+    regressions: List[str] = []
+    for name, metrics in results.items():
+        base_metrics = expected.get(name)
+        if not base_metrics:
+            continue
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if base is None:
+                continue
+            noise = WALL_NOISE_S if metric == "wall_s" else MEMORY_NOISE_MB
+            limit = base * (1 + threshold)
+            status = "ok"
+            if value > limit and value - base > noise:
+                status = "REGRESSION"
+                regressions.append(f"{name} {metric}: {value} > {base} × {1 + threshold:.2f}")
+            print(f"  {name:<46} {metric:<12} {base:>10} -> {value:>10}  {status}")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark ledger_daily.py on synthetic data.")
+    parser.add_argument("--rows", type=int, default=10000, help="合成数据行数（1 万 ~ 100 万）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例的计时次数，取最短")
+    parser.add_argument("--cases", action="append", default=[], help="只运行名称包含该片段的用例，可重复指定")
+    parser.add_argument("--fixtures-dir", default=str(Path(tempfile.gettempdir()) / "ledger_bench"),
+                        help="合成数据目录（按行数分子目录缓存，参数不变时复用）")
+    parser.add_argument("--threshold", type=float, default=None, help="允许的相对回退比例（默认取基线文件中的值）")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖该行数的基线")
+    parser.add_argument("--json-out", default=None, help="把本次结果另存为 JSON")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if not sys.platform.startswith("linux"):
+        raise SystemExit("基准测试依赖 os.wait4 与 Linux 的 ru_maxrss 单位，请在 Linux 上运行")
+    results, differences = run_benchmarks(args)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as handle:
+            json.dump({"rows": args.rows, "environment": environment(), "cases": results}, handle, ensure_ascii=False, indent=2)
+    if differences:
+        # 输出不一致时计时没有意义，也不能写入基线
+        sys.exit(1)
+
+    baseline = load_baseline()
+    key = str(args.rows)
+    if args.update_baseline:
+        entry = baseline["results"].setdefault(key, {"environment": environment(), "cases": {}})
+        entry["environment"] = environment()
+        entry["cases"].update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as handle:
+            json.dump(baseline, handle, ensure_ascii=False, indent=2)
+            handle.write("\n")
+        print(f"[bench] 已更新 {BASELINE_PATH.name} 中 {key} 行的基线")
+        return
+
+    entry = baseline["results"].get(key)
+    if entry is None:
+        print(f"[bench] {BASELINE_PATH.name} 中没有 {key} 行的基线，跳过比较（可用 --update-baseline 生成）")
+        return
+    threshold = args.threshold if args.threshold is not None else baseline.get("threshold", DEFAULT_THRESHOLD)
+    print(f"[bench] 与基线比较（阈值 +{threshold:.0%}，基线环境 {entry['environment'].get('platform')}）")
+    regressions = compare(results, entry["cases"], threshold)
+    if regressions:
+        print("[bench] 性能回退：\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("[bench] 未发现超过阈值的回退")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 import path from 'node:path'
 import fs from 'node:fs'
+import os from 'node:os'
 import { execa } from 'execa'
 import type { Workbook } from 'exceljs'
 import type { FormCreateRule, ParseOptions, TemplateDefinition } from './types'
+import { createLogger } from '../logger'
+import {
+  LedgerDailyWorkerCrashedError,
+  ledgerDailyWorker,
+  type LedgerDailyPlan,
+  type LedgerDailyWorkerResult
+} from './ledgerDailyWorker'
+
+const log = createLogger('ledgerDaily')
 
 interface LedgerDailyParsedData {
   ledgerPath: string
@@ -18,6 +28,9 @@ interface LedgerDailyUserInput {
   date: string
 }
 
+/** 五个数据源可用的格式（ledger_daily.py 按扩展名选择读取器） */
+const SOURCE_EXTS = ['xlsx', 'csv', 'parquet']
+
 const EXTRA_SOURCE_IDS = {
   loan: 'loanDetail',
   factoringRepay: 'factoringRepay',
@@ -53,6 +66,91 @@ function resolvePythonExecutable(): string {
   return process.env.PYTHON_PATH || 'python'
 }
 
+/**
+ * LEDGER_DAILY_PROFILE=1 时让 Python 输出运行剖析 JSON（各阶段耗时/RSS、各 sheet 行数），
+ * LEDGER_DAILY_PROFILE_HOTSPOTS=N 额外附带 cProfile 耗时最多的 N 个函数，
+ * LEDGER_DAILY_PROFILE_MEMORY=1 额外用 tracemalloc 记录各阶段 Python 内存峰值（耗时会偏大）
+ */
+function resolveProfileArgs(): { profilePath: string; args: string[] } | undefined {
+  if (process.env.LEDGER_DAILY_PROFILE !== '1') {
+    return undefined
+  }
+  const profilePath = path.join(os.tmpdir(), `ledger-daily-profile-${process.pid}-${Date.now()}.json`)
+  const args = ['--profile', profilePath]
+  const hotspots = Number.parseInt(process.env.LEDGER_DAILY_PROFILE_HOTSPOTS ?? '', 10)
+  if (hotspots > 0) {
+    args.push('--profile-hotspots', String(hotspots))
+  }
+  if (process.env.LEDGER_DAILY_PROFILE_MEMORY === '1') {
+    args.push('--profile-memory')
+  }
+  return { profilePath, args }
+}
+
+/** 读取剖析 JSON 写入应用日志后删除（.prof 文件保留，供离线分析） */
+async function forwardProfile(profilePath: string): Promise<void> {
+  try {
+    const profile = JSON.parse(await fs.promises.readFile(profilePath, 'utf-8')) as Record<string, unknown>
+    log.info('台账运行剖析', profile)
+    await fs.promises.rm(profilePath, { force: true })
+  } catch (error) {
+    log.warn('读取台账运行剖析失败', { profilePath, error: (error as Error).message })
+  }
+}
+
+/** 优先交给常驻 worker 运行；worker 不可用或被禁用时返回 undefined，由调用方单独启动进程 */
+async function runWithWorker(
+  pythonExecutable: string,
+  scriptPath: string,
+  argv: string[]
+): Promise<LedgerDailyWorkerResult | undefined> {
+  // 默认交给常驻 worker（同一会话内复用已加载的台账与数据源）；LEDGER_DAILY_WORKER=0 时每次单独启动进程
+  if (process.env.LEDGER_DAILY_WORKER === '0') {
+    return undefined
+  }
+  try {
+    return await ledgerDailyWorker.run(pythonExecutable, scriptPath, argv)
+  } catch (error) {
+    if (!(error instanceof LedgerDailyWorkerCrashedError)) {
+      throw error
+    }
+    log.warn('台账 worker 不可用，改为单次运行', { error: error.message })
+    return undefined
+  }
+}
+
+async function runLedgerDailyScript(pythonExecutable: string, scriptPath: string, argv: string[]): Promise<void> {
+  if (await runWithWorker(pythonExecutable, scriptPath, argv)) {
+    return
+  }
+
+  await execa(pythonExecutable, [scriptPath, ...argv], {
+    stdio: 'inherit',
+    env: {
+      ...process.env,
+      PYTHONIOENCODING: 'utf-8'
+    }
+  })
+}
+
+/** --dry-run：只生成追加计划，不保存台账；单次运行时计划 JSON 从 stdout 读取 */
+async function runLedgerDailyPlan(pythonExecutable: string, scriptPath: string, argv: string[]): Promise<LedgerDailyPlan> {
+  const dryRunArgv = [...argv, '--dry-run']
+  const result = await runWithWorker(pythonExecutable, scriptPath, dryRunArgv)
+  if (result?.plan) {
+    return result.plan
+  }
+
+  const { stdout } = await execa(pythonExecutable, [scriptPath, ...dryRunArgv], {
+    stderr: 'inherit',
+    env: {
+      ...process.env,
+      PYTHONIOENCODING: 'utf-8'
+    }
+  })
+  return JSON.parse(stdout) as LedgerDailyPlan
+}
+
 function normalizeInputDate(value: string): string {
   if (!/^\d{8}$/.test(value)) {
     throw new Error('日期格式需为 YYYYMMDD')
@@ -114,11 +212,8 @@ async function ledgerDailyStreamParser(
   })
 }
 
-async function renderLedgerDailyWithPython(
-  parsedData: unknown,
-  userInput: LedgerDailyUserInput | undefined,
-  outputPath: string
-): Promise<void> {
+/** 解析脚本、解释器与数据源参数（不含 --output） */
+function prepareLedgerDailyRun(parsedData: unknown, userInput: LedgerDailyUserInput | undefined) {
   if (!userInput) {
     throw new Error('缺少用户输入日期')
   }
@@ -131,35 +226,53 @@ async function renderLedgerDailyWithPython(
   }
 
   const pythonExecutable = resolvePythonExecutable()
-  await execa(
-    pythonExecutable,
-    [
-      scriptPath,
-      '--ledger',
-      path.resolve(data.ledgerPath),
-      '--loan',
-      path.resolve(data.loanPath),
-      '--factoring-repay',
-      path.resolve(data.factoringRepayPath),
-      '--refactoring-repay',
-      path.resolve(data.refactoringRepayPath),
-      '--zhongdeng',
-      path.resolve(data.zhongdengPath),
-      '--customer',
-      path.resolve(data.customerPath),
-      '--date',
-      targetDate,
-      '--output',
-      outputPath
-    ],
-    {
-      stdio: 'inherit',
-      env: {
-        ...process.env,
-        PYTHONIOENCODING: 'utf-8'
-      }
-    }
-  )
+  const argv = [
+    '--ledger',
+    path.resolve(data.ledgerPath),
+    '--loan',
+    path.resolve(data.loanPath),
+    '--factoring-repay',
+    path.resolve(data.factoringRepayPath),
+    '--refactoring-repay',
+    path.resolve(data.refactoringRepayPath),
+    '--zhongdeng',
+    path.resolve(data.zhongdengPath),
+    '--customer',
+    path.resolve(data.customerPath),
+    '--date',
+    targetDate
+  ]
+  return { pythonExecutable, scriptPath, argv }
+}
+
+async function renderLedgerDailyWithPython(
+  parsedData: unknown,
+  userInput: LedgerDailyUserInput | undefined,
+  outputPath: string
+): Promise<void> {
+  const { pythonExecutable, scriptPath, argv } = prepareLedgerDailyRun(parsedData, userInput)
+  argv.push('--output', outputPath)
+
+  const profile = resolveProfileArgs()
+  if (profile) {
+    argv.push(...profile.args)
+  }
+  await runLedgerDailyScript(pythonExecutable, scriptPath, argv)
+  if (profile) {
+    await forwardProfile(profile.profilePath)
+  }
+}
+
+/**
+ * 预览本次将追加的行（各 sheet 的取值 / 公式、AI 列合并与缺失客户等警告）：
+ * Python 只用流式扫描读取台账，不保存，通常几秒内返回
+ */
+export async function previewLedgerDaily(
+  parsedData: unknown,
+  userInput: LedgerDailyUserInput | undefined
+): Promise<LedgerDailyPlan> {
+  const { pythonExecutable, scriptPath, argv } = prepareLedgerDailyRun(parsedData, userInput)
+  return runLedgerDailyPlan(pythonExecutable, scriptPath, argv)
 }
 
 const inputRules: FormCreateRule[] = [
@@ -197,27 +310,27 @@ export const ledgerDailyTemplate: TemplateDefinition<LedgerDailyUserInput> = {
       {
         id: EXTRA_SOURCE_IDS.loan,
         label: '放款明细',
-        supportedExts: ['xlsx']
+        supportedExts: SOURCE_EXTS
       },
       {
         id: EXTRA_SOURCE_IDS.factoringRepay,
         label: '保理融资还款明细',
-        supportedExts: ['xlsx']
+        supportedExts: SOURCE_EXTS
       },
       {
         id: EXTRA_SOURCE_IDS.refactoringRepay,
         label: '再保理融资还款明细',
-        supportedExts: ['xlsx']
+        supportedExts: SOURCE_EXTS
       },
       {
         id: EXTRA_SOURCE_IDS.zhongdeng,
         label: '中登登记表',
-        supportedExts: ['xlsx']
+        supportedExts: SOURCE_EXTS
       },
       {
         id: EXTRA_SOURCE_IDS.customer,
         label: '客户表',
-        supportedExts: ['xlsx']
+        supportedExts: SOURCE_EXTS
       }
     ]
   },
@@ -239,7 +352,7 @@ export const ledgerDailyTemplate: TemplateDefinition<LedgerDailyUserInput> = {
 
 ### 数据源
 - 主文件：现有台账（xlsx）
-- 额外：放款明细、保理融资还款明细、再保理融资还款明细、中登登记表、客户表（均 xlsx）
+- 额外：放款明细、保理融资还款明细、再保理融资还款明细、中登登记表、客户表（xlsx / csv / parquet，CSV 支持 UTF-8 与 GBK 编码）
     `.trim()
   },
   parser: ledgerDailyParser,
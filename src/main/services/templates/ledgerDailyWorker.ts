@@ -0,0 +1,185 @@
+import readline from 'node:readline'
+import { execa } from 'execa'
+import { createLogger } from '../logger'
+
+const log = createLogger('ledgerDailyWorker')
+
+/** 空闲超过该时长后关闭常驻进程，释放缓存的台账与数据源 */
+const WORKER_IDLE_TIMEOUT_MS = 10 * 60 * 1000
+
+/** --dry-run 输出的追加计划（ledger_daily.py 的 write_dry_run_plan） */
+export interface LedgerDailyPlan {
+  version: number
+  ledger: string
+  added: number
+  dates: Array<{
+    /** YYYYMMDD */
+    date: string
+    sheets: Array<{
+      sheet: string
+      added: number
+      /** 不追加的原因 */
+      skipped: string | null
+      /** cells 以列字母为键，空值省略；日期为 ISO 字符串，公式以 = 开头 */
+      rows: Array<{ row: number; kind: string; cells: Record<string, string | number | boolean> }>
+      merges: Array<{ range: string; total: number }>
+      warnings: string[]
+    }>
+  }>
+}
+
+export interface LedgerDailyWorkerResult {
+  /** 输出台账路径；--dry-run 未指定计划文件时为 null */
+  output: string | null
+  added: number
+  elapsed: number
+  ledgerCache: 'hit' | 'miss' | 'off'
+  sourcesCache: 'hit' | 'miss'
+  /** 传入 --profile 时的剖析 JSON 路径 */
+  profile?: string
+  dryRun?: boolean
+  plan?: LedgerDailyPlan
+}
+
+interface WorkerResponse {
+  id: number | null
+  ok: boolean
+  result?: LedgerDailyWorkerResult
+  error?: string
+}
+
+interface PendingRequest {
+  resolve: (result: LedgerDailyWorkerResult) => void
+  reject: (error: Error) => void
+}
+
+/** worker 进程异常退出（而非业务报错），调用方可回退到一次性进程 */
+export class LedgerDailyWorkerCrashedError extends Error {}
+
+function spawnWorkerProcess(pythonExecutable: string, scriptPath: string) {
+  return execa(pythonExecutable, [scriptPath, '--worker'], {
+    stdin: 'pipe',
+    stdout: 'pipe',
+    stderr: 'pipe',
+    buffer: false,
+    env: {
+      ...process.env,
+      PYTHONIOENCODING: 'utf-8'
+    }
+  })
+}
+
+type WorkerProcess = ReturnType<typeof spawnWorkerProcess>
+
+/**
+ * ledger_daily.py 的常驻 worker（--worker 模式）：
+ * - 同一会话内复用同一个 Python 进程，省去解释器启动、openpyxl 导入与重复解析；
+ * - 请求串行发送，stdout 每行一个 JSON 响应，stderr 为进度日志；
+ * - 解释器或脚本路径变化、进程退出、空闲超时后自动重建。
+ */
+class LedgerDailyWorker {
+  private subprocess?: WorkerProcess
+  private signature = ''
+  private nextId = 1
+  private pending = new Map<number, PendingRequest>()
+  private queue: Promise<unknown> = Promise.resolve()
+  private idleTimer?: NodeJS.Timeout
+
+  run(pythonExecutable: string, scriptPath: string, argv: string[]): Promise<LedgerDailyWorkerResult> {
+    const task = this.queue.then(() => this.send(pythonExecutable, scriptPath, argv))
+    this.queue = task.catch(() => undefined)
+    return task
+  }
+
+  stop(): void {
+    if (this.idleTimer) {
+      clearTimeout(this.idleTimer)
+      this.idleTimer = undefined
+    }
+    const subprocess = this.subprocess
+    this.subprocess = undefined
+    if (subprocess && subprocess.exitCode === null) {
+      subprocess.stdin.end(`${JSON.stringify({ id: null, command: 'shutdown' })}\n`)
+    }
+  }
+
+  private send(pythonExecutable: string, scriptPath: string, argv: string[]): Promise<LedgerDailyWorkerResult> {
+    if (this.idleTimer) {
+      clearTimeout(this.idleTimer)
+      this.idleTimer = undefined
+    }
+    const subprocess = this.ensureStarted(pythonExecutable, scriptPath)
+    const id = this.nextId++
+    return new Promise<LedgerDailyWorkerResult>((resolve, reject) => {
+      this.pending.set(id, { resolve, reject })
+      subprocess.stdin.write(`${JSON.stringify({ id, command: 'run', argv })}\n`)
+    }).finally(() => {
+      if (this.pending.size === 0) {
+        this.idleTimer = setTimeout(() => this.stop(), WORKER_IDLE_TIMEOUT_MS)
+      }
+    })
+  }
+
+  private ensureStarted(pythonExecutable: string, scriptPath: string): WorkerProcess {
+    const signature = `${pythonExecutable}\u0000${scriptPath}`
+    if (this.subprocess && this.subprocess.exitCode === null && this.signature === signature) {
+      return this.subprocess
+    }
+    this.stop()
+
+    log.info('启动台账 worker', { pythonExecutable, scriptPath })
+    const subprocess = spawnWorkerProcess(pythonExecutable, scriptPath)
+    this.subprocess = subprocess
+    this.signature = signature
+
+    readline.createInterface({ input: subprocess.stdout }).on('line', (line) => this.onResponse(line))
+    readline.createInterface({ input: subprocess.stderr }).on('line', (line) => log.info(line))
+
+    subprocess
+      .catch((error: unknown) => error)
+      .then((outcome) => {
+        if (this.subprocess === subprocess) {
+          this.subprocess = undefined
+        }
+        const crash = new LedgerDailyWorkerCrashedError(
+          `台账 worker 已退出（退出码 ${subprocess.exitCode ?? '未知'}）`
+        )
+        if (this.pending.size > 0) {
+          log.error('台账 worker 异常退出', { error: outcome })
+        }
+        for (const request of this.pending.values()) {
+          request.reject(crash)
+        }
+        this.pending.clear()
+      })
+
+    return subprocess
+  }
+
+  private onResponse(line: string): void {
+    let response: WorkerResponse
+    try {
+      response = JSON.parse(line) as WorkerResponse
+    } catch {
+      log.warn('无法解析台账 worker 输出', { line })
+      return
+    }
+    if (response.id === null) {
+      return
+    }
+    const request = this.pending.get(response.id)
+    if (!request) {
+      return
+    }
+    this.pending.delete(response.id)
+    if (response.ok && response.result) {
+      const { plan: _plan, ...summary } = response.result
+      log.info('台账 worker 完成', summary)
+      request.resolve(response.result)
+    } else {
+      request.reject(new Error(response.error || '台账 worker 返回未知错误'))
+    }
+  }
+}
+
+export const ledgerDailyWorker = new LedgerDailyWorker()
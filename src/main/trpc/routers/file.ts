@@ -23,6 +23,7 @@ export const fileRouter = router({
         properties: ['openFile'],
         filters: [
           { name: 'Excel 文件', extensions: ['xlsx', 'xls'] },
+          { name: 'CSV / Parquet 文件', extensions: ['csv', 'parquet'] },
           { name: '所有文件', extensions: ['*'] }
         ]
       })